@@ -1,11 +1,37 @@
 import os
 import json
-import textwrap
+import time
 from datetime import datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 
-# OpenAI Python SDK (>=1.0)
-from openai import OpenAI
+from story_auth import QuotaExceeded
+from story_cache import ResponseCache, request_hash
+from story_cascade import (
+    AUTO_MODEL, STATS as CASCADE_STATS, cascaded, days_summary, model_label, report_summary, resolve_model, route,
+)
+from story_dedup import MAX_REROLLS, DuplicateIndex, generate_unique
+from story_history import HistoryStore
+from story_jobs import JobError
+from story_nogo import enforce_no_gos
+from story_metrics import METRICS_PORT, start_metrics_server
+from story_schema import STATS as SCHEMA_STATS
+from story_stream import GenerationCancelled
+from story_variants import MAX_VARIANTS, rank_variants
+from story_client import get_client
+from story_core import (
+    WEEK_MAX_WORKERS, build_day_cfg, expand_week_plan, generate_single_story, generate_week_plan, revise_slide,
+    run_completion_n, story_request,
+)
+from story_ratelimit import get_scheduler
+from story_pdf import pdf_bytes
+from story_render import render_zip
+from story_ui import (
+    jobs_panel, login_gate, measure_rerun, record_rerun, render_cascade_stats, render_duplicates,
+    render_history_panel, render_no_go_report, render_rerun_timings, render_schema_stats, render_user_box,
+    render_variant_picker, session_quota, slide_action_buttons, submit_job,
+)
 
 # -----------------------------
 # App Config
@@ -33,85 +59,56 @@ def get_api_key() -> str:
         key = ""
     return key or os.getenv("OPENAI_API_KEY", "")
 
-def safe_json_loads(text: str):
-    try:
-        return json.loads(text)
-    except Exception:
-        return None
-
-def build_system_prompt():
-    return (
-        "Du bist ein erfahrener Social-Media-Redakteur und Trauma-informierter Content-Stratege "
-        "für einen Instagram-Kanal, der Betroffene von narzisstischem Missbrauch unterstützt. "
-        "Du formulierst empathisch, klar, nicht reißerisch, ohne Diagnosen oder medizinische/therapeutische Anweisungen. "
-        "Du vermeidest gefährliche oder eskalierende Ratschläge (z.B. Konfrontationspläne, Rache, Stalking, Manipulation). "
-        "Du nutzt eine respektvolle Sprache: 'narzisstische Muster', 'emotionaler Missbrauch', 'Kontrolle', 'Gaslighting'. "
-        "Du gibst keine Rechts- oder Therapieanweisungen, sondern alltagstaugliche, sichere Mikro-Schritte und Selbstschutz. "
-        "Wenn sensible Themen vorkommen (Gewalt, Suizid, akute Gefahr), empfiehlst du Hilfe über lokale Notrufnummern/Hotlines. "
-        "Output immer im gewünschten Format als valides JSON."
-    )
-
-def build_user_prompt(cfg: dict) -> str:
-    # Compact but explicit instructions for consistent output
-    return f"""
-Erstelle Instagram-Story-Inhalte in deutscher Sprache für einen Kanal mit Fokus: Hilfe für Betroffene von narzisstischem Missbrauch.
-
-KONFIG:
-- Ziel der Story: {cfg["goal"]}
-- Textart: {cfg["text_type"]}
-- Tonalität: {cfg["tone"]}
-- Phase/Zustand der Zielgruppe: {cfg["stage"]}
-- Hauptthema: {cfg["topic"]}
-- Sensibilität/Trigger: {cfg["sensitivity"]}
-- Länge pro Slide: {cfg["slide_length"]}
-- Anzahl Slides: {cfg["num_slides"]}
-- CTA/Interaktion: {cfg["cta"]}
-- Tabu-Wörter/No-Gos: {cfg["no_gos"]}
-- Optionaler Kontext (Channel-Style, spezielle Situation): {cfg["extra_context"]}
-
-ANFORDERUNGEN:
-1) Liefere ein JSON mit diesem Schema:
-{{
-  "title_hook": "Sehr kurzer Hook (max 8 Wörter)",
-  "slides": [
-    {{
-      "slide_no": 1,
-      "headline": "max 7 Wörter",
-      "body": "max. {cfg["slide_length"]} Zeichen, kurze Zeilen, story-tauglich",
-      "sticker_suggestion": "z.B. Umfrage, Fragen-Sticker, Slider, Quiz",
-      "visual_suggestion": "z.B. Hintergrundidee / Symbolik / Farben"
-    }}
-  ],
-  "caption_variants": [
-    "1-2 Sätze, empathisch, ohne Diagnose, mit CTA",
-    "Alternative"
-  ],
-  "cta_options": [
-    "Kurzer CTA 1",
-    "Kurzer CTA 2",
-    "Kurzer CTA 3"
-  ],
-  "poll_or_question": {{
-    "type": "poll|question|quiz|slider",
-    "prompt": "Text",
-    "options": ["Option A", "Option B"]
-  }},
-  "hashtags": ["max 12, deutsch, thematisch, nicht zu generisch"],
-  "safety_note": "1 Satz: keine Diagnose, bei akuter Gefahr Hilfe holen"
-}}
-
-2) Achte darauf:
-- Keine Täter-Labels/Diagnosen als Fakt. Keine Schuldumkehr. Keine Eskalations-Tipps.
-- Konkrete, sichere Mikro-Schritte (z.B. Grenzen, Dokumentation für sich, Unterstützung suchen, Selbstfürsorge).
-- Variation: nicht jede Slide gleich starten; ein klarer Gedanke pro Slide.
-- Für die Zielgruppe passend: validierend, stärkend, handlungsfähig.
-
-3) Wenn 'Sensibilität/Trigger' hoch ist: sanfter, vorsichtiger Ton, Hinweis auf Unterstützung.
-
-Jetzt generieren.
-""".strip()
-
-def render_story(data: dict):
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    # One SQLite-backed cache per server process, shared by all sessions
+    return ResponseCache()
+
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    # Every generation (cfg, tokens, latency, JSON) in one searchable SQLite file
+    return HistoryStore()
+
+@st.cache_resource
+def get_dedup_index() -> DuplicateIndex:
+    # Near-duplicate index over all hooks/slides/captions; first start indexes the history
+    index = DuplicateIndex()
+    if not index.stats()["texts"]:
+        index.backfill(get_history_store())
+    return index
+
+@st.cache_resource
+def get_metrics_server():
+    # Prometheus /metrics on STORYGEN_METRICS_PORT, one per process (pages/Telemetrie.py shows the same data)
+    return start_metrics_server(METRICS_PORT) if METRICS_PORT else None
+
+def load_from_history(record: dict):
+    data = record["data"]
+    week_stories = [(story, None) for story in data.get("stories", [])]
+    st.session_state.result = {"data": data, "batch_mode": "days" in data, "week_stories": week_stories,
+                               "duplicates": [], "no_gos": ([], []), "cfg": record["cfg"]}
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_export(content_hash, format_type, _data) -> bytes:
+    # One export format of one result, built on first download and then reused.
+    # Keyed by content hash only (_data is not hashed). zip: 1080×1920 PNG per
+    # slide (week plans on the process pool); pdf: briefing, one page per slide / day.
+    if format_type == "zip":
+        return render_zip(_data)
+    if format_type == "pdf":
+        return pdf_bytes(_data)
+    if format_type == "json":
+        return json.dumps(_data, ensure_ascii=False, indent=2).encode("utf-8")
+    return make_export_text(_data).encode("utf-8")
+
+def lazy_export(data: dict, format_type: str):
+    # download_button data: built (and hashed) only when the button is clicked
+    return lambda: get_export(request_hash(data), format_type, data)
+
+def render_story(data: dict, partial: bool = False, actions_key: str = None):
+    # partial=True: story is still streaming, only hook + finished slides.
+    # actions_key: show regenerate/shorten per slide; returns (slide index, action) when clicked
+    clicked = None
     st.subheader("🧩 Story Output")
     st.markdown(f"**Hook:** {data.get('title_hook','')}")
     st.divider()
@@ -126,8 +123,15 @@ def render_story(data: dict):
                 st.write(slide.get("body",""))
                 st.caption(f"Sticker: {slide.get('sticker_suggestion','')}")
                 st.caption(f"Visual: {slide.get('visual_suggestion','')}")
+                if actions_key and not partial:
+                    action = slide_action_buttons(actions_key, i)
+                    if action:
+                        clicked = (i, action)
                 st.divider()
 
+    if partial:
+        return clicked
+
     st.subheader("✍️ Caption-Varianten")
     for c in data.get("caption_variants", []):
         st.write(f"- {c}")
@@ -149,6 +153,20 @@ def render_story(data: dict):
     st.write(" ".join([f"#{h.strip('#')}" for h in data.get("hashtags", [])]))
 
     st.info(data.get("safety_note", "Hinweis: Keine Diagnose. Bei akuter Gefahr bitte Hilfe holen."))
+    return clicked
+
+def submit_slide_revision(result: dict, story_no, index: int, action: str):
+    # Regenerate/shorten one slide of the current result in the job pool (story_no: day of an expanded week)
+    settings = st.session_state.settings
+    day = "" if story_no is None else f"{result['data']['days'][story_no].get('day', f'Tag {story_no + 1}')} · "
+    opts = {"cache": get_response_cache(), "scheduler": get_scheduler(settings["api_key"]),
+            "history": get_history_store(), "quota": session_quota()}
+    submit_job(
+        partial(revise_result_slide, client=get_client(settings["api_key"]), model=resolve_model(settings["model"]),
+                creativity=st.session_state.creativity, cfg=result.get("cfg") or settings["cfg"], result=result,
+                story_no=story_no, index=index, action=action, opts=opts),
+        label=f"{day}Slide {index + 1} {'neu schreiben' if action == 'regenerate' else 'kürzen'}",
+    )
 
 def make_export_text(data: dict) -> str:
     # Simple copy/paste export format
@@ -180,132 +198,481 @@ def make_export_text(data: dict) -> str:
     return "\n".join(lines)
 
 # -----------------------------
-# UI
+# UI Sections (fragments: a widget change only reruns its own section)
 # -----------------------------
-st.title("📲 Instagram Story Generator – Narzissmus-Hilfe")
-st.caption("Erstellt Story-Slides, Captions, Sticker-Ideen & Hashtags per OpenAI API (ohne Diagnosen, trauma-informiert).")
+@st.fragment
+def settings_panel():
+    # Sidebar settings -> st.session_state.settings
+    previous = st.session_state.get("settings")
+    with measure_rerun("Einstellungen"):
+        st.header("⚙️ Einstellungen")
+
+        api_key = get_api_key()
+        if not api_key:
+            api_key = st.text_input("OpenAI API Key (Session)", type="password", help="Wird nicht gespeichert – nur für die aktuelle Session.")
+        model = st.selectbox(
+            "Modell",
+            options=[AUTO_MODEL, "gpt-4o-mini", "gpt-4o", "gpt-4.1-mini", "gpt-4.1"],
+            index=0,
+            format_func=model_label,
+            help="Automatisch: erst das günstige Modell; nur Stories/Slides, die die lokale Prüfung "
+                 "(Schema, Länge, Tabu-Wörter, Wiederholungen) nicht bestehen, schreibt das größere neu."
+        )
+        force_fresh = st.checkbox(
+            "Cache umgehen (frisch generieren)",
+            value=False,
+            help="Gleiche Einstellungen liefern sonst die gespeicherte Antwort sofort und ohne Kosten."
+        )
+        repair_no_gos = st.checkbox(
+            "Tabu-Wörter automatisch ersetzen",
+            value=True,
+            help="Nur die betroffenen Slides/Felder werden neu formuliert, nicht die ganze Story."
+        )
+        reroll_duplicates = st.checkbox(
+            "Wiederholungen neu generieren",
+            value=False,
+            help="Ähnelt Hook/Slide/Caption einer früheren Story, wird bis zu 2× neu generiert. Sonst nur Hinweis."
+        )
 
-api_key = get_api_key()
+        st.divider()
+        st.subheader("🧠 Inhaltliche Vorauswahl")
+
+        goal = st.selectbox(
+            "Ziel der Story",
+            [
+                "Validierung & Entlastung (Du bist nicht verrückt)",
+                "Aufklärung (Muster erkennen: Gaslighting, Silent Treatment, Triangulation)",
+                "Selbstschutz (Grenzen, Abstand, No-Contact/Low-Contact Prinzipien ohne Anleitung zur Eskalation)",
+                "Stärkung (Selbstwert, innere Klarheit, Identität zurückholen)",
+                "Community & Interaktion (Umfrage/Frage/DM-Trigger)",
+                "Motivation (Mut machen, kleine Schritte)",
+                "Mythen brechen (z.B. 'Wenn ich mich nur besser erkläre…')",
+            ],
+            index=0
+        )
 
-with st.sidebar:
-    st.header("⚙️ Einstellungen")
-
-    if not api_key:
-        api_key = st.text_input("OpenAI API Key (Session)", type="password", help="Wird nicht gespeichert – nur für die aktuelle Session.")
-    model = st.selectbox(
-        "Modell",
-        options=["gpt-4o-mini", "gpt-4o", "gpt-4.1-mini", "gpt-4.1"],
-        index=0,
-        help="Wenn du Kosten drücken willst: mini. Wenn du maximalen Feinschliff willst: gpt-4o / 4.1."
-    )
+        text_type = st.selectbox(
+            "Art des Textes",
+            [
+                "Sprüche / One-Liner (Punchy, kurz)",
+                "Mini-Carousel in Story (3–7 Slides, logisch aufgebaut)",
+                "Checkliste (Warnsignale / Red Flags)",
+                "Reframe (Gedanken umdrehen: Schuld → Klarheit)",
+                "Übung / Mikro-Schritt (2 Minuten, sicher)",
+                "Grenzsatz-Vorlagen (kommunikativ, nicht eskalierend)",
+                "Story-Quiz (Mythos vs Fakt / Erkennen von Mustern)",
+            ],
+            index=1
+        )
 
-    st.divider()
-    st.subheader("🧠 Inhaltliche Vorauswahl")
-
-    goal = st.selectbox(
-        "Ziel der Story",
-        [
-            "Validierung & Entlastung (Du bist nicht verrückt)",
-            "Aufklärung (Muster erkennen: Gaslighting, Silent Treatment, Triangulation)",
-            "Selbstschutz (Grenzen, Abstand, No-Contact/Low-Contact Prinzipien ohne Anleitung zur Eskalation)",
-            "Stärkung (Selbstwert, innere Klarheit, Identität zurückholen)",
-            "Community & Interaktion (Umfrage/Frage/DM-Trigger)",
-            "Motivation (Mut machen, kleine Schritte)",
-            "Mythen brechen (z.B. 'Wenn ich mich nur besser erkläre…')",
-        ],
-        index=0
-    )
+        tone = st.selectbox(
+            "Tonalität",
+            ["Sehr empathisch & sanft", "Klar & direkt (ohne hart zu sein)", "Mutmachend & hoffnungsvoll", "Faktenorientiert & ruhig"],
+            index=1
+        )
 
-    text_type = st.selectbox(
-        "Art des Textes",
-        [
-            "Sprüche / One-Liner (Punchy, kurz)",
-            "Mini-Carousel in Story (3–7 Slides, logisch aufgebaut)",
-            "Checkliste (Warnsignale / Red Flags)",
-            "Reframe (Gedanken umdrehen: Schuld → Klarheit)",
-            "Übung / Mikro-Schritt (2 Minuten, sicher)",
-            "Grenzsatz-Vorlagen (kommunikativ, nicht eskalierend)",
-            "Story-Quiz (Mythos vs Fakt / Erkennen von Mustern)",
-        ],
-        index=1
-    )
+        stage = st.selectbox(
+            "Phase/Zustand der Zielgruppe",
+            [
+                "Noch drin / verwirrt / Selbstzweifel",
+                "Trennung läuft / emotional instabil",
+                "No-Contact/Abstand / Stabilisierung",
+                "Rückfallgefahr / Trauma-Bond / Sehnsucht",
+                "Heilung & Neuaufbau / Identität",
+            ],
+            index=0
+        )
 
-    tone = st.selectbox(
-        "Tonalität",
-        ["Sehr empathisch & sanft", "Klar & direkt (ohne hart zu sein)", "Mutmachend & hoffnungsvoll", "Faktenorientiert & ruhig"],
-        index=1
-    )
+        topic = st.selectbox(
+            "Hauptthema",
+            [
+                "Gaslighting",
+                "Silent Treatment / Entzug",
+                "Love Bombing → Abwertung",
+                "Triangulation (Dritte ins Spiel bringen)",
+                "Schuldumkehr & Projektion",
+                "Grenzen setzen ohne Rechtfertigen",
+                "Trauma Bond / Suchtgefühl",
+                "Co-Abhängigkeit / People-Pleasing",
+                "Eifersucht & Kontrolle",
+                "Aftermath: Selbstwert & Vertrauen",
+            ],
+            index=0
+        )
 
-    stage = st.selectbox(
-        "Phase/Zustand der Zielgruppe",
-        [
-            "Noch drin / verwirrt / Selbstzweifel",
-            "Trennung läuft / emotional instabil",
-            "No-Contact/Abstand / Stabilisierung",
-            "Rückfallgefahr / Trauma-Bond / Sehnsucht",
-            "Heilung & Neuaufbau / Identität",
-        ],
-        index=0
-    )
+        sensitivity = st.selectbox(
+            "Sensibilität/Trigger",
+            ["Niedrig", "Mittel", "Hoch (sehr vorsichtig formulieren)"],
+            index=1
+        )
 
-    topic = st.selectbox(
-        "Hauptthema",
-        [
-            "Gaslighting",
-            "Silent Treatment / Entzug",
-            "Love Bombing → Abwertung",
-            "Triangulation (Dritte ins Spiel bringen)",
-            "Schuldumkehr & Projektion",
-            "Grenzen setzen ohne Rechtfertigen",
-            "Trauma Bond / Suchtgefühl",
-            "Co-Abhängigkeit / People-Pleasing",
-            "Eifersucht & Kontrolle",
-            "Aftermath: Selbstwert & Vertrauen",
-        ],
-        index=0
-    )
+        slide_length = st.select_slider(
+            "Länge pro Slide (Zeichen)",
+            options=[120, 160, 220, 300],
+            value=160
+        )
 
-    sensitivity = st.selectbox(
-        "Sensibilität/Trigger",
-        ["Niedrig", "Mittel", "Hoch (sehr vorsichtig formulieren)"],
-        index=1
-    )
+        num_slides = st.slider("Anzahl Slides", min_value=3, max_value=10, value=6, step=1)
+
+        cta = st.selectbox(
+            "CTA / Interaktion",
+            [
+                "Frage-Sticker: 'Was war dein Aha-Moment?'",
+                "Umfrage: 'Kennst du das?'",
+                "DM-Trigger: 'Schreib mir 'KLARHEIT' für…'",
+                "Speichern/Teilen: 'Speicher dir das für schlechte Tage'",
+                "Quiz: Mythos vs Fakt",
+                "Kein CTA (nur Validierung)",
+            ],
+            index=2
+        )
 
-    slide_length = st.select_slider(
-        "Länge pro Slide (Zeichen)",
-        options=[120, 160, 220, 300],
-        value=160
-    )
+        no_gos = st.text_input(
+            "Tabu-Wörter/No-Gos (kommagetrennt)",
+            value="diagnose, narzisst, narzisstin, psychopat, rache, konfrontiere ihn, konfrontiere sie"
+        )
 
-    num_slides = st.slider("Anzahl Slides", min_value=3, max_value=10, value=6, step=1)
-
-    cta = st.selectbox(
-        "CTA / Interaktion",
-        [
-            "Frage-Sticker: 'Was war dein Aha-Moment?'",
-            "Umfrage: 'Kennst du das?'",
-            "DM-Trigger: 'Schreib mir 'KLARHEIT' für…'",
-            "Speichern/Teilen: 'Speicher dir das für schlechte Tage'",
-            "Quiz: Mythos vs Fakt",
-            "Kein CTA (nur Validierung)",
-        ],
-        index=2
-    )
+        extra_context = st.text_area(
+            "Optionaler Kontext (dein Stil / Worte, die du oft nutzt)",
+            placeholder="z.B. 'kurze Zeilen', 'du-form', 'klarer Abschluss pro Slide', 'mehr Hoffnung', 'kein Drama'..."
+        )
 
-    no_gos = st.text_input(
-        "Tabu-Wörter/No-Gos (kommagetrennt)",
-        value="diagnose, narzisst, narzisstin, psychopat, rache, konfrontiere ihn, konfrontiere sie"
-    )
+        st.divider()
+        st.subheader("📅 Batch-Mode")
+        batch_mode = st.toggle("7 Story-Ideen auf einmal (Wochenplan)", value=False)
+        st.caption("Wenn aktiv: du bekommst 7 kompakte Story-Konzepte statt 1 fertige Story.")
+        streaming = st.toggle(
+            "Live-Streaming (Slides sofort anzeigen)",
+            value=True,
+            help="Zeigt jede Slide, sobald sie fertig generiert ist (nur Einzel-Story)."
+        )
+        expand_week = st.toggle(
+            "Alle Tage direkt als fertige Stories ausarbeiten",
+            value=False,
+            disabled=not batch_mode,
+            help="Nach dem Wochenplan werden alle Tage parallel zu kompletten Stories ausgearbeitet."
+        )
+        variants = st.slider(
+            "Varianten pro Klick",
+            1, MAX_VARIANTS, 1,
+            disabled=batch_mode,
+            help="Mehrere Stories in einer Anfrage (Prompt wird nur einmal berechnet), lokal gerankt. "
+                 "Kein Live-Streaming."
+        )
 
-    extra_context = st.text_area(
-        "Optionaler Kontext (dein Stil / Worte, die du oft nutzt)",
-        placeholder="z.B. 'kurze Zeilen', 'du-form', 'klarer Abschluss pro Slide', 'mehr Hoffnung', 'kein Drama'..."
-    )
+        st.session_state.settings = {
+            "api_key": api_key,
+            "model": model,
+            "force_fresh": force_fresh,
+            "repair_no_gos": repair_no_gos,
+            "reroll_duplicates": reroll_duplicates,
+            "batch_mode": batch_mode,
+            "streaming": streaming,
+            "expand_week": expand_week,
+            "variants": variants,
+            "cfg": {
+                "goal": goal,
+                "text_type": text_type,
+                "tone": tone,
+                "stage": stage,
+                "topic": topic,
+                "sensitivity": sensitivity,
+                "slide_length": slide_length,
+                "num_slides": num_slides,
+                "cta": cta,
+                "no_gos": no_gos,
+                "extra_context": extra_context.strip(),
+            },
+        }
+    # Entering the key unlocks the main page, which lives outside this fragment
+    if previous is not None and bool(previous["api_key"]) != bool(api_key):
+        st.rerun()
+
+@st.fragment
+def creativity_control():
+    with measure_rerun("Kreativität"):
+        st.slider("Kreativität", 0.0, 1.0, 0.6, 0.05, key="creativity",
+                  help="0 = sehr nüchtern, 1 = mehr Variation/Metaphern")
+
+@st.fragment
+def output_panel():
+    # Last result from st.session_state.result; survives reruns of the other sections
+    result = st.session_state.get("result")
+    if not result:
+        return
+    with measure_rerun("Output"):
+        if len(result.get("variants") or []) > 1:
+            choice = render_variant_picker(result["variants"], result["variant"], key="variant_choice")
+            if choice != result["variant"]:
+                variant = result["variants"][choice]
+                result.update(data=variant["data"], variant=choice, duplicates=[],
+                              no_gos=(variant["no_go_hits"], []))
+                st.rerun()  # full rerun: exports follow the chosen variant
+        data, week_stories = result["data"], result["week_stories"]
+        for warning in result.get("warnings", []):
+            st.warning(warning)
+        if result.get("cascade"):
+            st.caption(report_summary(result["cascade"]))
+        if result.get("day_cascade"):
+            st.caption(days_summary(result["day_cascade"]))
+        render_no_go_report(*result.get("no_gos", ([], [])))
+        render_duplicates(result.get("duplicates"))
+        if result["batch_mode"]:
+            st.subheader("📅 Wochenplan (7 Story-Ideen)")
+            st.markdown(f"**Wochenthema:** {data.get('week_theme','')}")
+            for d in data.get("days", []):
+                with st.expander(f"{d.get('day','Tag')} – {d.get('hook','')}"):
+                    st.write(f"**Ziel:** {d.get('goal','')}")
+                    st.write(f"**Thema:** {d.get('topic','')}")
+                    st.write("**Slides Outline:**")
+                    for s in d.get("slides_outline", []):
+                        st.write(f"- {s}")
+                    st.write(f"**Interaktion:** {d.get('interaction','')}")
+                    st.write(f"**CTA:** {d.get('cta','')}")
+            st.info(data.get("safety_note", "Keine Diagnose. Bei akuter Gefahr Hilfe holen."))
+
+            if week_stories:
+                st.subheader("📚 Ausgearbeitete Stories")
+                tabs = st.tabs([d.get("day", f"Tag {i+1}") for i, d in enumerate(data.get("days", []))])
+                day_no_gos = result.get("day_no_gos") or []
+                for day_no, (tab, (story, story_raw)) in enumerate(zip(tabs, week_stories)):
+                    with tab:
+                        if day_no < len(day_no_gos):
+                            render_no_go_report(*day_no_gos[day_no])
+                        if story:
+                            clicked = render_story(story, actions_key=f"day{day_no}")
+                            if clicked:
+                                submit_slide_revision(result, day_no, *clicked)
+                                st.rerun()  # full rerun: the jobs panel shows the revision
+                        else:
+                            st.error("Diese Story konnte nicht generiert werden.")
+                            st.code(story_raw)
+        else:
+            clicked = render_story(data, actions_key="story")
+            if clicked:
+                submit_slide_revision(result, None, *clicked)
+                st.rerun()  # full rerun: the jobs panel shows the revision
+
+@st.fragment
+def export_panel():
+    # Download buttons; clicking one only reruns this fragment
+    result = st.session_state.get("result")
+    if not result:
+        return
+    with measure_rerun("Export"):
+        data = result["data"]
+        if result["batch_mode"]:
+            st.download_button(
+                "⬇️ Export (JSON)",
+                data=lazy_export(data, "json"),
+                file_name=f"ig_story_weekplan_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
+                mime="application/json",
+                use_container_width=True
+            )
+
+            st.download_button(
+                "📑 Briefing (PDF)",
+                data=lazy_export(data, "pdf"),
+                file_name=f"ig_story_weekplan_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
+                mime="application/pdf",
+                use_container_width=True
+            )
+
+            if data.get("stories"):
+                st.download_button(
+                    "🖼️ Alle Slides (PNG, ZIP)",
+                    data=lazy_export(data, "zip"),
+                    file_name=f"ig_story_weekplan_slides_{datetime.now().strftime('%Y%m%d_%H%M')}.zip",
+                    mime="application/zip",
+                    use_container_width=True
+                )
+        else:
+            st.download_button(
+                "⬇️ Export (TXT)",
+                data=lazy_export(data, "txt"),
+                file_name=f"ig_story_{datetime.now().strftime('%Y%m%d_%H%M')}.txt",
+                mime="text/plain",
+                use_container_width=True
+            )
+
+            st.download_button(
+                "⬇️ Export (JSON)",
+                data=lazy_export(data, "json"),
+                file_name=f"ig_story_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
+                mime="application/json",
+                use_container_width=True
+            )
+
+            st.download_button(
+                "📑 Briefing (PDF)",
+                data=lazy_export(data, "pdf"),
+                file_name=f"ig_story_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
+                mime="application/pdf",
+                use_container_width=True
+            )
+
+            if data.get("slides"):
+                st.download_button(
+                    "🖼️ Slides (PNG, ZIP)",
+                    data=lazy_export(data, "zip"),
+                    file_name=f"ig_story_slides_{datetime.now().strftime('%Y%m%d_%H%M')}.zip",
+                    mime="application/zip",
+                    use_container_width=True
+                )
 
-    st.divider()
-    st.subheader("📅 Batch-Mode")
-    batch_mode = st.toggle("7 Story-Ideen auf einmal (Wochenplan)", value=False)
-    st.caption("Wenn aktiv: du bekommst 7 kompakte Story-Konzepte statt 1 fertige Story.")
+# -----------------------------
+# Generation (background job)
+# -----------------------------
+def generate_result(job, client, model, creativity, cfg, settings, gen_opts, index):
+    """
+    One click of "Story generieren" as a story_jobs function (pool thread, no
+    st.* here): story / variants / week plan, no-go repair, week expansion.
+    Streamed slides and the week progress go to job.update(). Returns the
+    st.session_state.result dict; a cancelled story keeps the slides it has.
+    model "auto" routes the story / week plan through story_cascade.
+    """
+    gen_opts = dict(gen_opts, cancel=job.cancel_event)
+    auto, model = model == AUTO_MODEL, resolve_model(model)
+    cascade, day_reports = None, []
+    batch_mode = settings["batch_mode"]
+    # Checked against earlier hooks/slides/captions; re-rolled if enabled
+    dedup_opts = {"index": index, "rerolls": MAX_REROLLS if settings["reroll_duplicates"] else 0}
+    variants = []
+    if settings["variants"] > 1 and not batch_mode:
+        # One request with n choices; ranked locally, the best one is shown first
+        candidates = run_completion_n(
+            client, story_request(model, creativity, cfg), settings["variants"],
+            scheduler=gen_opts["scheduler"], history=gen_opts["history"], quota=gen_opts["quota"],
+            cancel=job.cancel_event, meta={"kind": "story", "cfg": cfg},
+        )
+        variants = rank_variants(candidates, cfg, index=index)
+        data, raw = variants[0]["data"], variants[0]["raw"]
+        duplicates = index.check(data) if data else []
+        if data:
+            index.add(data, topic=cfg["topic"])
+    elif batch_mode and auto:
+        data, raw, cascade = route(generate_week_plan, client, creativity, cfg, index=index, schema="week_plan",
+                                   **gen_opts)
+        duplicates = cascade["duplicates"]
+    elif batch_mode:
+        data, raw, duplicates = generate_unique(generate_week_plan, client, model, creativity, cfg,
+                                                **dedup_opts, **gen_opts)
+    else:
+        on_update = (lambda partial_data: job.update(partial=partial_data)) if settings["streaming"] else None
+        try:
+            if auto:
+                data, raw, cascade = route(generate_single_story, client, creativity, cfg, index=index,
+                                           on_update=on_update, **gen_opts)
+                duplicates = cascade["duplicates"]
+            else:
+                data, raw, duplicates = generate_unique(generate_single_story, client, model, creativity, cfg,
+                                                        on_update=on_update, **dedup_opts, **gen_opts)
+        except GenerationCancelled as e:
+            if not (e.partial or {}).get("slides"):
+                raise
+            data, raw, duplicates = e.partial, e.text, []
+
+    if not data:
+        raise JobError("Konnte JSON nicht sauber lesen. Unten ist die Roh-Ausgabe (du kannst sie manuell prüfen).",
+                       detail=raw)
+
+    # No-go terms: rewrite only the offending slides/fields
+    warnings = []
+    try:
+        repair = settings["repair_no_gos"] and not job.cancel_event.is_set()
+        data, no_go_hits, repaired = enforce_no_gos(client, model, creativity, cfg, data, repair=repair, **gen_opts)
+    except (QuotaExceeded, GenerationCancelled) as e:
+        warnings.append(f"Tabu-Wörter nicht neu formuliert: {e}")
+        data, no_go_hits, repaired = enforce_no_gos(client, model, creativity, cfg, data, repair=False)
+    if variants:
+        variants[0]["data"], variants[0]["no_go_hits"] = data, no_go_hits
+
+    week_stories, day_no_gos = [], []
+    if batch_mode and settings["expand_week"] and data.get("days") and not job.cancel_event.is_set():
+        job.update(progress=(0.0, "Arbeite alle Tage parallel aus…"))
+        week_stories = expand_week_plan(
+            client, model, creativity, cfg, data,
+            progress=lambda done, total: job.update(progress=(done / total, f"{done}/{total} Stories fertig")),
+            generate=cascaded(generate_single_story, reports=day_reports) if auto else generate_single_story,
+            **gen_opts
+        )
+        # The day stories get the same no-go check / repair as the plan
+        repair = settings["repair_no_gos"] and not job.cancel_event.is_set()
+        with ThreadPoolExecutor(max_workers=WEEK_MAX_WORKERS) as pool:
+            checked = list(pool.map(
+                lambda day, story: enforce_day_no_gos(client, model, creativity, cfg, day, story, repair,
+                                                      warnings, gen_opts),
+                data["days"], [story for story, _ in week_stories],
+            ))
+        week_stories = [(story, raw) for (story, _, _), (_, raw) in zip(checked, week_stories)]
+        day_no_gos = [(hits, day_repaired) for _, hits, day_repaired in checked]
+        data["stories"] = [story for story, _ in week_stories]
+        for story in data["stories"]:
+            if story:
+                index.add(story, topic=cfg["topic"])
+
+    return {"data": data, "batch_mode": batch_mode, "week_stories": week_stories,
+            "duplicates": duplicates, "no_gos": (no_go_hits, repaired), "day_no_gos": day_no_gos, "cfg": cfg,
+            "variants": variants, "variant": 0, "warnings": warnings, "cascade": cascade,
+            "day_cascade": day_reports}
+
+def enforce_day_no_gos(client, model, creativity, cfg, day, story, repair, warnings, gen_opts):
+    # No-go check / repair of one expanded day story: (story, hits, repaired)
+    if not story:
+        return story, [], []
+    day_cfg = build_day_cfg(cfg, day)
+    try:
+        return enforce_no_gos(client, model, creativity, day_cfg, story, repair=repair, **gen_opts)
+    except (QuotaExceeded, GenerationCancelled) as e:
+        warnings.append(f"{day.get('day', 'Tag')}: Tabu-Wörter nicht neu formuliert: {e}")
+        return enforce_no_gos(client, model, creativity, day_cfg, story, repair=False)
+
+def revise_result_slide(job, client, model, creativity, cfg, result, story_no, index, action, opts):
+    """
+    Slide regenerate / shorten as a story_jobs function: returns a copy of
+    result with the revised slide (applied like a new generation).
+    """
+    data = result["data"]
+    story = data if story_no is None else data["stories"][story_no]
+    if story_no is not None:
+        cfg = build_day_cfg(cfg, data["days"][story_no])
+    story, _ = revise_slide(client, model, creativity, cfg, story, index, action, cancel=job.cancel_event, **opts)
+    result = dict(result)
+    if story_no is None:
+        result["data"] = story
+        if result.get("variants"):
+            result["variants"] = [dict(v) for v in result["variants"]]
+            result["variants"][result["variant"]]["data"] = story
+    else:
+        stories = list(data["stories"])
+        stories[story_no] = story
+        result["data"] = {**data, "stories": stories}
+        result["week_stories"] = [(s, None) for s in stories]
+    return result
+
+# -----------------------------
+# UI
+# -----------------------------
+run_started = time.perf_counter()
+get_metrics_server()
+# Accounts (story_auth): login form until the session has a valid token; open mode without accounts
+login_gate()
+
+st.title("📲 Instagram Story Generator – Narzissmus-Hilfe")
+st.caption("Erstellt Story-Slides, Captions, Sticker-Ideen & Hashtags per OpenAI API (ohne Diagnosen, trauma-informiert).")
+
+with st.sidebar:
+    render_user_box()
+    settings_panel()
+    render_rerun_timings()
+    render_schema_stats(SCHEMA_STATS.snapshot())
+    render_cascade_stats(CASCADE_STATS.snapshot())
+
+settings = st.session_state.settings
+api_key = settings["api_key"]
+model = settings["model"]
+batch_mode = settings["batch_mode"]
+cfg = settings["cfg"]
 
 # -----------------------------
 # Main Actions
@@ -314,20 +681,16 @@ if not api_key:
     st.warning("Bitte API-Key in der Sidebar setzen (oder via OPENAI_API_KEY / Streamlit Secrets).")
     st.stop()
 
-client = OpenAI(api_key=api_key)
-
-cfg = {
-    "goal": goal,
-    "text_type": text_type,
-    "tone": tone,
-    "stage": stage,
-    "topic": topic,
-    "sensitivity": sensitivity,
-    "slide_length": slide_length,
-    "num_slides": num_slides,
-    "cta": cta,
-    "no_gos": no_gos,
-    "extra_context": extra_context.strip(),
+# Pooled client shared by all sessions with this key (see story_client)
+client = get_client(api_key)
+gen_opts = {
+    "cache": get_response_cache(),
+    "force_fresh": settings["force_fresh"],
+    # RPM/TPM budgeting + retries, shared by everyone on this key
+    "scheduler": get_scheduler(api_key),
+    "history": get_history_store(),
+    # Charged to the logged-in user's daily token/request quota
+    "quota": session_quota(),
 }
 
 colA, colB = st.columns([1, 1])
@@ -336,125 +699,34 @@ with colA:
     generate = st.button("✨ Story generieren", type="primary", use_container_width=True)
 
 with colB:
-    creativity = st.slider("Kreativität", 0.0, 1.0, 0.6, 0.05, help="0 = sehr nüchtern, 1 = mehr Variation/Metaphern")
+    creativity_control()
+creativity = st.session_state.creativity
 
 st.divider()
 
-def generate_single_story():
-    user_prompt = build_user_prompt(cfg)
-
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=creativity,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": build_system_prompt()},
-            {"role": "user", "content": user_prompt},
-        ],
-    )
-    text = resp.choices[0].message.content or "{}"
-    data = safe_json_loads(text)
-    return data, text
-
-def generate_week_plan():
-    plan_prompt = f"""
-Erstelle einen 7-Tage-Plan für Instagram Stories (deutsch) für einen Kanal: Hilfe bei narzisstischem Missbrauch.
-
-Konfiguration:
-- Zielgruppe/Phase: {cfg["stage"]}
-- Tonalität: {cfg["tone"]}
-- Fokus-Themen (rotierend): Gaslighting, Grenzen, Trauma Bond, Selbstwert, Kontrolle, Schuldumkehr, Heilung
-- CTA-Stil: {cfg["cta"]}
-- No-Gos: {cfg["no_gos"]}
-- Optionaler Kontext: {cfg["extra_context"]}
-
-Liefere valides JSON im Schema:
-{{
-  "week_theme": "Titel",
-  "days": [
-    {{
-      "day": "Tag 1",
-      "goal": "Ziel",
-      "topic": "Thema",
-      "hook": "max 8 Wörter",
-      "slides_outline": ["Slide1 Idee", "Slide2 Idee", "Slide3 Idee", "… max 6"],
-      "interaction": "Umfrage/Frage/Quiz/Slider Vorschlag",
-      "cta": "kurzer CTA"
-    }}
-  ],
-  "safety_note": "1 Satz"
-}}
-""".strip()
-
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=creativity,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": build_system_prompt()},
-            {"role": "user", "content": plan_prompt},
-        ],
-    )
-    text = resp.choices[0].message.content or "{}"
-    data = safe_json_loads(text)
-    return data, text
-
 if generate:
-    with st.spinner("Generiere Content…"):
-        if batch_mode:
-            data, raw = generate_week_plan()
-        else:
-            data, raw = generate_single_story()
+    # Runs in the job pool: widget changes and reloads no longer abort it (story_jobs)
+    kind = "Wochenplan" if batch_mode else f"{settings['variants']} Varianten" if settings["variants"] > 1 else "Story"
+    submit_job(
+        partial(generate_result, client=client, model=model, creativity=creativity, cfg=dict(cfg),
+                settings=dict(settings), gen_opts=gen_opts, index=get_dedup_index()),
+        label=f"{kind} · {cfg['topic']}",
+    )
 
-    if not data:
-        st.error("Konnte JSON nicht sauber lesen. Unten ist die Roh-Ausgabe (du kannst sie manuell prüfen).")
-        st.code(raw)
-        st.stop()
-
-    if batch_mode:
-        st.subheader("📅 Wochenplan (7 Story-Ideen)")
-        st.markdown(f"**Wochenthema:** {data.get('week_theme','')}")
-        for d in data.get("days", []):
-            with st.expander(f"{d.get('day','Tag')} – {d.get('hook','')}"):
-                st.write(f"**Ziel:** {d.get('goal','')}")
-                st.write(f"**Thema:** {d.get('topic','')}")
-                st.write("**Slides Outline:**")
-                for s in d.get("slides_outline", []):
-                    st.write(f"- {s}")
-                st.write(f"**Interaktion:** {d.get('interaction','')}")
-                st.write(f"**CTA:** {d.get('cta','')}")
-        st.info(data.get("safety_note", "Keine Diagnose. Bei akuter Gefahr Hilfe holen."))
-        export_text = json.dumps(data, ensure_ascii=False, indent=2)
-        st.download_button(
-            "⬇️ Export (JSON)",
-            data=export_text.encode("utf-8"),
-            file_name=f"ig_story_weekplan_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
-            mime="application/json",
-            use_container_width=True
-        )
-    else:
-        render_story(data)
-
-        export_text = make_export_text(data)
-        st.download_button(
-            "⬇️ Export (TXT)",
-            data=export_text.encode("utf-8"),
-            file_name=f"ig_story_{datetime.now().strftime('%Y%m%d_%H%M')}.txt",
-            mime="text/plain",
-            use_container_width=True
-        )
+jobs_panel(lambda result: st.session_state.update(result=result),
+           render_partial=lambda data: render_story(data, partial=True))
 
-        st.download_button(
-            "⬇️ Export (JSON)",
-            data=json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"),
-            file_name=f"ig_story_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
-            mime="application/json",
-            use_container_width=True
-        )
+output_panel()
+export_panel()
 
 st.divider()
+with st.expander("🗂️ Verlauf"):
+    render_history_panel(get_history_store(), load_from_history)
+
 with st.expander("ℹ️ Sicherheit & Verantwortung (kurz)"):
     st.write(
         "Diese App generiert Social-Media-Content und ersetzt keine Beratung, Therapie oder rechtliche Einschätzung. "
         "Bitte vermeide Diagnosen/Labels als Tatsachen. Bei akuter Gefahr: lokale Notrufnummern kontaktieren."
-    )
\ No newline at end of file
+    )
+
+record_rerun("App", run_started)
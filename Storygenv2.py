@@ -1,9 +1,29 @@
 import os
 import json
-import textwrap
 from datetime import datetime
+from functools import partial
 import streamlit as st
-from openai import OpenAI
+
+from story_cache import ResponseCache, request_hash
+from story_cascade import AUTO_MODEL, STATS as CASCADE_STATS, model_label, report_summary, resolve_model, route
+from story_dedup import MAX_REROLLS, DuplicateIndex, generate_unique
+from story_history import HistoryStore
+from story_nogo import enforce_no_gos
+from story_metrics import METRICS_PORT, REGISTRY as METRICS_REGISTRY, start_metrics_server
+from story_schema import STATS as SCHEMA_STATS
+from story_variants import MAX_VARIANTS, rank_variants
+from story_client import get_client
+from story_core import generate_viral_story, revise_slide, run_completion_n, viral_request
+from story_jobs import JobError
+from story_stream import GenerationCancelled
+from story_ratelimit import get_scheduler
+from story_pdf import pdf_bytes
+from story_render import render_zip
+from story_ui import (
+    jobs_panel, login_gate, measure_rerun, render_cascade_stats, render_duplicates, render_history_panel,
+    render_no_go_report, render_rerun_timings, render_metrics_summary, render_schema_stats, render_user_box,
+    render_variant_picker, session_quota, slide_action_buttons, submit_job,
+)
 
 # -----------------------------
 # App Config
@@ -34,124 +54,34 @@ def get_api_key() -> str:
 def get_available_models():
     """Return available models"""
     return {
+        "Automatisch": [AUTO_MODEL],
         "Kosteneffizient": ["gpt-4o-mini", "gpt-4.1-mini"],
         "Hochwertig": ["gpt-4o", "gpt-4.1"],
         "Schnell": ["gpt-3.5-turbo"]
     }
 
-def safe_json_loads(text: str):
-    """Robust JSON parsing with fallback"""
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        # Try to extract JSON from markdown code blocks
-        import re
-        json_match = re.search(r'```(?:json)?\n?(.*?)\n?```', text, re.DOTALL)
-        if json_match:
-            try:
-                return json.loads(json_match.group(1))
-            except:
-                pass
-        return None
+@st.cache_resource
+def get_response_cache():
+    """Process-wide on-disk response cache (shared by all sessions)"""
+    return ResponseCache()
 
-# -----------------------------
-# Enhanced Prompts
-# -----------------------------
-def build_system_prompt():
-    return textwrap.dedent("""
-    Du bist ein hochkarätiger Social-Media-Content-Spezialist mit Expertise in Trauma-informierter Kommunikation.
-    
-    DEINE ROLLE:
-    - Erstellst viralen, hoch-engagierenden Content für Instagram Stories
-    - Formulierst sofort süchtig machende Hooks & emotional packende Texte
-    - Nutzt psychologische Trigger für maximale Interaktion (Neugier, Identifikation, Empowerment)
-    - Bleibst absolut sicher: Keine Diagnosen, keine Eskalationstipps
-    
-    DEINE SUPER-SKILLS:
-    🔥 EMOTIONAL HOOKS: Jede Story beginnt mit einem "Aha-Moment"
-    💥 SCROLL-STOPPER: Texte, die zum Stehenbleiben zwingen
-    📈 ENGAGEMENT-BOOSTER: Fragen, die zur Interaktion einladen
-    🎯 ZIELGRUPPEN-TREFFER: Exakt auf Phase & Bedürfnisse abgestimmt
-    
-    FORMAT-RICHTLINIEN:
-    - Jede Slide hat einen klaren Mehrwert
-    - Emotionale Achterbahn: Problem → Einsicht → Lösung → Aktion
-    - Storytelling mit persönlicher Note (ohne zu privat zu sein)
-    - Zahlen, Emojis und kurze Zeilen für bessere Lesbarkeit
-    
-    SICHERHEIT:
-    - Sprache: "narzisstische Dynamiken", "toxische Muster", "emotionaler Schutz"
-    - Immer empowernd, nie entmündigend
-    - Bei Hoch-Sensibilität: Sanfter Ton + Hilfsangebote
-    """).strip()
+@st.cache_resource
+def get_history_store():
+    """Process-wide generation history (searchable, exportable)"""
+    return HistoryStore()
+
+@st.cache_resource
+def get_metrics_server():
+    """Prometheus /metrics endpoint on STORYGEN_METRICS_PORT (one per process, off if unset)"""
+    return start_metrics_server(METRICS_PORT) if METRICS_PORT else None
 
-def build_viral_prompt_template(cfg: dict) -> str:
-    """Optimized prompt for viral content"""
-    return textwrap.dedent(f"""
-    ERSTELLE VIRALE INSTAGRAM-STORY CONTENT mit maximalem Engagement-Potential!
-    
-    🔥 VIRALE STRATEGIE:
-    - Slide 1: EMOTIONALER HOOK (muss zum Weiterscrollen zwingen)
-    - Slide 2-3: PROBLEM-VERSTÄNDNIS (Identifikation schaffen)
-    - Slide 4-5: LÖSUNGS-IMPULS (klarer Mehrwert)
-    - Slide 6+: INTERAKTIONS-PUSH (Community-Bindung)
-    
-    📊 CONTENT-KONFIGURATION:
-    • Ziel: {cfg["goal"]} + Engagement-Boost
-    • Format: {cfg["text_type"]} 
-    • Ton: {cfg["tone"]} + emotionale Tiefe
-    • Zielgruppe: {cfg["stage"]} (genau treffen!)
-    • Fokus: {cfg["topic"]}
-    • Sensibilität: {cfg["sensitivity"]} (entsprechend anpassen)
-    • Slides: {cfg["num_slides"]} (jede muss Wert liefern)
-    • CTA: {cfg["cta"]} (maximale Interaktion)
-    
-    🚀 VIRALE ELEMENTE EINBAUEN:
-    1. KURIOSITÄTSLÜCKEN (Curiosity Gaps)
-    2. EMOTIONALE IDENTIFIKATION ("Kennst du das?")
-    3. ÜBERRASCHUNGS-MOMENTE (unerwartete Einsichten)
-    4. GEMEINSCHAFTSGEFÜHL ("Wir sind viele")
-    5. KLARE HANDLUNGSIMPULSE (mikro-Aktionen)
-    
-    ⚠️ TABUS: {cfg["no_gos"]}
-    
-    💡 STYLE-TIPPS: {cfg["extra_context"] or "Emojis sinnvoll einsetzen • Kurze Zeilen • Direkte Ansprache • Konkrete Beispiele"}
-    
-    📝 OUTPUT-FORMAT (STRENG EINHALTEN):
-    {{
-      "title_hook": "🔥 Emotionaler Hook (max 6 Wörter, muss neugierig machen)",
-      "viral_score": 85,  # 1-100 wie viral der Content ist
-      "slides": [
-        {{
-          "slide_no": 1,
-          "headline": "📌 Scroll-Stopper (max 5 Wörter)",
-          "body": "Max {cfg['slide_length']} Zeichen. Emotional • Persönlich • Wertvoll",
-          "engagement_tip": "Warum diese Slide interaktionsstark ist",
-          "sticker_suggestion": "Interaktiver Sticker + genaue Formulierung",
-          "visual_suggestion": "Hintergrund-Farbe • Symbol • Bild-Idee"
-        }}
-      ],
-      "caption_variants": [
-        "🔥 Caption mit Hook + CTA + Frage",
-        "💫 Alternative mit Storytelling"
-      ],
-      "cta_options": [
-        "📍 Dringender Handlungsimpuls",
-        "🤝 Community-Frage",
-        "💡 Wissens-CTA"
-      ],
-      "poll_or_question": {{
-        "type": "poll|question|quiz|slider|emoji_slider",
-        "prompt": "Ultra-interaktive Frageformulierung",
-        "options": ["Emotional Option A", "Überraschende Option B", "Tiefe Option C"]
-      }},
-      "hashtags": ["Deutsch • Thematisch • Viral • Community"],
-      "viral_techniques": ["Liste der verwendeten Viral-Techniken"],
-      "safety_note": "🔒 Sicherheitshinweis + Empowerment"
-    }}
-    
-    JETZT: Erstelle den engagiertesten Content, den Instagram je gesehen hat!
-    """).strip()
+@st.cache_resource
+def get_dedup_index():
+    """Process-wide near-duplicate index (built from the history on first start)"""
+    index = DuplicateIndex()
+    if not index.stats()["texts"]:
+        index.backfill(get_history_store())
+    return index
 
 # -----------------------------
 # Enhanced UI Components
@@ -162,12 +92,38 @@ def init_session_state():
         st.session_state.generated_content = None
     if 'export_format' not in st.session_state:
         st.session_state.export_format = 'txt'
-    if 'api_usage' not in st.session_state:
-        st.session_state.api_usage = 0
+    if 'content_hash' not in st.session_state:
+        st.session_state.content_hash = None
+    if 'duplicates' not in st.session_state:
+        st.session_state.duplicates = []
+    if 'no_gos' not in st.session_state:
+        st.session_state.no_gos = ([], [])
+    if 'generated_cfg' not in st.session_state:
+        st.session_state.generated_cfg = None
+    if 'variants' not in st.session_state:
+        st.session_state.variants = []
+        st.session_state.variant = 0
+    if 'notes' not in st.session_state:
+        st.session_state.notes = []
+    if 'cascade' not in st.session_state:
+        st.session_state.cascade = None
+
+def set_generated_content(data, duplicates=None, no_gos=None, cfg=None, variants=None, notes=None, cascade=None):
+    """Store a story together with its content hash (the key of the export cache)"""
+    st.session_state.variants = variants or []
+    st.session_state.variant = 0
+    st.session_state.generated_content = data
+    st.session_state.generated_cfg = cfg
+    st.session_state.content_hash = request_hash(data) if data else None
+    st.session_state.duplicates = duplicates or []
+    st.session_state.no_gos = no_gos or ([], [])
+    st.session_state.notes = notes or []
+    st.session_state.cascade = cascade
 
+@st.fragment
 def render_viral_sidebar():
-    """Enhanced sidebar with viral tips"""
-    with st.sidebar:
+    """Viral settings (sidebar fragment) -> st.session_state.viral_cfg"""
+    with measure_rerun("Viral-Einstellungen"):
         st.header("🚀 Viral-Optimierung")
         
         col1, col2 = st.columns(2)
@@ -191,16 +147,21 @@ def render_viral_sidebar():
                 "Utility (praktischer Nutzen)",
                 "Inspiration (Motivationsboost)"
             ],
-            default=["Curiosity Gap", "Utility", "Storytelling"]
+            default=[
+                "Curiosity Gap (Neugier wecken)",
+                "Utility (praktischer Nutzen)",
+                "Storytelling (persönliche Geschichte)"
+            ]
         )
         
         st.info("💡 **Viral-Tipp:** Kombiniere 2-3 Elemente für maximalen Impact!")
         
         st.divider()
         st.subheader("📈 Performance-Tracking")
-        st.metric("API Calls", st.session_state.api_usage)
+        render_metrics_summary(METRICS_REGISTRY.summary(), compact=True)
+        st.page_link("pages/Telemetrie.py", label="Alle Metriken", icon="📊")
         
-        return {
+        st.session_state.viral_cfg = {
             "urgency": urgency,
             "emotion": emotion,
             "viral_elements": viral_elements
@@ -209,58 +170,160 @@ def render_viral_sidebar():
 # -----------------------------
 # Enhanced Content Generation
 # -----------------------------
-def generate_viral_story(client, model, creativity, cfg, viral_cfg):
-    """Generate viral-optimized content"""
-    
-    base_prompt = build_viral_prompt_template(cfg)
-    
-    # Add viral configuration to prompt
-    viral_addition = f"""
-    ZUSÄTZLICHE VIRAL-KONFIG:
-    • Dringlichkeit: {viral_cfg['urgency']}/10
-    • Emotion: {viral_cfg['emotion']}/10
-    • Viral-Elemente: {', '.join(viral_cfg['viral_elements'])}
-    
-    FOKUS: {cfg['goal']} mit {cfg['topic']} für Zielgruppe in {cfg['stage']}
-    
-    MACH DIESEN CONTENT UNVERGESSLICH!
+def generate_viral_variants(client, model, creativity, cfg, viral_cfg, n, index=None, scheduler=None, history=None,
+                            quota=None, cancel=None):
+    """n candidates in one request (`n` parameter), ranked locally; best first"""
+    candidates = run_completion_n(
+        client, viral_request(model, creativity, cfg, viral_cfg), n,
+        scheduler=scheduler,
+        history=history,
+        meta={"kind": "viral", "cfg": cfg, "viral_cfg": viral_cfg},
+        quota=quota,
+        cancel=cancel
+    )
+    return rank_variants(candidates, cfg, index=index, schema="viral_story")
+
+def generate_viral_content(job, client, settings, cfg, viral_cfg, index, cache=None, scheduler=None,
+                           history=None, quota=None):
+    """
+    One click of the generate button as a story_jobs function (runs in the
+    job pool, so no st.* in here): variants or a single streamed story, then
+    the no-go check. Returns the arguments for set_generated_content; a
+    cancelled story keeps the slides that had already streamed in. Model
+    "auto" routes the single story through story_cascade.
     """
+    model, creativity = resolve_model(settings["model"]), settings["creativity"]
+    cascade = None
+    
+    variants = []
+    if settings["variants"] > 1:
+        variants = generate_viral_variants(
+            client, model, creativity, cfg, viral_cfg, settings["variants"],
+            index=index,
+            scheduler=scheduler,
+            history=history,
+            quota=quota,
+            cancel=job.cancel_event
+        )
+        data, raw = variants[0]["data"], variants[0]["raw"]
+        duplicates = index.check(data) if data else []
+        if data:
+            index.add(data, topic=cfg["topic"])
+    else:
+        # Near-duplicates of earlier stories are flagged (or re-rolled)
+        completion_opts = dict(
+            index=index,
+            on_update=(lambda partial_data: job.update(partial=partial_data)) if settings["streaming"] else None,
+            cache=cache,
+            force_fresh=settings["force_fresh"],
+            scheduler=scheduler,
+            history=history,
+            quota=quota,
+            cancel=job.cancel_event
+        )
+        try:
+            if settings["model"] == AUTO_MODEL:
+                # Cheap model first; only failing stories/slides go to the larger one
+                data, raw, cascade = route(
+                    generate_viral_story, client, creativity, cfg, viral_cfg,
+                    schema="viral_story",
+                    **completion_opts
+                )
+                duplicates = cascade["duplicates"]
+            else:
+                data, raw, duplicates = generate_unique(
+                    generate_viral_story, client, model, creativity, cfg, viral_cfg,
+                    rerolls=MAX_REROLLS if settings["reroll_duplicates"] else 0,
+                    **completion_opts
+                )
+        except GenerationCancelled as e:
+            if not (e.partial or {}).get("slides"):
+                raise
+            data, raw, duplicates = e.partial, e.text, []
     
-    full_prompt = base_prompt + "\n\n" + viral_addition
+    if not data:
+        raise JobError("❌ Fehler bei der Generierung", detail=raw)
     
+    # No-go terms: only the offending slides/fields are rewritten
+    notes = []
     try:
-        response = client.chat.completions.create(
-            model=model,
-            temperature=creativity,
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": build_system_prompt()},
-                {"role": "user", "content": full_prompt}
-            ],
-            max_tokens=2000
+        data, no_go_hits, repaired = enforce_no_gos(
+            client, model, creativity, cfg, data,
+            repair=settings["repair_no_gos"] and not job.cancel_event.is_set(),
+            cache=cache,
+            scheduler=scheduler,
+            history=history,
+            quota=quota,
+            cancel=job.cancel_event
         )
-        
-        st.session_state.api_usage += 1
-        text = response.choices[0].message.content or "{}"
-        
-        # Enhanced JSON parsing with retry
-        data = safe_json_loads(text)
-        if not data:
-            # Try to fix common JSON issues
-            text = text.replace("'", '"').replace("True", "true").replace("False", "false")
-            data = json.loads(text)
-        
-        return data, text
-        
     except Exception as e:
-        st.error(f"API Error: {str(e)}")
-        return None, None
+        notes.append(f"API Error: {str(e)}")
+        data, no_go_hits, repaired = enforce_no_gos(client, model, creativity, cfg, data, repair=False)
+    if variants:
+        variants[0]["data"], variants[0]["no_go_hits"] = data, no_go_hits
+    
+    return {"data": data, "duplicates": duplicates, "no_gos": (no_go_hits, repaired), "cfg": cfg,
+            "variants": variants, "raw": raw, "notes": notes, "cascade": cascade}
+
+def apply_generated_content(result):
+    """jobs_panel callback: show a finished generation or slide revision"""
+    if "revised" in result:
+        data, variants = result["revised"], st.session_state.variants
+        st.session_state.generated_content = data
+        st.session_state.content_hash = request_hash(data)
+        if result["variant"] < len(variants):
+            variants[result["variant"]]["data"] = data
+            st.session_state.variant = result["variant"]
+        return
+    set_generated_content(result["data"], result["duplicates"], result["no_gos"], result["cfg"], result["variants"],
+                          notes=result["notes"], cascade=result["cascade"])
+    st.session_state.raw_output = result["raw"]
+    st.toast("✅ Content erfolgreich generiert!")
+
+def revise_generated_slide(job, client, settings, cfg, data, variant, index, action, cache=None, scheduler=None,
+                           history=None, quota=None):
+    """Regenerate / shorten one slide as a story_jobs function; the rest of the story is kept"""
+    data, _ = revise_slide(
+        client, resolve_model(settings["model"]), settings["creativity"], cfg, data, index, action,
+        cache=cache,
+        scheduler=scheduler,
+        history=history,
+        quota=quota,
+        cancel=job.cancel_event
+    )
+    return {"revised": data, "variant": variant}
+
+def submit_slide_revision(index, action):
+    """Queue a slide revision of the shown story in the job pool"""
+    settings = st.session_state.model_settings
+    api_key = settings["api_key"]
+    submit_job(
+        partial(
+            revise_generated_slide,
+            client=get_client(api_key),
+            settings=dict(settings),
+            cfg=st.session_state.generated_cfg or st.session_state.cfg,
+            data=st.session_state.generated_content,
+            variant=st.session_state.variant,
+            index=index,
+            action=action,
+            cache=get_response_cache(),
+            scheduler=get_scheduler(api_key),
+            history=get_history_store(),
+            quota=session_quota()
+        ),
+        label=f"Slide {index + 1} {'neu schreiben' if action == 'regenerate' else 'kürzen'}"
+    )
 
 # -----------------------------
 # Enhanced Content Display
 # -----------------------------
-def render_viral_story(data):
-    """Display content with viral metrics"""
+def render_viral_story(data, partial=False, actions_key=None):
+    """
+    Display content with viral metrics (partial=True: hook + slides while streaming).
+    actions_key: regenerate/shorten buttons per slide; returns (slide index, action) when clicked
+    """
+    clicked = None
     
     if not data:
         st.error("Keine Daten zum Anzeigen")
@@ -304,6 +367,14 @@ def render_viral_story(data):
                                 st.caption(f"**Sticker:** {slide.get('sticker_suggestion', '')}")
                             with col_b:
                                 st.caption(f"**Visual:** {slide.get('visual_suggestion', '')}")
+                            
+                            if actions_key and not partial:
+                                action = slide_action_buttons(actions_key, i + j)
+                                if action:
+                                    clicked = (i + j, action)
+    
+    if partial:
+        return clicked
     
     # Captions & CTAs
     tab1, tab2, tab3, tab4 = st.tabs(["📝 Captions", "🎯 CTAs", "📊 Interaktion", "🏷️ Hashtags"])
@@ -346,6 +417,7 @@ def render_viral_story(data):
     
     # Safety note
     st.info(data.get("safety_note", "🔒 Sicherheitshinweis: Dieser Content ersetzt keine professionelle Beratung."))
+    return clicked
 
 # -----------------------------
 # Enhanced Export
@@ -410,24 +482,34 @@ def make_enhanced_export(data, format_type='txt'):
         
         return output.getvalue()
 
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_export(content_hash, format_type, _data):
+    """
+    One export format of one story, built on first download and then reused.
+    Keyed by content hash only (_data is not hashed), so reruns cost nothing.
+    """
+    if format_type == 'zip':
+        return render_zip(_data)
+    if format_type == 'pdf':
+        return pdf_bytes(_data)
+    return make_enhanced_export(_data, format_type).encode('utf-8')
+
+def lazy_export(format_type):
+    """download_button data: built only when the button is clicked"""
+    content_hash = st.session_state.content_hash
+    data = st.session_state.generated_content
+    return lambda: get_export(content_hash, format_type, data)
+
 # -----------------------------
-# Main App
+# Page Sections (fragments)
 # -----------------------------
-def main():
-    # Initialize
-    init_session_state()
-    
-    # Header
-    st.title("🚀 IG Story Generator – Viral Edition")
-    st.markdown("**Erstelle hoch-engagierenden Content für maximale Reichweite & Community-Bindung**")
-    
-    # API Key
-    api_key = get_api_key()
-    
-    # Enhanced Sidebar
-    with st.sidebar:
+@st.fragment
+def render_model_sidebar():
+    """API key & model (sidebar fragment) -> st.session_state.model_settings"""
+    with measure_rerun("Modell"):
         st.header("🔑 API & Model")
         
+        api_key = get_api_key()
         if not api_key:
             api_key = st.text_input(
                 "OpenAI API Key",
@@ -447,7 +529,9 @@ def main():
             "Modell",
             model_groups[model_category],
             index=0,
-            help="gpt-4o-mini: kosteneffizient • gpt-4o: beste Qualität"
+            format_func=model_label,
+            help="gpt-4o-mini: kosteneffizient • gpt-4o: beste Qualität • Automatisch: erst mini, "
+                 "nur bei Schema-/Längen-/Tabu-/Wiederholungs-Problemen das größere Modell"
         )
         
         creativity = st.slider(
@@ -455,214 +539,238 @@ def main():
             0.0, 1.0, 0.7, 0.05,
             help="0.7 = optimaler Mix aus Konsistenz & Kreativität"
         )
-    
-    # Viral Configuration
-    viral_cfg = render_viral_sidebar()
-    
-    # Main Content Configuration
-    st.header("🎯 Content-Konfiguration")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        goal = st.selectbox(
-            "Primäres Ziel",
-            [
-                "🔥 Maximale Interaktion (Likes, Shares, Comments)",
-                "💬 Community-Aufbau & Bindung",
-                "📈 Reichweite steigern (viral Potential)",
-                "🤝 Vertrauen & Glaubwürdigkeit",
-                "🎯 Konkrete Aktionen (Downloads, DMs, Saves)",
-                "💡 Aufklärung & Awareness",
-                "❤️ Emotionale Verbindung"
-            ],
-            index=0
-        )
         
-        text_type = st.selectbox(
-            "Content-Format",
-            [
-                "🚀 Viral Carousel (3-7 ultra-engagierende Slides)",
-                "💥 Emotionaler One-Liner (Scroll-Stopper)",
-                "📚 Mini-Guide (Wertvoll + Teilbar)",
-                "🎯 Interaktive Checkliste",
-                "📖 Storytelling (Persönlich + Relatable)",
-                "🧠 Mindshift (Perspektivenwechsel)",
-                "🔄 Transformations-Story (Vorher/Nachher)",
-                "❓ Quiz/Test (hohe Interaktion)"
-            ],
-            index=0
+        streaming = st.toggle(
+            "⚡ Live-Streaming",
+            value=True,
+            help="Slides erscheinen, sobald sie fertig generiert sind"
         )
         
-        tone = st.selectbox(
-            "Ton & Stimme",
-            [
-                "🔥 Leidenschaftlich & Mitreißend",
-                "💫 Empathisch & Tief",
-                "🎯 Direkt & Klar",
-                "✨ Inspirierend & Motivierend",
-                "🤝 Vertrauensvoll & Autoritativ",
-                "😊 Freundlich & Gemeinschaftlich"
-            ],
-            index=0
+        force_fresh = st.checkbox(
+            "♻️ Cache umgehen",
+            value=False,
+            help="Identische Anfragen kommen sonst sofort aus dem Cache (keine API-Kosten)"
         )
         
-        stage = st.selectbox(
-            "Zielgruppen-Phase",
-            [
-                "🌀 Verwirrung & Selbstzweifel",
-                "⚡ Erkenntnis & Schock",
-                "💔 Trennung & Schmerz",
-                "🛡️ Schutz & Distanzierung",
-                "🌱 Heilung & Wachstum",
-                "🚀 Transformation & Neuanfang"
-            ],
-            index=0
-        )
-    
-    with col2:
-        topic = st.selectbox(
-            "Fokus-Thema",
-            [
-                "🔥 Gaslighting erkennen & benennen",
-                "💔 Emotionale Erpressung durchbrechen",
-                "🛡️ Grenzen setzen ohne Schuldgefühle",
-                "🌀 Trauma-Bond verstehen & lösen",
-                "🎯 Selbstwert aufbauen trotz Abwertung",
-                "✨ Innere Freiheit gewinnen",
-                "🤝 Gesunde Beziehungen nach toxischen",
-                "💪 Empowerment & Selbstwirksamkeit"
-            ],
-            index=0
+        repair_no_gos = st.checkbox(
+            "🛠️ Tabu-Wörter automatisch ersetzen",
+            value=True,
+            help="Nur die betroffenen Slides/Felder werden neu formuliert, nicht die ganze Story"
         )
         
-        sensitivity = st.selectbox(
-            "Sensibilitäts-Level",
-            ["🌱 Sanft & Vorsichtig", "🎯 Klar & Direkt", "🔥 Intensiv & Tief"],
-            index=1
+        reroll_duplicates = st.checkbox(
+            "🎲 Wiederholungen neu generieren",
+            value=False,
+            help="Ähnelt Hook/Slide/Caption einer früheren Story, wird bis zu 2× neu generiert"
         )
         
-        slide_length = st.select_slider(
-            "Zeichen pro Slide",
-            options=[80, 120, 160, 200, 240],
-            value=120,
-            help="Kürzer = besser für Mobile"
+        variants = st.slider(
+            "🎯 Varianten pro Klick",
+            1, MAX_VARIANTS, 1,
+            help="Mehrere Stories in einer Anfrage (Prompt nur einmal bezahlt), lokal gerankt • ohne Live-Streaming"
         )
         
-        num_slides = st.slider(
-            "Anzahl Slides",
-            min_value=3, max_value=12, value=6,
-            help="6-8 Slides = optimale Engagement-Länge"
-        )
+        st.session_state.model_settings = {
+            "api_key": api_key,
+            "model": model,
+            "creativity": creativity,
+            "streaming": streaming,
+            "force_fresh": force_fresh,
+            "repair_no_gos": repair_no_gos,
+            "reroll_duplicates": reroll_duplicates,
+            "variants": variants,
+        }
+
+@st.fragment
+def render_content_config():
+    """Content configuration (fragment) -> st.session_state.cfg"""
+    with measure_rerun("Konfiguration"):
+        st.header("🎯 Content-Konfiguration")
         
-        cta = st.selectbox(
-            "Interaktions-Typ",
-            [
-                "🔥 Frage-Sticker (hohe Reply-Rate)",
-                "📊 Umfrage (instant Engagement)",
-                "💬 DM-Trigger (Community-Building)",
-                "💾 Save-Sticker (Langzeit-Engagement)",
-                "🎯 Quiz/Test (spielerisch)",
-                "✨ Emoji-Slider (einfach & effektiv)",
-                "🔄 Share-Prompt (Virality)"
-            ],
-            index=0
-        )
-    
-    # Advanced Settings
-    with st.expander("⚙️ Erweiterte Einstellungen"):
-        col_a, col_b = st.columns(2)
+        col1, col2 = st.columns(2)
         
-        with col_a:
-            no_gos = st.text_area(
-                "Tabu-Wörter",
-                value="diagnose, narzisst, therapie, konfrontation, rache, opfer",
-                help="Kommagetrennte Liste"
+        with col1:
+            goal = st.selectbox(
+                "Primäres Ziel",
+                [
+                    "🔥 Maximale Interaktion (Likes, Shares, Comments)",
+                    "💬 Community-Aufbau & Bindung",
+                    "📈 Reichweite steigern (viral Potential)",
+                    "🤝 Vertrauen & Glaubwürdigkeit",
+                    "🎯 Konkrete Aktionen (Downloads, DMs, Saves)",
+                    "💡 Aufklärung & Awareness",
+                    "❤️ Emotionale Verbindung"
+                ],
+                index=0
             )
             
-            target_demographic = st.multiselect(
-                "Ziel-Demographie",
-                ["Frauen 25-45", "Männer 30-50", "Junge Erwachsene", "Berufstätige", "Eltern"],
-                default=["Frauen 25-45"]
+            text_type = st.selectbox(
+                "Content-Format",
+                [
+                    "🚀 Viral Carousel (3-7 ultra-engagierende Slides)",
+                    "💥 Emotionaler One-Liner (Scroll-Stopper)",
+                    "📚 Mini-Guide (Wertvoll + Teilbar)",
+                    "🎯 Interaktive Checkliste",
+                    "📖 Storytelling (Persönlich + Relatable)",
+                    "🧠 Mindshift (Perspektivenwechsel)",
+                    "🔄 Transformations-Story (Vorher/Nachher)",
+                    "❓ Quiz/Test (hohe Interaktion)"
+                ],
+                index=0
+            )
+            
+            tone = st.selectbox(
+                "Ton & Stimme",
+                [
+                    "🔥 Leidenschaftlich & Mitreißend",
+                    "💫 Empathisch & Tief",
+                    "🎯 Direkt & Klar",
+                    "✨ Inspirierend & Motivierend",
+                    "🤝 Vertrauensvoll & Autoritativ",
+                    "😊 Freundlich & Gemeinschaftlich"
+                ],
+                index=0
+            )
+            
+            stage = st.selectbox(
+                "Zielgruppen-Phase",
+                [
+                    "🌀 Verwirrung & Selbstzweifel",
+                    "⚡ Erkenntnis & Schock",
+                    "💔 Trennung & Schmerz",
+                    "🛡️ Schutz & Distanzierung",
+                    "🌱 Heilung & Wachstum",
+                    "🚀 Transformation & Neuanfang"
+                ],
+                index=0
             )
         
-        with col_b:
-            extra_context = st.text_area(
-                "Style-Guide & Besonderheiten",
-                placeholder="z.B.: 'Du-Form • Emojis sparsam • Konkrete Beispiele • Action-words • Positiver Abschluss'",
-                height=100
+        with col2:
+            topic = st.selectbox(
+                "Fokus-Thema",
+                [
+                    "🔥 Gaslighting erkennen & benennen",
+                    "💔 Emotionale Erpressung durchbrechen",
+                    "🛡️ Grenzen setzen ohne Schuldgefühle",
+                    "🌀 Trauma-Bond verstehen & lösen",
+                    "🎯 Selbstwert aufbauen trotz Abwertung",
+                    "✨ Innere Freiheit gewinnen",
+                    "🤝 Gesunde Beziehungen nach toxischen",
+                    "💪 Empowerment & Selbstwirksamkeit"
+                ],
+                index=0
             )
             
-            posting_time = st.selectbox(
-                "Optimale Posting-Zeit",
-                ["⏰ Flexibel", "🌅 Morgens (7-9)", "☕ Mittag (12-14)", "🌇 Abend (18-20)", "🌙 Spät (20-22)"]
+            sensitivity = st.selectbox(
+                "Sensibilitäts-Level",
+                ["🌱 Sanft & Vorsichtig", "🎯 Klar & Direkt", "🔥 Intensiv & Tief"],
+                index=1
             )
-    
-    # Generate Button
-    st.divider()
-    
-    col_gen1, col_gen2, col_gen3 = st.columns([2, 1, 1])
-    
-    with col_gen1:
-        if st.button(
-            "🚀 JETZT VIRALEN CONTENT GENERIEREN",
-            type="primary",
-            use_container_width=True,
-            help="Erstellt hoch-optimierten Content für maximale Reichweite"
-        ):
-            if not api_key:
-                st.error("Bitte API-Key eingeben!")
-                st.stop()
             
-            # Build configuration
-            cfg = {
-                "goal": goal,
-                "text_type": text_type,
-                "tone": tone,
-                "stage": stage,
-                "topic": topic,
-                "sensitivity": sensitivity,
-                "slide_length": slide_length,
-                "num_slides": num_slides,
-                "cta": cta,
-                "no_gos": no_gos,
-                "extra_context": f"{extra_context} | Ziel: {target_demographic} | Zeit: {posting_time}",
-            }
+            slide_length = st.select_slider(
+                "Zeichen pro Slide",
+                options=[80, 120, 160, 200, 240],
+                value=120,
+                help="Kürzer = besser für Mobile"
+            )
             
-            # Initialize client
-            client = OpenAI(api_key=api_key)
+            num_slides = st.slider(
+                "Anzahl Slides",
+                min_value=3, max_value=12, value=6,
+                help="6-8 Slides = optimale Engagement-Länge"
+            )
+            
+            cta = st.selectbox(
+                "Interaktions-Typ",
+                [
+                    "🔥 Frage-Sticker (hohe Reply-Rate)",
+                    "📊 Umfrage (instant Engagement)",
+                    "💬 DM-Trigger (Community-Building)",
+                    "💾 Save-Sticker (Langzeit-Engagement)",
+                    "🎯 Quiz/Test (spielerisch)",
+                    "✨ Emoji-Slider (einfach & effektiv)",
+                    "🔄 Share-Prompt (Virality)"
+                ],
+                index=0
+            )
+        
+        # Advanced Settings
+        with st.expander("⚙️ Erweiterte Einstellungen"):
+            col_a, col_b = st.columns(2)
             
-            # Generate content
-            with st.spinner("🔥 Erstelle viral-optimierten Content..."):
-                data, raw = generate_viral_story(client, model, creativity, cfg, viral_cfg)
+            with col_a:
+                no_gos = st.text_area(
+                    "Tabu-Wörter",
+                    value="diagnose, narzisst, therapie, konfrontation, rache, opfer",
+                    help="Kommagetrennte Liste"
+                )
                 
-                if data:
-                    st.session_state.generated_content = data
-                    st.session_state.raw_output = raw
-                    st.success("✅ Content erfolgreich generiert!")
-                else:
-                    st.error("❌ Fehler bei der Generierung")
-    
-    with col_gen2:
-        batch_mode = st.toggle(
-            "📅 Wochenplan",
-            help="Generiert 7 Tage Content auf einmal"
-        )
-    
-    with col_gen3:
-        st.session_state.export_format = st.selectbox(
-            "Export",
-            ["txt", "json", "csv"],
-            index=0,
-            label_visibility="collapsed"
-        )
-    
-    # Display Generated Content
-    if st.session_state.generated_content:
-        st.divider()
-        render_viral_story(st.session_state.generated_content)
+                target_demographic = st.multiselect(
+                    "Ziel-Demographie",
+                    ["Frauen 25-45", "Männer 30-50", "Junge Erwachsene", "Berufstätige", "Eltern"],
+                    default=["Frauen 25-45"]
+                )
+            
+            with col_b:
+                extra_context = st.text_area(
+                    "Style-Guide & Besonderheiten",
+                    placeholder="z.B.: 'Du-Form • Emojis sparsam • Konkrete Beispiele • Action-words • Positiver Abschluss'",
+                    height=100
+                )
+                
+                posting_time = st.selectbox(
+                    "Optimale Posting-Zeit",
+                    ["⏰ Flexibel", "🌅 Morgens (7-9)", "☕ Mittag (12-14)", "🌇 Abend (18-20)", "🌙 Spät (20-22)"]
+                )
         
-        # Export Options
+        st.session_state.cfg = {
+            "goal": goal,
+            "text_type": text_type,
+            "tone": tone,
+            "stage": stage,
+            "topic": topic,
+            "sensitivity": sensitivity,
+            "slide_length": slide_length,
+            "num_slides": num_slides,
+            "cta": cta,
+            "no_gos": no_gos,
+            "extra_context": f"{extra_context} | Ziel: {target_demographic} | Zeit: {posting_time}",
+        }
+
+@st.fragment
+def render_output():
+    """Generated story (fragment: config edits don't re-render it)"""
+    if not st.session_state.generated_content:
+        return
+    with measure_rerun("Output"):
+        st.divider()
+        variants = st.session_state.variants
+        if len(variants) > 1:
+            choice = render_variant_picker(variants, st.session_state.variant, key="variant_choice")
+            if choice != st.session_state.variant:
+                st.session_state.generated_content = variants[choice]["data"]
+                st.session_state.content_hash = request_hash(variants[choice]["data"])
+                st.session_state.variant = choice
+                st.session_state.duplicates = []
+                st.session_state.no_gos = (variants[choice]["no_go_hits"], [])
+                st.rerun()  # full rerun: exports follow the chosen variant
+        for note in st.session_state.notes:
+            st.warning(note)
+        if st.session_state.cascade:
+            st.caption(report_summary(st.session_state.cascade))
+        render_no_go_report(*st.session_state.no_gos)
+        render_duplicates(st.session_state.duplicates)
+        clicked = render_viral_story(st.session_state.generated_content, actions_key="slide")
+        if clicked:
+            submit_slide_revision(*clicked)
+            st.rerun()  # full rerun: the jobs panel shows the revision
+
+@st.fragment
+def render_export_panel():
+    """Download buttons (fragment: a download only reruns this panel)"""
+    if not st.session_state.generated_content:
+        return
+    with measure_rerun("Export"):
         st.divider()
         st.subheader("📤 Export")
         
@@ -671,20 +779,18 @@ def main():
         export_data = st.session_state.generated_content
         
         with col_exp1:
-            txt_export = make_enhanced_export(export_data, 'txt')
             st.download_button(
                 "📄 TXT Export",
-                data=txt_export.encode('utf-8'),
+                data=lazy_export('txt'),
                 file_name=f"viral_ig_story_{datetime.now().strftime('%Y%m%d_%H%M')}.txt",
                 mime="text/plain",
                 use_container_width=True
             )
         
         with col_exp2:
-            json_export = make_enhanced_export(export_data, 'json')
             st.download_button(
                 "📊 JSON Export",
-                data=json_export.encode('utf-8'),
+                data=lazy_export('json'),
                 file_name=f"viral_ig_story_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
                 mime="application/json",
                 use_container_width=True
@@ -692,14 +798,121 @@ def main():
         
         with col_exp3:
             if export_data.get('slides'):
-                csv_export = make_enhanced_export(export_data, 'csv')
                 st.download_button(
                     "📈 CSV Export",
-                    data=csv_export.encode('utf-8'),
+                    data=lazy_export('csv'),
                     file_name=f"viral_slides_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
                     mime="text/csv",
                     use_container_width=True
                 )
+        
+        if export_data.get('slides'):
+            col_exp4, col_exp5 = st.columns(2)
+            with col_exp4:
+                st.download_button(
+                    "🖼️ Slides als PNG (ZIP, 1080×1920)",
+                    data=lazy_export('zip'),
+                    file_name=f"viral_slides_{datetime.now().strftime('%Y%m%d_%H%M')}.zip",
+                    mime="application/zip",
+                    use_container_width=True
+                )
+            with col_exp5:
+                st.download_button(
+                    "📑 Briefing (PDF)",
+                    data=lazy_export('pdf'),
+                    file_name=f"viral_ig_story_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
+                    mime="application/pdf",
+                    use_container_width=True
+                )
+
+# -----------------------------
+# Main App
+# -----------------------------
+def main():
+    # Initialize
+    init_session_state()
+    get_metrics_server()
+    login_gate()  # story_auth accounts; open mode while none exist
+    
+    # Header
+    st.title("🚀 IG Story Generator – Viral Edition")
+    st.markdown("**Erstelle hoch-engagierenden Content für maximale Reichweite & Community-Bindung**")
+    
+    # Enhanced Sidebar (each section is a fragment: edits only rerun that section)
+    with st.sidebar:
+        render_user_box()
+        render_model_sidebar()
+        render_viral_sidebar()
+        render_rerun_timings()
+        render_schema_stats(SCHEMA_STATS.snapshot())
+        render_cascade_stats(CASCADE_STATS.snapshot())
+    
+    # Main Content Configuration
+    render_content_config()
+    
+    # Generate Button
+    st.divider()
+    
+    col_gen1, col_gen2, col_gen3 = st.columns([2, 1, 1])
+    
+    with col_gen1:
+        if st.button(
+            "🚀 JETZT VIRALEN CONTENT GENERIEREN",
+            type="primary",
+            use_container_width=True,
+            help="Erstellt hoch-optimierten Content für maximale Reichweite"
+        ):
+            settings = st.session_state.model_settings
+            api_key = settings["api_key"]
+            if not api_key:
+                st.error("Bitte API-Key eingeben!")
+                st.stop()
+            
+            cfg = st.session_state.cfg
+            kind = "Viral Story" if settings["variants"] == 1 else f"{settings['variants']} Varianten"
+            
+            # Runs in the job pool (story_jobs): touching a widget or reloading no longer aborts it
+            submit_job(
+                partial(
+                    generate_viral_content,
+                    client=get_client(api_key),  # shared pooled client (one connection pool per key and process)
+                    settings=dict(settings),
+                    cfg=dict(cfg),
+                    viral_cfg=dict(st.session_state.viral_cfg),
+                    index=get_dedup_index(),
+                    cache=get_response_cache(),
+                    scheduler=get_scheduler(api_key),
+                    history=get_history_store(),
+                    quota=session_quota()
+                ),
+                label=f"{kind} · {cfg['topic']}"
+            )
+    
+    with col_gen2:
+        batch_mode = st.toggle(
+            "📅 Wochenplan",
+            help="Generiert 7 Tage Content auf einmal"
+        )
+    
+    with col_gen3:
+        st.session_state.export_format = st.selectbox(
+            "Export",
+            ["txt", "json", "csv"],
+            index=0,
+            label_visibility="collapsed"
+        )
+    
+    # Running / queued generations (streamed slides show up here), finished ones are displayed below
+    jobs_panel(apply_generated_content, render_partial=lambda data: render_viral_story(data, partial=True))
+    
+    # Display Generated Content
+    render_output()
+    render_export_panel()
+    
+    with st.expander("🗂️ Verlauf"):
+        # Week plans are shown by the v1 app only
+        render_history_panel(get_history_store(), lambda record: set_generated_content(record["data"], cfg=record["cfg"]),
+                             loadable=("story", "viral"))
     
     # Footer & Info
     st.divider()
@@ -749,4 +962,5 @@ def main():
 # Run App
 # -----------------------------
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with measure_rerun("App"):
+        main()
\ No newline at end of file
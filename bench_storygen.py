@@ -0,0 +1,224 @@
+"""
+Latency / throughput benchmark for the generation core against the local mock.
+
+Drives generate_single_story, generate_week_plan and generate_viral_story
+through mock_openai_server (no network, no API key) and reports:
+- p50/p95/p99 latency per function (sequential)
+- throughput at N concurrent requests (coalescing off: every request is an
+  API call; generate_single_story_coalesced shows identical concurrent
+  requests sharing one call, story_singleflight)
+- JSON parse time of typical answers
+- schema validation time (story_schema) of the same answers
+
+    python bench_storygen.py --requests 20 --concurrency 1 4 16
+    python bench_storygen.py --base-url http://127.0.0.1:8808/v1   # external mock
+"""
+import sys
+import json
+import math
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_openai_server import fake_completion_text, start_mock_server
+from story_client import get_client
+from story_metrics import REGISTRY
+from story_core import (
+    DEFAULT_CFG,
+    DEFAULT_VIRAL_CFG,
+    generate_single_story,
+    generate_viral_story,
+    generate_week_plan,
+    safe_json_loads,
+)
+from story_schema import validate
+
+MODEL = "gpt-4o-mini"
+TEMPERATURE = 0.6
+
+
+def percentile(samples: list, pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(samples: list) -> dict:
+    return {
+        "n": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2) if samples else 0.0,
+    }
+
+
+def scenarios(client, stream: bool):
+    on_update = (lambda partial: None) if stream else None
+    # All workers send the same request: without these, run_completion would coalesce them into one call
+    fresh = {"coalesce": False, "force_fresh": True}
+    return {
+        "generate_single_story": lambda: generate_single_story(
+            client, MODEL, TEMPERATURE, DEFAULT_CFG, on_update=on_update, **fresh),
+        "generate_week_plan": lambda: generate_week_plan(
+            client, MODEL, TEMPERATURE, DEFAULT_CFG, **fresh),
+        "generate_viral_story": lambda: generate_viral_story(
+            client, MODEL, TEMPERATURE, DEFAULT_CFG, DEFAULT_VIRAL_CFG, on_update=on_update, **fresh),
+        "generate_single_story_coalesced": lambda: generate_single_story(
+            client, MODEL, TEMPERATURE, DEFAULT_CFG, on_update=on_update),
+    }
+
+
+def timed(fn):
+    started = time.perf_counter()
+    data, _ = fn()
+    return time.perf_counter() - started, bool(data)
+
+
+def bench_latency(fn, requests: int) -> dict:
+    samples, failures = [], 0
+    for _ in range(requests):
+        elapsed, ok = timed(fn)
+        samples.append(elapsed)
+        failures += not ok
+    return {**summarize(samples), "failures": failures}
+
+
+def bench_throughput(fn, requests: int, concurrency: int) -> dict:
+    calls_before = REGISTRY.total("storygen_api_calls_total")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: timed(fn), range(requests)))
+    wall = time.perf_counter() - started
+    samples = [elapsed for elapsed, _ in results]
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "wall_s": round(wall, 3),
+        "req_per_s": round(requests / wall, 2) if wall else 0.0,
+        "api_calls": int(REGISTRY.total("storygen_api_calls_total") - calls_before),
+        "failures": sum(1 for _, ok in results if not ok),
+        **summarize(samples),
+    }
+
+
+def bench_parse(iterations: int) -> dict:
+    texts = {
+        "story": fake_completion_text({"messages": [{"content": "Anzahl Slides: 10"}]}),
+        "week_plan": fake_completion_text({"messages": [{"content": "7-Tage-Plan"}]}),
+        "story_fenced": "```json\n" + fake_completion_text({"messages": [{"content": "Anzahl Slides: 10"}]}) + "\n```",
+        # Comment, trailing comma and cut-off end: exercises the repair path
+        "story_repaired": fake_completion_text({"messages": [{"content": "Anzahl Slides: 10"}]})
+        .replace('"slides": [', '"slides": [  # 1-100\n', 1)[:-200] + ",",
+    }
+    report = {}
+    for name, text in texts.items():
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            safe_json_loads(text)
+            samples.append(time.perf_counter() - started)
+        stats = summarize(samples)
+        report[name] = {
+            "bytes": len(text.encode("utf-8")),
+            "p50_us": round(stats["p50_ms"] * 1000, 1),
+            "p99_us": round(stats["p99_ms"] * 1000, 1),
+        }
+    return report
+
+
+def bench_validate(iterations: int) -> dict:
+    answers = {
+        "story": ("story", fake_completion_text({"messages": [{"content": "Anzahl Slides: 10"}]})),
+        "viral_story": ("viral_story", fake_completion_text({"messages": [{"content": "viral_score Slides: 10"}]})),
+        "week_plan": ("week_plan", fake_completion_text({"messages": [{"content": "7-Tage-Plan"}]})),
+    }
+    report = {}
+    for name, (schema, text) in answers.items():
+        data = safe_json_loads(text)
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            errors = validate(schema, data)
+            samples.append(time.perf_counter() - started)
+        stats = summarize(samples)
+        report[name] = {
+            "errors": len(errors),
+            "p50_us": round(stats["p50_ms"] * 1000, 1),
+            "p99_us": round(stats["p99_ms"] * 1000, 1),
+        }
+    return report
+
+
+def run(args) -> dict:
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server, base_url = start_mock_server(
+            latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+            error_rate=args.error_rate, jitter=args.jitter, seed=0,
+        )
+    client = get_client("mock", base_url=base_url, max_retries=0)
+    try:
+        report = {"config": vars(args), "latency": {}, "throughput": {}}
+        for name, fn in scenarios(client, args.stream).items():
+            if args.only and name not in args.only:
+                continue
+            report["latency"][name] = bench_latency(fn, args.requests)
+            report["throughput"][name] = [
+                bench_throughput(fn, args.requests, c) for c in args.concurrency
+            ]
+        report["json_parse"] = bench_parse(args.parse_iterations)
+        report["schema_validate"] = bench_validate(args.parse_iterations)
+        return report
+    finally:
+        if server:
+            server.shutdown()
+
+
+def print_report(report: dict):
+    print("LATENCY (sequential)")
+    for name, r in report["latency"].items():
+        print(f"  {name:32s} n={r['n']:<4d} p50={r['p50_ms']:8.1f}ms  p95={r['p95_ms']:8.1f}ms  "
+              f"p99={r['p99_ms']:8.1f}ms  failures={r['failures']}")
+    print("THROUGHPUT")
+    for name, rows in report["throughput"].items():
+        for r in rows:
+            print(f"  {name:32s} c={r['concurrency']:<3d} {r['req_per_s']:7.2f} req/s  "
+                  f"p95={r['p95_ms']:8.1f}ms  api_calls={r['api_calls']:<4d} failures={r['failures']}")
+    print("JSON PARSE")
+    for name, r in report["json_parse"].items():
+        print(f"  {name:24s} {r['bytes']:6d} B  p50={r['p50_us']:7.1f}µs  p99={r['p99_us']:7.1f}µs")
+    print("SCHEMA VALIDATE")
+    for name, r in report["schema_validate"].items():
+        print(f"  {name:24s} errors={r['errors']:<3d} p50={r['p50_us']:7.1f}µs  p99={r['p99_us']:7.1f}µs")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark story generation against a local mock API.")
+    parser.add_argument("--base-url", default=None, help="Use an already running mock instead of starting one")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per measurement")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--tokens-per-sec", type=float, default=2000.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true", help="Use streamed completions where supported")
+    parser.add_argument("--only", nargs="+", default=None, help="Limit to these generate_* functions")
+    parser.add_argument("--parse-iterations", type=int, default=2000)
+    parser.add_argument("--json", default=None, help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
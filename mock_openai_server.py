@@ -0,0 +1,406 @@
+"""
+Offline stand-in for the OpenAI chat completions endpoint.
+
+Answers POST /v1/chat/completions with schema-valid story / week-plan /
+viral JSON, with configurable latency, token rate, SSE streaming and error
+injection. The Batch API workflow (POST /v1/files, POST/GET /v1/batches,
+GET /v1/files/{id}/content with Range support) is simulated as well. No
+network or API key needed, so benchmarks and the batch runners can run on CI:
+
+    python mock_openai_server.py --port 8808 --latency 0.3 --tokens-per-sec 120
+    python story_batch.py topics.csv -o out.jsonl --base-url http://127.0.0.1:8808/v1
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Rough chars per token, good enough for pacing and usage numbers
+CHARS_PER_TOKEN = 4
+
+
+class MockConfig:
+    def __init__(self, latency=0.2, tokens_per_sec=200.0, error_rate=0.0,
+                 error_status=429, jitter=0.0, seed=None, batch_delay=0.0):
+        self.latency = latency            # seconds before the first token
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate      # share of requests that fail
+        self.error_status = error_status  # 429 or 5xx
+        self.jitter = jitter              # +/- share of random latency variation
+        self.batch_delay = batch_delay    # seconds until a batch completes
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.files = {}                   # file id -> (filename, purpose, bytes)
+        self.batches = {}                 # batch id -> batch dict
+        self._lock = threading.Lock()
+
+    def count_request(self) -> int:
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+
+def _find_int(pattern: str, text: str, default: int) -> int:
+    match = re.search(pattern, text)
+    return int(match.group(1)) if match else default
+
+
+def fake_story(prompt: str, viral: bool = False) -> dict:
+    num_slides = _find_int(r"(?:Anzahl Slides|Slides):\s*(\d+)", prompt, 6)
+    slide_length = _find_int(r"(?:Länge pro Slide|Max):?\s*(\d+)", prompt, 160)
+    body = ("Du bist nicht zu empfindlich. Deine Wahrnehmung zählt. " * 5)[:max(20, slide_length - 10)].strip()
+    slides = []
+    for i in range(1, num_slides + 1):
+        slide = {
+            "slide_no": i,
+            "headline": f"Klarheit Schritt {i}",
+            "body": body,
+            "sticker_suggestion": "Umfrage: Kennst du das?",
+            "visual_suggestion": "Ruhiges Blau, Verlauf zu Weiß",
+        }
+        if viral:
+            slide["engagement_tip"] = "Identifikation durch direkte Ansprache"
+        slides.append(slide)
+    data = {
+        "title_hook": "Du bist nicht verrückt",
+        "slides": slides,
+        "caption_variants": ["Du darfst deiner Wahrnehmung trauen.", "Kleine Schritte zählen."],
+        "cta_options": ["Speicher dir das", "Schreib mir KLARHEIT", "Teile es"],
+        "poll_or_question": {"type": "poll", "prompt": "Kennst du das?", "options": ["Ja", "Nein"]},
+        "hashtags": ["gaslighting", "selbstwert", "heilung"],
+        "safety_note": "Keine Diagnose. Bei akuter Gefahr bitte Hilfe holen.",
+    }
+    if viral:
+        data["viral_score"] = 82
+        data["viral_techniques"] = ["Curiosity Gap", "Storytelling"]
+    return data
+
+
+def fake_week_plan() -> dict:
+    return {
+        "week_theme": "Zurück zu dir",
+        "days": [
+            {
+                "day": f"Tag {i}",
+                "goal": "Validierung",
+                "topic": topic,
+                "hook": "Das ist nicht deine Schuld",
+                "slides_outline": ["Einstieg", "Muster erkennen", "Mikro-Schritt"],
+                "interaction": "Umfrage: Kennst du das?",
+                "cta": "Speicher dir das",
+            }
+            for i, topic in enumerate(
+                ["Gaslighting", "Grenzen", "Trauma Bond", "Selbstwert", "Kontrolle", "Schuldumkehr", "Heilung"],
+                start=1,
+            )
+        ],
+        "safety_note": "Keine Diagnose. Bei akuter Gefahr Hilfe holen.",
+    }
+
+
+def fake_completion_text(body: dict) -> str:
+    prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+    if "7-Tage-Plan" in prompt:
+        data = fake_week_plan()
+    else:
+        data = fake_story(prompt, viral="viral_score" in prompt)
+    return json.dumps(data, ensure_ascii=False)
+
+
+def fake_completion(body: dict, text: str = None) -> dict:
+    text = text if text is not None else fake_completion_text(body)
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // CHARS_PER_TOKEN
+    completion_tokens = len(text) // CHARS_PER_TOKEN
+    return {
+        "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": i,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        } for i in range(int(body.get("n", 1)))],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def run_fake_batch(input_jsonl: bytes) -> bytes:
+    """Batch API output file for a batch input file"""
+    lines = []
+    for line in input_jsonl.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        req = json.loads(line)
+        lines.append(json.dumps({
+            "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+            "custom_id": req["custom_id"],
+            "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": fake_completion(req["body"])},
+            "error": None,
+        }, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "MockOpenAI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def cfg(self) -> MockConfig:
+        return self.server.mock_config
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        match = re.search(r"/batches/([^/]+)$", path)
+        if match:
+            self._send_batch(match.group(1))
+            return
+        match = re.search(r"/files/([^/]+)/content$", path)
+        if match:
+            self._send_file(match.group(1))
+            return
+        self._not_found()
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        length = int(self.headers.get("Content-Length", 0))
+        raw_body = self.rfile.read(length)
+        if path.endswith("/files"):
+            self._create_file(raw_body)
+            return
+        if path.endswith("/batches"):
+            self._create_batch(json.loads(raw_body or b"{}"))
+            return
+        if not path.endswith("/chat/completions"):
+            self._not_found()
+            return
+        body = json.loads(raw_body or b"{}")
+        self.cfg.count_request()
+
+        if self.cfg.error_rate and self.cfg.random.random() < self.cfg.error_rate:
+            status = self.cfg.error_status
+            self._send_json(
+                status,
+                {"error": {"message": "Injected mock error", "type": "rate_limit_error" if status == 429 else "server_error"}},
+                extra_headers={"retry-after": "1"} if status == 429 else None,
+            )
+            return
+
+        completion = fake_completion(body)
+        text = completion["choices"][0]["message"]["content"]
+        usage = completion["usage"]
+        time.sleep(self._latency())
+        if body.get("stream"):
+            self._stream(body, text, usage)
+        else:
+            time.sleep(usage["completion_tokens"] / self.cfg.tokens_per_sec)
+            self._send_json(200, completion)
+
+    # Batch API --------------------------------------------------------
+    def _not_found(self):
+        self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def _create_file(self, raw_body: bytes):
+        message = BytesParser(policy=email_policy).parsebytes(
+            b"Content-Type: " + self.headers.get("Content-Type", "").encode("latin-1") + b"\r\n\r\n" + raw_body
+        )
+        fields, filename, content = {}, "upload.jsonl", b""
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                filename, content = part.get_filename(), part.get_payload(decode=True) or b""
+            else:
+                fields[name] = part.get_content().strip()
+        file_id = f"file-mock-{uuid.uuid4().hex[:12]}"
+        with self.cfg._lock:
+            self.cfg.files[file_id] = (filename, fields.get("purpose", "batch"), content)
+        self._send_json(200, self._file_object(file_id))
+
+    def _file_object(self, file_id: str) -> dict:
+        filename, purpose, content = self.cfg.files[file_id]
+        return {
+            "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose, "status": "processed",
+        }
+
+    def _create_batch(self, body: dict):
+        input_file_id = body.get("input_file_id")
+        if input_file_id not in self.cfg.files:
+            self._send_json(400, {"error": {"message": "Unknown input_file_id", "type": "invalid_request_error"}})
+            return
+        batch_id = f"batch_mock_{uuid.uuid4().hex[:12]}"
+        total = sum(1 for line in self.cfg.files[input_file_id][2].splitlines() if line.strip())
+        with self.cfg._lock:
+            self.cfg.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": body.get("endpoint"),
+                "input_file_id": input_file_id, "completion_window": body.get("completion_window", "24h"),
+                "status": "in_progress", "output_file_id": None, "error_file_id": None,
+                "created_at": int(time.time()), "completed_at": None, "metadata": body.get("metadata"),
+                "request_counts": {"total": total, "completed": 0, "failed": 0},
+                "_started": time.monotonic(),
+            }
+        self._send_batch(batch_id)
+
+    def _send_batch(self, batch_id: str):
+        with self.cfg._lock:
+            batch = self.cfg.batches.get(batch_id)
+            if batch and batch["status"] == "in_progress" \
+                    and time.monotonic() - batch["_started"] >= self.cfg.batch_delay:
+                output = run_fake_batch(self.cfg.files[batch["input_file_id"]][2])
+                output_id = f"file-mock-{uuid.uuid4().hex[:12]}"
+                self.cfg.files[output_id] = ("batch_output.jsonl", "batch_output", output)
+                total = batch["request_counts"]["total"]
+                batch.update(status="completed", output_file_id=output_id, completed_at=int(time.time()),
+                             request_counts={"total": total, "completed": total, "failed": 0})
+        if not batch:
+            self._not_found()
+            return
+        self._send_json(200, {k: v for k, v in batch.items() if not k.startswith("_")})
+
+    def _send_file(self, file_id: str):
+        if file_id not in self.cfg.files:
+            self._not_found()
+            return
+        content = self.cfg.files[file_id][2]
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        start = int(match.group(1)) if match else 0
+        if start >= len(content) and match:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(content)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        chunk = content[start:]
+        self.send_response(206 if match else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(chunk)))
+        if match:
+            self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+        self.end_headers()
+        self.wfile.write(chunk)
+
+    def _latency(self) -> float:
+        jitter = self.cfg.jitter * (2 * self.cfg.random.random() - 1)
+        return max(0.0, self.cfg.latency * (1 + jitter))
+
+    def _rate_limit_headers(self) -> dict:
+        return {
+            "x-ratelimit-limit-requests": "10000",
+            "x-ratelimit-remaining-requests": "9999",
+            "x-ratelimit-limit-tokens": "2000000",
+            "x-ratelimit-remaining-tokens": "1999000",
+        }
+
+    def _send_json(self, status: int, payload: dict, extra_headers=None):
+        raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in {**self._rate_limit_headers(), **(extra_headers or {})}.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _stream(self, body: dict, text: str, usage: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        for k, v in self._rate_limit_headers().items():
+            self.send_header(k, v)
+        self.end_headers()
+
+        chunk_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        step = CHARS_PER_TOKEN * 4  # four tokens per SSE event
+        delay = 4 / self.cfg.tokens_per_sec
+        try:
+            for i in range(0, len(text), step):
+                self._sse(self._chunk(chunk_id, created, body, {"content": text[i:i + step]}, None))
+                time.sleep(delay)
+            final = self._chunk(chunk_id, created, body, {}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                final["usage"] = usage
+            self._sse(final)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client went away (e.g. cancelled)
+
+    @staticmethod
+    def _chunk(chunk_id, created, body, delta, finish_reason) -> dict:
+        return {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    def _sse(self, payload: dict):
+        self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # A client closing its keep-alive connection (e.g. after a stream) is not an error
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, **config):
+    """Start the mock in a daemon thread. Returns (server, base_url); call server.shutdown() to stop."""
+    server = MockServer((host, port), MockHandler)
+    server.mock_config = MockConfig(**config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local mock of the OpenAI chat completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds until the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random latency variation, e.g. 0.2 = ±20%%")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail (0-1)")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="Seconds until a submitted batch completes")
+    args = parser.parse_args(argv)
+
+    server = MockServer((args.host, args.port), MockHandler)
+    server.mock_config = MockConfig(
+        latency=args.latency, tokens_per_sec=args.tokens_per_sec, error_rate=args.error_rate,
+        error_status=args.error_status, jitter=args.jitter, seed=args.seed, batch_delay=args.batch_delay,
+    )
+    print(f"Mock OpenAI listening on http://{args.host}:{server.server_address[1]}/v1", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+"""
+Telemetrie: per-call metrics of this server process (story_metrics.REGISTRY),
+shared by Storygen.py and Storygenv2.py. Refreshes every few seconds.
+"""
+import streamlit as st
+
+from story_metrics import METRICS_PORT, REGISTRY
+from story_ui import login_gate, render_metrics_dashboard
+
+REFRESH_SECONDS = 5
+
+login_gate()
+st.title("📊 Telemetrie")
+st.caption("Latenz, Tokens, Kosten, Retries und Cache-Treffer aller API-Aufrufe dieses Servers."
+           + (f" Prometheus: :{METRICS_PORT}/metrics" if METRICS_PORT else ""))
+
+
+@st.fragment(run_every=REFRESH_SECONDS)
+def dashboard():
+    render_metrics_dashboard(REGISTRY)
+
+
+dashboard()
@@ -0,0 +1,352 @@
+"""
+User accounts, signed session tokens and per-user daily quotas.
+
+Accounts (bcrypt password hashes, daily token / request limits) live in one
+SQLite file. The slow bcrypt check runs once per login; the session then
+carries an HMAC-signed token (user, expiry, token version) that is verified
+on every rerun in microseconds. Changing a password bumps the token version
+and removing a user deletes it; either ends the user's open sessions.
+
+Quotas are checked in memory: QuotaLedger reserves the estimated tokens of
+a call under one lock (atomic across all sessions of the server process),
+settles them with the real usage afterwards and persists the day's totals,
+so a restart keeps the counts. Login is only required once an account exists.
+
+    python story_auth.py add alice --tokens 200000 --requests 200
+    python story_auth.py passwd alice
+    python story_auth.py quota alice --tokens 500000
+    python story_auth.py list
+"""
+import os
+import re
+import sys
+import hmac
+import time
+import base64
+import sqlite3
+import getpass
+import hashlib
+import secrets
+import argparse
+import threading
+from datetime import date
+
+import bcrypt
+
+from story_metrics import usage_tokens
+from story_ratelimit import estimate_tokens
+
+DEFAULT_USERS_PATH = os.getenv("STORYGEN_USERS_PATH", ".storygen_users.sqlite3")
+AUTH_SECRET = os.getenv("STORYGEN_AUTH_SECRET", "")
+TOKEN_TTL = 12 * 3600
+BCRYPT_ROUNDS = 12
+# Defaults for new accounts; 0 = unlimited
+DEFAULT_DAILY_TOKENS = 200_000
+DEFAULT_DAILY_REQUESTS = 200
+# Accounts are re-read this often, so CLI changes reach a running app
+USERS_RELOAD_S = 30.0
+
+_USERNAME_RE = re.compile(r"^[\w.@-]{1,64}$")
+
+
+class QuotaExceeded(Exception):
+    """A call would exceed the user's daily token or request limit"""
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class UserStore:
+    """Accounts and their persisted daily usage in one SQLite file. Safe to share between threads."""
+
+    def __init__(self, path: str = DEFAULT_USERS_PATH, secret: str = AUTH_SECRET):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                password_hash BLOB NOT NULL,
+                daily_tokens INTEGER NOT NULL,
+                daily_requests INTEGER NOT NULL,
+                token_version INTEGER NOT NULL DEFAULT 1,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS usage (
+                username TEXT NOT NULL,
+                day TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                requests INTEGER NOT NULL,
+                PRIMARY KEY (username, day)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB NOT NULL);
+            """
+        )
+        self._conn.commit()
+        self._secret = secret.encode("utf-8") if secret else self._stored_secret()
+        self._users, self._loaded = {}, 0.0
+        self._dummy_hash = None
+        self.ledger = QuotaLedger(self)
+
+    def _stored_secret(self) -> bytes:
+        # Generated once per users file, so tokens stay valid across restarts and processes
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('secret', ?)", (secrets.token_bytes(32),))
+            self._conn.commit()
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'secret'").fetchone()[0]
+
+    # -----------------------------
+    # Accounts
+    # -----------------------------
+    def users(self) -> dict:
+        """{username: {"daily_tokens", "daily_requests", "token_version"}}, re-read every USERS_RELOAD_S"""
+        if time.monotonic() - self._loaded > USERS_RELOAD_S:
+            self.reload()
+        return self._users
+
+    def reload(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT username, daily_tokens, daily_requests, token_version FROM users").fetchall()
+        self._users = {
+            name: {"daily_tokens": tokens, "daily_requests": requests, "token_version": version}
+            for name, tokens, requests, version in rows
+        }
+        self._loaded = time.monotonic()
+
+    def has_users(self) -> bool:
+        return bool(self.users())
+
+    def add_user(self, username: str, password: str, daily_tokens: int = DEFAULT_DAILY_TOKENS,
+                 daily_requests: int = DEFAULT_DAILY_REQUESTS):
+        if not _USERNAME_RE.match(username):
+            raise ValueError("Username: 1-64 letters, digits, . _ @ -")
+        password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(BCRYPT_ROUNDS))
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO users (username, password_hash, daily_tokens, daily_requests, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (username, password_hash, daily_tokens, daily_requests, time.time()),
+            )
+            self._conn.commit()
+        self.reload()
+
+    def set_password(self, username: str, password: str):
+        """New password; open sessions of the user are logged out"""
+        password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(BCRYPT_ROUNDS))
+        self._update(username, "UPDATE users SET password_hash = ?, token_version = token_version + 1 "
+                               "WHERE username = ?", (password_hash, username))
+
+    def set_quota(self, username: str, daily_tokens: int = None, daily_requests: int = None):
+        self._update(username, "UPDATE users SET daily_tokens = COALESCE(?, daily_tokens), "
+                               "daily_requests = COALESCE(?, daily_requests) WHERE username = ?",
+                     (daily_tokens, daily_requests, username))
+
+    def remove_user(self, username: str):
+        """Delete the account (its sessions end, its usage rows stay)"""
+        self._update(username, "DELETE FROM users WHERE username = ?", (username,))
+
+    def _update(self, username: str, sql: str, params: tuple):
+        with self._lock:
+            changed = self._conn.execute(sql, params).rowcount
+            self._conn.commit()
+        if not changed:
+            raise KeyError(username)
+        self.reload()
+
+    def verify_password(self, username: str, password: str) -> bool:
+        """bcrypt check (deliberately slow); unknown users cost the same time"""
+        with self._lock:
+            row = self._conn.execute("SELECT password_hash FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = bcrypt.hashpw(b"dummy", bcrypt.gensalt(BCRYPT_ROUNDS))
+            bcrypt.checkpw(password.encode("utf-8"), self._dummy_hash)
+            return False
+        return bcrypt.checkpw(password.encode("utf-8"), row[0])
+
+    # -----------------------------
+    # Session tokens
+    # -----------------------------
+    def issue_token(self, username: str, ttl: float = TOKEN_TTL) -> str:
+        version = self.users()[username]["token_version"]
+        payload = f"{username}\n{int(time.time() + ttl)}\n{version}".encode("utf-8")
+        signature = hmac.new(self._secret, payload, hashlib.sha256).digest()
+        return f"{_b64(payload)}.{_b64(signature)}"
+
+    def verify_token(self, token: str):
+        """Username of a valid, unexpired token of an existing user, else None (no bcrypt involved)"""
+        if not token or "." not in token:
+            return None
+        try:
+            payload_b64, signature_b64 = token.split(".", 1)
+            payload = _unb64(payload_b64)
+            if not hmac.compare_digest(hmac.new(self._secret, payload, hashlib.sha256).digest(),
+                                       _unb64(signature_b64)):
+                return None
+            username, expires, version = payload.decode("utf-8").split("\n")
+        except ValueError:
+            return None
+        user = self.users().get(username)
+        if user is None or int(expires) < time.time() or int(version) != user["token_version"]:
+            return None
+        return username
+
+    def login(self, username: str, password: str):
+        """Signed session token, or None for wrong credentials"""
+        if not self.verify_password(username, password):
+            return None
+        self.reload()  # the account may be new to this process
+        return self.issue_token(username)
+
+    # -----------------------------
+    # Persisted usage
+    # -----------------------------
+    def load_usage(self, day: str) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT username, tokens, requests FROM usage WHERE day = ?", (day,)).fetchall()
+        return {name: [tokens, requests] for name, tokens, requests in rows}
+
+    def add_usage(self, username: str, day: str, tokens: int, requests: int = 1):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO usage VALUES (?, ?, ?, ?) ON CONFLICT (username, day) DO UPDATE SET "
+                "tokens = tokens + excluded.tokens, requests = requests + excluded.requests",
+                (username, day, tokens, requests),
+            )
+            self._conn.commit()
+
+
+# -----------------------------
+# Quotas
+# -----------------------------
+class QuotaLedger:
+    """
+    Today's usage per user in memory. reserve() is a dict update under one
+    lock (microseconds), so concurrent sessions of a user can't overshoot;
+    the day's totals are also written to the UserStore after each call.
+    """
+
+    def __init__(self, store: UserStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._day = None
+        self._used = {}  # username -> [tokens, requests] of self._day
+
+    def _rollover(self):
+        day = date.today().isoformat()
+        if day != self._day:
+            self._day, self._used = day, self.store.load_usage(day)
+
+    def reserve(self, username: str, tokens: int):
+        """Count one request with `tokens` estimated tokens, or raise QuotaExceeded"""
+        limits = self.store.users().get(username)
+        if limits is None:
+            raise QuotaExceeded("Unbekannter Benutzer")
+        with self._lock:
+            self._rollover()
+            used = self._used.setdefault(username, [0, 0])
+            if limits["daily_requests"] and used[1] + 1 > limits["daily_requests"]:
+                raise QuotaExceeded(f"Tageslimit erreicht: {limits['daily_requests']} Anfragen pro Tag.")
+            if limits["daily_tokens"] and used[0] + tokens > limits["daily_tokens"]:
+                raise QuotaExceeded(f"Tageslimit erreicht: noch {max(0, limits['daily_tokens'] - used[0]):,} "
+                                    f"von {limits['daily_tokens']:,} Tokens übrig.".replace(",", "."))
+            used[0] += tokens
+            used[1] += 1
+            return self._day
+
+    def release(self, username: str, day: str, tokens: int):
+        """Undo a reservation (the call failed)"""
+        with self._lock:
+            if day == self._day:
+                self._used[username][0] -= tokens
+                self._used[username][1] -= 1
+
+    def settle(self, username: str, day: str, reserved: int, actual: int = None):
+        """Replace the estimate with the real usage (kept if the answer had none) and persist it"""
+        actual = reserved if actual is None else actual
+        with self._lock:
+            if day == self._day:
+                self._used[username][0] += actual - reserved
+        self.store.add_usage(username, day, actual)
+
+    def usage(self, username: str) -> dict:
+        limits = self.store.users().get(username, {})
+        with self._lock:
+            self._rollover()
+            tokens, requests = self._used.get(username, (0, 0))
+        return {"tokens": tokens, "requests": requests,
+                "daily_tokens": limits.get("daily_tokens", 0), "daily_requests": limits.get("daily_requests", 0)}
+
+
+class SessionQuota:
+    """The quota of one logged-in user; story_core.run_completion(quota=...) charges every call to it"""
+
+    def __init__(self, ledger: QuotaLedger, username: str):
+        self.ledger = ledger
+        self.username = username
+
+    def reserve(self, request: dict) -> tuple:
+        tokens = estimate_tokens(request)
+        return self.ledger.reserve(self.username, tokens), tokens
+
+    def release(self, reservation: tuple):
+        self.ledger.release(self.username, *reservation)
+
+    def settle(self, reservation: tuple, usage=None):
+        prompt, completion = usage_tokens(usage)
+        self.ledger.settle(self.username, *reservation, actual=prompt + completion if usage is not None else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage Storygen user accounts and daily quotas.")
+    parser.add_argument("--path", default=DEFAULT_USERS_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("add", "quota"):
+        cmd = sub.add_parser(name)
+        cmd.add_argument("username")
+        cmd.add_argument("--tokens", type=int, default=DEFAULT_DAILY_TOKENS if name == "add" else None,
+                         help="Daily token limit (0 = unlimited)")
+        cmd.add_argument("--requests", type=int, default=DEFAULT_DAILY_REQUESTS if name == "add" else None,
+                         help="Daily request limit (0 = unlimited)")
+    sub.add_parser("passwd").add_argument("username")
+    sub.add_parser("remove").add_argument("username")
+    sub.add_parser("list")
+    args = parser.parse_args(argv)
+
+    store = UserStore(args.path)
+    try:
+        if args.command in ("add", "passwd"):
+            password = getpass.getpass("Passwort: ")
+            if not password or password != getpass.getpass("Wiederholen: "):
+                print("Passwords empty or not matching", file=sys.stderr)
+                return 1
+            if args.command == "add":
+                store.add_user(args.username, password, args.tokens, args.requests)
+            else:
+                store.set_password(args.username, password)
+        elif args.command == "quota":
+            store.set_quota(args.username, args.tokens, args.requests)
+        elif args.command == "remove":
+            store.remove_user(args.username)
+        else:
+            for name, limits in sorted(store.users().items()):
+                used = store.ledger.usage(name)
+                print(f"{name}\t{used['tokens']}/{limits['daily_tokens'] or '∞'} tokens\t"
+                      f"{used['requests']}/{limits['daily_requests'] or '∞'} requests today")
+    except (KeyError, ValueError, sqlite3.IntegrityError) as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
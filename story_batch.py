@@ -0,0 +1,233 @@
+"""
+Headless batch runner: generate many stories from a JSONL/CSV manifest.
+
+Each input row is a config (same keys as the app's cfg; missing keys fall
+back to story_core.DEFAULT_CFG). Optional per-row keys:
+  id, mode ("story" | "viral" | "week"), model ("auto" = story_cascade), temperature,
+  urgency, emotion, viral_elements (viral mode; "|" separated in CSV)
+
+Results are appended to the output JSONL as soon as each job finishes, so an
+interrupted run keeps everything that was already done. Re-running with the
+same output file skips rows whose id already has a successful result.
+
+    python story_batch.py topics.csv -o stories.jsonl --concurrency 8
+"""
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from story_cache import ResponseCache
+from story_cascade import AUTO_MODEL, STATS as CASCADE_STATS, resolve_model, route
+from story_dedup import DuplicateIndex, generate_unique
+from story_history import HistoryStore
+from story_nogo import enforce_no_gos
+from story_metrics import METRICS_FILE, REGISTRY as METRICS_REGISTRY
+from story_schema import STATS as SCHEMA_STATS
+from story_client import get_client
+from story_ratelimit import DEFAULT_RPM, DEFAULT_TPM, RateLimitScheduler
+from story_core import (
+    DEFAULT_CFG,
+    DEFAULT_CREATIVITY,
+    DEFAULT_MODEL,
+    DEFAULT_VIRAL_CFG,
+    generate_single_story,
+    generate_viral_story,
+    generate_week_plan,
+)
+
+MODES = ("story", "viral", "week")
+INT_FIELDS = ("slide_length", "num_slides", "urgency", "emotion")
+
+
+def read_manifest(path: str) -> list:
+    """Rows of a .jsonl or .csv manifest as dicts (blank lines / cells ignored)"""
+    rows = []
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                rows.append({k: v for k, v in row.items() if k and v not in (None, "")})
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    rows.append(json.loads(line))
+    return rows
+
+
+def build_job(index: int, row: dict, args) -> dict:
+    cfg = dict(DEFAULT_CFG)
+    cfg.update({k: row[k] for k in DEFAULT_CFG if k in row})
+    for key in INT_FIELDS:
+        if key in cfg:
+            cfg[key] = int(cfg[key])
+
+    viral_cfg = dict(DEFAULT_VIRAL_CFG)
+    for key in ("urgency", "emotion"):
+        if key in row:
+            viral_cfg[key] = int(row[key])
+    if "viral_elements" in row:
+        elements = row["viral_elements"]
+        viral_cfg["viral_elements"] = elements.split("|") if isinstance(elements, str) else elements
+
+    mode = row.get("mode", args.mode)
+    if mode not in MODES:
+        raise ValueError(f"Row {index}: unknown mode {mode!r}")
+
+    return {
+        "id": str(row.get("id", index)),
+        "index": index,
+        "mode": mode,
+        "model": row.get("model", args.model),
+        "temperature": float(row.get("temperature", args.temperature)),
+        "cfg": cfg,
+        "viral_cfg": viral_cfg if mode == "viral" else None,
+    }
+
+
+def run_job(client, job: dict, cache=None, force_fresh=False, scheduler=None, history=None,
+            dedup=None, rerolls=0, repair=True) -> dict:
+    started = time.perf_counter()
+    result = {k: job[k] for k in ("id", "index", "mode", "model", "temperature", "cfg")}
+    try:
+        model, temperature, cfg = resolve_model(job["model"]), job["temperature"], job["cfg"]
+        opts = {"cache": cache, "force_fresh": force_fresh, "scheduler": scheduler, "history": history,
+                "index": dedup, "rerolls": rerolls}
+        if job["model"] == AUTO_MODEL:
+            generate, args, schema = {
+                "viral": (generate_viral_story, (job["viral_cfg"],), "viral_story"),
+                "week": (generate_week_plan, (), "week_plan"),
+            }.get(job["mode"], (generate_single_story, (), "story"))
+            opts.pop("rerolls")
+            data, raw, cascade = route(generate, client, temperature, cfg, *args, schema=schema, **opts)
+            duplicates = cascade["duplicates"]
+            result["cascade"] = {k: cascade[k] for k in ("model", "escalated", "slide_model", "problems")}
+        elif job["mode"] == "viral":
+            data, raw, duplicates = generate_unique(generate_viral_story, client, model, temperature, cfg,
+                                                    job["viral_cfg"], **opts)
+        elif job["mode"] == "week":
+            data, raw, duplicates = generate_unique(generate_week_plan, client, model, temperature, cfg, **opts)
+        else:
+            data, raw, duplicates = generate_unique(generate_single_story, client, model, temperature, cfg, **opts)
+        completion_opts = {k: opts[k] for k in ("cache", "scheduler", "history")}
+        data, no_go_hits, repaired = enforce_no_gos(client, model, temperature, cfg, data, repair=repair,
+                                                    **completion_opts)
+        result.update(ok=bool(data), data=data, raw=None if data else raw, error=None, duplicates=duplicates,
+                      no_go_hits=[{k: hit[k] for k in ("field", "term", "match")} for hit in no_go_hits],
+                      repaired=repaired)
+    except Exception as e:
+        result.update(ok=False, data=None, raw=None, error=f"{type(e).__name__}: {e}")
+    result["latency_s"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def completed_ids(path: str) -> set:
+    """Ids with a successful result in an existing output file (for resume)"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line of a crashed run
+            if rec.get("ok"):
+                done.add(str(rec.get("id")))
+    return done
+
+
+def run_batch(client, jobs: list, out_path: str, concurrency: int = 4, cache=None,
+              force_fresh=False, scheduler=None, history=None, dedup=None, rerolls=0, repair=True,
+              log=print) -> dict:
+    """Run jobs with bounded concurrency, appending each result to out_path when it completes"""
+    write_lock = threading.Lock()
+    counts = {"ok": 0, "failed": 0}
+    started = time.perf_counter()
+
+    with open(out_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [
+            pool.submit(run_job, client, job, cache=cache, force_fresh=force_fresh, scheduler=scheduler,
+                        history=history, dedup=dedup, rerolls=rerolls, repair=repair)
+            for job in jobs
+        ]
+        for done, fut in enumerate(as_completed(futures), start=1):
+            result = fut.result()
+            with write_lock:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+            counts["ok" if result["ok"] else "failed"] += 1
+            log(f"[{done}/{len(jobs)}] {result['id']} "
+                f"{'ok' if result['ok'] else 'FAILED'} {result['latency_s']:.2f}s"
+                + (f" {len(result['duplicates'])} near-duplicates" if result.get("duplicates") else "")
+                + (f" repaired: {', '.join(result['repaired'])}" if result.get("repaired") else "")
+                + (f" {len(result['no_go_hits'])} no-go hits left" if result.get("no_go_hits") else "")
+                + (f" {result['error']}" if result.get("error") else ""))
+
+    counts["elapsed_s"] = round(time.perf_counter() - started, 3)
+    counts["schema"] = SCHEMA_STATS.snapshot()
+    counts["cascade"] = CASCADE_STATS.snapshot()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate IG stories in bulk from a JSONL/CSV manifest.")
+    parser.add_argument("manifest", help="Input .jsonl or .csv with one config per row")
+    parser.add_argument("-o", "--output", required=True, help="Output .jsonl (appended, used for resume)")
+    parser.add_argument("--mode", choices=MODES, default="story", help="Default mode for rows without 'mode'")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--temperature", type=float, default=DEFAULT_CREATIVITY)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--base-url", default=None, help="Alternative API endpoint (e.g. a local mock)")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or write the response cache")
+    parser.add_argument("--force-fresh", action="store_true", help="Skip cache reads, still store results")
+    parser.add_argument("--no-history", action="store_true", help="Don't record generations in the history")
+    parser.add_argument("--no-dedup", action="store_true", help="Don't check against the near-duplicate index")
+    parser.add_argument("--rerolls", type=int, default=0,
+                        help="Regenerate stories with near-duplicate hooks/slides up to N times (0 = only flag)")
+    parser.add_argument("--no-repair", action="store_true", help="Only flag no-go terms, don't rewrite the slides")
+    parser.add_argument("--no-resume", action="store_true", help="Re-run rows already in the output file")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_RPM, help="Requests per minute budget")
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TPM, help="Tokens per minute budget")
+    parser.add_argument("--metrics-file", default=METRICS_FILE or None,
+                        help="Write Prometheus metrics (tokens, cost, latency, retries) here at the end")
+    args = parser.parse_args(argv)
+
+    jobs = [build_job(i, row, args) for i, row in enumerate(read_manifest(args.manifest))]
+    if not args.no_resume:
+        done = completed_ids(args.output)
+        skipped = sum(1 for job in jobs if job["id"] in done)
+        jobs = [job for job in jobs if job["id"] not in done]
+        if skipped:
+            print(f"Resuming: {skipped} rows already done", file=sys.stderr)
+
+    client = get_client(os.getenv("OPENAI_API_KEY", ""), base_url=args.base_url)
+    cache = None if args.no_cache else ResponseCache()
+
+    counts = run_batch(
+        client, jobs, args.output,
+        concurrency=args.concurrency,
+        cache=cache,
+        force_fresh=args.force_fresh,
+        scheduler=RateLimitScheduler(rpm=args.rpm, tpm=args.tpm),
+        history=None if args.no_history else HistoryStore(),
+        dedup=None if args.no_dedup else DuplicateIndex(),
+        rerolls=args.rerolls,
+        repair=not args.no_repair,
+        log=lambda msg: print(msg, file=sys.stderr),
+    )
+    print(json.dumps(counts), file=sys.stderr)
+    print(json.dumps(METRICS_REGISTRY.summary()), file=sys.stderr)
+    if args.metrics_file:
+        METRICS_REGISTRY.write_textfile(args.metrics_file)
+    return 0 if counts["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
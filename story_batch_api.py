@@ -0,0 +1,281 @@
+"""
+Bulk generation through the OpenAI Batch API (half price, results within 24h).
+
+Same manifest format as story_batch.py. The configs are turned into a
+Batch-API JSONL with exactly the messages the apps send (story_core request
+builders), submitted, polled and parsed back into the story schema. Output
+records match story_batch.py's, so both runners feed the same downstream.
+
+Every step is resumable: the batch id and job list live in
+<output>.batch.json, the result file is downloaded with HTTP Range resume
+into <output>.batch_output.jsonl.part, and already parsed ids are skipped.
+
+    python story_batch_api.py submit topics.csv -o month.jsonl
+    python story_batch_api.py status -o month.jsonl
+    python story_batch_api.py collect -o month.jsonl --wait
+    python story_batch_api.py run topics.csv -o month.jsonl --base-url http://127.0.0.1:8808/v1
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import openai
+
+from story_batch import MODES, build_job, completed_ids, read_manifest
+from story_cascade import resolve_model
+from story_client import get_client
+from story_core import DEFAULT_CREATIVITY, DEFAULT_MODEL, story_request, viral_request, week_plan_request
+from story_dedup import DuplicateIndex
+from story_history import HistoryStore
+from story_json import parse_json
+from story_schema import STATS as SCHEMA_STATS, api_request, schema_name, validate
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+DOWNLOAD_CHUNK = 1 << 16
+
+
+def job_request(job: dict) -> dict:
+    """
+    The chat completion body the apps would send for this job. Model "auto"
+    uses the cascade's first tier only: there is no second pass in a batch.
+    """
+    model = resolve_model(job["model"])
+    if job["mode"] == "viral":
+        return viral_request(model, job["temperature"], job["cfg"], job["viral_cfg"])
+    if job["mode"] == "week":
+        return week_plan_request(model, job["temperature"], job["cfg"])
+    return story_request(model, job["temperature"], job["cfg"])
+
+
+def write_batch_input(jobs: list, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        for job in jobs:
+            f.write(json.dumps({
+                "custom_id": job["id"],
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": api_request(job_request(job)),
+            }, ensure_ascii=False) + "\n")
+
+
+def state_path(output: str) -> str:
+    return output + ".batch.json"
+
+
+def load_state(output: str):
+    try:
+        with open(state_path(output), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_state(output: str, state: dict):
+    tmp = state_path(output) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, state_path(output))
+
+
+def submit(client, jobs: list, output: str, log=print) -> dict:
+    """Upload the batch input and create the batch (no-op if already submitted)"""
+    state = load_state(output)
+    if state and state.get("batch_id"):
+        log(f"Already submitted: {state['batch_id']}")
+        return state
+    if not jobs:
+        raise ValueError("Nothing to submit")
+    if len({job["id"] for job in jobs}) != len(jobs):
+        raise ValueError("Job ids must be unique (they become the batch custom_id)")
+
+    input_path = output + ".batch_input.jsonl"
+    write_batch_input(jobs, input_path)
+    with open(input_path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+        metadata={"source": "storygen", "jobs": str(len(jobs))},
+    )
+    state = {
+        "batch_id": batch.id,
+        "input_file_id": uploaded.id,
+        "status": batch.status,
+        "submitted_at": time.time(),
+        "jobs": jobs,
+    }
+    save_state(output, state)
+    log(f"Submitted {len(jobs)} requests as {batch.id}")
+    return state
+
+
+def poll(client, output: str, wait: bool = False, interval: float = 60.0, log=print):
+    """Refresh the batch status in the state file; with wait=True block until it is terminal"""
+    state = load_state(output)
+    if not state:
+        raise FileNotFoundError(f"No batch state at {state_path(output)}, submit first")
+    while True:
+        batch = client.batches.retrieve(state["batch_id"])
+        counts = getattr(batch, "request_counts", None)
+        state.update(
+            status=batch.status,
+            output_file_id=batch.output_file_id,
+            error_file_id=batch.error_file_id,
+        )
+        save_state(output, state)
+        log(f"{batch.id}: {batch.status}"
+            + (f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""))
+        if batch.status in TERMINAL_STATES or not wait:
+            return state
+        time.sleep(interval)
+
+
+def download(client, file_id: str, dest: str):
+    """Download a file, continuing a previous partial download via HTTP Range"""
+    if os.path.exists(dest):
+        return dest
+    part = dest + ".part"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else None
+    try:
+        with client.files.with_streaming_response.content(file_id, extra_headers=headers) as resp:
+            if offset and resp.status_code != 206:
+                offset = 0  # server ignored the Range header, start over
+            with open(part, "ab" if offset else "wb") as f:
+                for chunk in resp.iter_bytes(DOWNLOAD_CHUNK):
+                    f.write(chunk)
+    except openai.APIStatusError as e:
+        if e.status_code != 416:  # 416: the part file is already complete
+            raise
+    os.replace(part, dest)
+    return dest
+
+
+def parse_result_line(rec: dict, job: dict) -> dict:
+    """One Batch-API output record -> story_batch.py result record"""
+    result = {k: job.get(k) for k in ("id", "index", "mode", "model", "temperature", "cfg")}
+    result["id"] = rec.get("custom_id", result["id"])
+    response = rec.get("response") or {}
+    body = response.get("body") or {}
+    error = rec.get("error") or (body.get("error") if response.get("status_code") != 200 else None)
+    if error:
+        message = error.get("message", error) if isinstance(error, dict) else error
+        result.update(ok=False, data=None, raw=None, error=str(message), usage=None)
+        return result
+
+    text = (body.get("choices") or [{}])[0].get("message", {}).get("content") or ""
+    parsed = parse_json(text)
+    result.update(
+        ok=bool(parsed.data),
+        data=parsed.data,
+        raw=None if parsed.data else text,
+        error=None if parsed.data else "unparseable output",
+        usage=body.get("usage"),
+    )
+    return result
+
+
+def collect(client, output: str, history=None, dedup=None, log=print) -> dict:
+    """
+    Download the batch results and append parsed records to output (skipping
+    ids already there). Successful stories are also recorded in history and
+    checked against / added to the near-duplicate index (flagged, no re-roll).
+    Schema violations are listed per record (schema_errors); there is no retry.
+    """
+    state = load_state(output)
+    if not state or state.get("status") != "completed":
+        state = poll(client, output, log=log)
+    if state["status"] != "completed":
+        raise RuntimeError(f"Batch {state['batch_id']} is {state['status']}, nothing to collect yet")
+
+    jobs = {job["id"]: job for job in state["jobs"]}
+    done = completed_ids(output)
+    counts = {"ok": 0, "failed": 0, "skipped": 0, "invalid": 0}
+    files = [state.get("output_file_id"), state.get("error_file_id")]
+    with open(output, "a", encoding="utf-8") as out:
+        for suffix, file_id in zip(("output", "errors"), files):
+            if not file_id:
+                continue
+            path = download(client, file_id, f"{output}.batch_{suffix}.jsonl")
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    rec = json.loads(line)
+                    if rec.get("custom_id") in done:
+                        counts["skipped"] += 1
+                        continue
+                    job = jobs.get(rec.get("custom_id"))
+                    if job is None:
+                        # Not a job of this batch (stale state or foreign output file)
+                        log(f"unknown custom_id {rec.get('custom_id')!r}, skipped: {line.strip()[:200]}")
+                        counts["failed"] += 1
+                        continue
+                    result = parse_result_line(rec, job)
+                    name = schema_name(job_request(job)) if result["ok"] else None
+                    if name:
+                        result["schema_errors"] = validate(name, result["data"])
+                        SCHEMA_STATS.record(name, invalid=int(bool(result["schema_errors"])),
+                                            failed=bool(result["schema_errors"]))
+                        counts["invalid"] += bool(result["schema_errors"])
+                    if dedup and result["ok"]:
+                        result["duplicates"] = dedup.check(result["data"])
+                        dedup.add(result["data"], topic=job["cfg"].get("topic"), source=result["id"])
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    if history and result["ok"]:
+                        history.record(job_request(job), "", result["data"], usage=result["usage"],
+                                       kind=job["mode"], cfg=job["cfg"], viral_cfg=job.get("viral_cfg"))
+                    counts["ok" if result["ok"] else "failed"] += 1
+            out.flush()
+    log(json.dumps(counts))
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate IG stories via the OpenAI Batch API.")
+    parser.add_argument("command", choices=("submit", "status", "collect", "run"))
+    parser.add_argument("manifest", nargs="?", help="Input .jsonl or .csv (submit / run)")
+    parser.add_argument("-o", "--output", required=True, help="Result .jsonl; state files are stored next to it")
+    parser.add_argument("--mode", choices=MODES, default="story")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--temperature", type=float, default=DEFAULT_CREATIVITY)
+    parser.add_argument("--base-url", default=None, help="Alternative API endpoint (e.g. the local mock)")
+    parser.add_argument("--wait", action="store_true", help="collect: wait until the batch is done")
+    parser.add_argument("--poll-interval", type=float, default=60.0)
+    parser.add_argument("--no-dedup", action="store_true", help="Don't check against the near-duplicate index")
+    parser.add_argument("--no-history", action="store_true", help="Don't record collected stories in the history")
+    args = parser.parse_args(argv)
+
+    log = lambda msg: print(msg, file=sys.stderr)
+    client = get_client(os.getenv("OPENAI_API_KEY", ""), base_url=args.base_url)
+
+    if args.command in ("submit", "run"):
+        if not load_state(args.output):
+            if not args.manifest:
+                parser.error("manifest is required for submit/run")
+            jobs = [build_job(i, row, args) for i, row in enumerate(read_manifest(args.manifest))]
+            submit(client, jobs, args.output, log=log)
+        if args.command == "submit":
+            return 0
+    if args.command == "status":
+        poll(client, args.output, log=log)
+        return 0
+
+    wait = args.wait or args.command == "run"
+    state = poll(client, args.output, wait=wait, interval=args.poll_interval, log=log)
+    if state["status"] != "completed":
+        log(f"Batch is {state['status']}")
+        return 1 if state["status"] in TERMINAL_STATES else 0
+    counts = collect(client, args.output,
+                     history=None if args.no_history else HistoryStore(),
+                     dedup=None if args.no_dedup else DuplicateIndex(), log=log)
+    return 0 if counts["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+Model cascade ("🔀 Automatisch"): cheap model first, the larger one only where needed.
+
+route() generates with the first tier (gpt-4o-mini) and checks the answer
+locally, without further API calls: schema and slide count (story_schema),
+slide length, no-go terms (story_nogo) and near-duplicates (story_dedup).
+
+- Problems of the story as a whole (schema, wrong slide count, no-go terms
+  or duplicates in hook / captions, more than MAX_SLIDE_SHARE of the slides
+  failing) regenerate the story with the next tier.
+- Problems of single slides only revise those slides (story_core.revise_slide,
+  "shorten" for slides that are merely too long) with the next tier; the
+  rest of the story stays as the cheap model wrote it.
+
+STATS counts per model how often a story passed all checks as it was
+written ("story") and how often a revised slide passed them ("slide"); the
+same counts go to story_metrics.REGISTRY (storygen_cascade_total).
+"""
+import os
+import threading
+
+from story_core import revise_slide
+from story_dedup import story_key
+from story_metrics import REGISTRY
+from story_nogo import find_no_gos, get_matcher
+from story_variants import LENGTH_TOLERANCE, schema_problems
+
+AUTO_MODEL = "auto"
+TIERS = tuple(m.strip() for m in os.getenv("STORYGEN_CASCADE", "gpt-4o-mini,gpt-4o").split(",") if m.strip())
+# More failing slides than this share: cheaper to regenerate the whole story
+MAX_SLIDE_SHARE = 0.5
+TOO_LONG = "zu lang"
+
+
+def model_label(model: str) -> str:
+    """Selectbox label: the cascade gets a readable name, real models stay as they are"""
+    return f"🔀 Automatisch ({' → '.join(TIERS)})" if model == AUTO_MODEL else model
+
+
+def resolve_model(model: str) -> str:
+    """The model for calls that are not cascaded (variants, repairs, slide actions)"""
+    return TIERS[0] if model == AUTO_MODEL else model
+
+
+# -----------------------------
+# Local checks
+# -----------------------------
+def _slide_index(data: dict, label: str):
+    """Position of the slide a story_dedup / story_nogo field label ("Slide 3 · …") points to"""
+    head = label.split(" · ")[0]
+    if not head.startswith("Slide "):
+        return None
+    number = head[len("Slide "):]
+    for i, slide in enumerate(data.get("slides") or []):
+        if isinstance(slide, dict) and str(slide.get("slide_no", i + 1)) == number:
+            return i
+    return None
+
+
+def check_story(data, cfg: dict, schema: str = "story", index=None, lexicon: bool = True, key: str = None) -> dict:
+    """
+    Problems of an answer: {"story": [reasons], "slides": {slide position:
+    [reasons]}, "duplicates": index.check(data, key=key)}. Empty "story" and
+    "slides" = passed.
+    """
+    if not isinstance(data, dict):
+        return {"story": ["keine verwertbare Antwort"], "slides": {}, "duplicates": []}
+    story = schema_problems(data, cfg, schema)
+    slides = {}
+    all_slides = [s for s in data.get("slides") or [] if isinstance(s, dict)]
+
+    limit = int(cfg.get("slide_length") or 0) * LENGTH_TOLERANCE
+    for i, slide in enumerate(data.get("slides") or []):
+        if limit and isinstance(slide, dict) and len(str(slide.get("body", ""))) > limit:
+            slides.setdefault(i, []).append(TOO_LONG)
+
+    for hit in find_no_gos(data, get_matcher(cfg.get("no_gos", ""), lexicon)):
+        path = hit["path"]
+        if path[0] == "slides" and len(path) > 2 and isinstance(path[1], int):
+            slides.setdefault(path[1], []).append(f"Tabu-Wort „{hit['match']}“")
+        else:
+            story.append(f"{hit['field']}: Tabu-Wort „{hit['match']}“")
+
+    duplicates = index.check(data, key=key) if index is not None else []
+    for dup in duplicates:
+        i = _slide_index(data, dup["field"])
+        if i is None:
+            story.append(f"{dup['field']}: wiederholt frühere Inhalte")
+        else:
+            slides.setdefault(i, []).append("wiederholt frühere Inhalte")
+
+    if all_slides and len(slides) > MAX_SLIDE_SHARE * len(all_slides):
+        story.append(f"{len(slides)} von {len(all_slides)} Slides fehlerhaft")
+    return {"story": story, "slides": slides, "duplicates": duplicates}
+
+
+# -----------------------------
+# Per-tier success rates
+# -----------------------------
+class CascadeStats:
+    """Thread-safe counters per model and level ("story" / "slide"): attempts and passed checks"""
+
+    def __init__(self, registry=REGISTRY):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self.registry = registry
+
+    def record(self, model: str, level: str, passed: bool):
+        with self._lock:
+            counts = self._counts.setdefault((model, level), dict(attempts=0, passed=0))
+            counts["attempts"] += 1
+            counts["passed"] += bool(passed)
+        self.registry.inc("storygen_cascade_total", model=model, level=level, result="pass" if passed else "fail")
+
+    def snapshot(self) -> dict:
+        """{model: {level: counts + pass_rate}} in tier order"""
+        with self._lock:
+            items = sorted(self._counts.items(),
+                           key=lambda i: (TIERS.index(i[0][0]) if i[0][0] in TIERS else len(TIERS), i[0]))
+            result = {}
+            for (model, level), c in items:
+                result.setdefault(model, {})[level] = dict(
+                    c, pass_rate=round(c["passed"] / c["attempts"], 4) if c["attempts"] else 0.0)
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+STATS = CascadeStats()
+
+
+# -----------------------------
+# Routing
+# -----------------------------
+def route(generate, client, creativity, cfg, *args, tiers=TIERS, index=None, schema: str = "story",
+          lexicon: bool = True, **completion_opts):
+    """
+    Call a generate_* function through the cascade (a drop-in for
+    story_dedup.generate_unique). The accepted story is added to index
+    under the key of the answer it was made from, so the same answer from
+    the response cache is not flagged as repeating it.
+    Returns (data, raw, report) with report = {"model", "escalated" (slide_no
+    of the slides revised with "slide_model"), "slide_model", "problems"
+    (still open), "duplicates", "notes"}.
+    """
+    cancel = completion_opts.get("cancel")
+    notes, best = [], None
+    for level, model in enumerate(tiers):
+        try:
+            new_data, new_raw = generate(client, model, creativity, cfg, *args, **completion_opts)
+        except Exception as e:
+            if not level:
+                raise
+            # Quota, cancel or API error on the larger model: keep what the smaller one wrote
+            notes.append(f"{model} nicht verfügbar: {e}")
+            break
+        checked = check_story(new_data, cfg, schema, index, lexicon)
+        STATS.record(model, "story", not checked["story"] and not checked["slides"])
+        # All tiers failing: the answer with the fewest story problems wins
+        if best is None or len(checked["story"]) <= len(best[3]["story"]):
+            best = (new_data, new_raw, model, checked)
+        if not checked["story"] or (cancel is not None and cancel.is_set()):
+            break
+    data, raw, story_model, checked = best
+    key = story_key(data) if isinstance(data, dict) else None
+
+    escalated = []
+    # A story that still fails as a whole isn't worth per-slide calls
+    if checked["slides"] and not checked["story"]:
+        fix_model = tiers[min(tiers.index(story_model) + 1, len(tiers) - 1)]
+        # Slides are fixed as a whole answer; only the story itself streams
+        slide_opts = {k: v for k, v in completion_opts.items() if k != "on_update"}
+        for i, reasons in sorted(checked["slides"].items()):
+            if cancel is not None and cancel.is_set():
+                break
+            action = "shorten" if set(reasons) == {TOO_LONG} else "regenerate"
+            try:
+                data, _ = revise_slide(client, fix_model, creativity, cfg, data, i, action, **slide_opts)
+            except Exception as e:
+                notes.append(f"Slide {i + 1} nicht überarbeitet: {e}")
+                break
+            escalated.append(i)
+        rechecked = check_story(data, cfg, schema, index, lexicon, key=key)
+        for i in escalated:
+            STATS.record(fix_model, "slide", i not in rechecked["slides"])
+        checked = rechecked
+
+    if index is not None and isinstance(data, dict):
+        index.add(data, topic=cfg.get("topic"), key=key)
+    slides = (data.get("slides") or []) if isinstance(data, dict) else []
+    problems = checked["story"] + [
+        f"Slide {slides[i].get('slide_no', i + 1)}: {', '.join(reasons)}"
+        for i, reasons in sorted(checked["slides"].items())
+    ]
+    report = {
+        "model": story_model,
+        "escalated": [slides[i].get("slide_no", i + 1) for i in escalated],
+        "slide_model": fix_model if escalated else None,
+        "problems": problems,
+        "duplicates": checked["duplicates"],
+        "notes": notes,
+    }
+    return data, raw, report
+
+
+def cascaded(generate, reports: list = None, **route_opts):
+    """
+    generate wrapped in route() with the signature of generate (the model
+    argument is ignored), e.g. for story_core.expand_week_plan. Each
+    report is appended to reports.
+    """
+    def run(client, model, creativity, cfg, *args, **completion_opts):
+        data, raw, report = route(generate, client, creativity, cfg, *args, **route_opts, **completion_opts)
+        if reports is not None:
+            reports.append(report)
+        return data, raw
+    return run
+
+
+def report_summary(report: dict) -> str:
+    """One-line German summary of a route() report"""
+    parts = [f"🔀 Automatisch: {report['model']}"]
+    if report["escalated"]:
+        parts.append(f"Slide {', '.join(map(str, report['escalated']))} mit {report['slide_model']} überarbeitet")
+    if report["problems"]:
+        parts.append("offen: " + "; ".join(report["problems"][:3]) + (" …" if len(report["problems"]) > 3 else ""))
+    return " · ".join(parts + report["notes"])
+
+
+def days_summary(reports: list) -> str:
+    """Summary of the route() reports of the expanded week days"""
+    models = {}
+    for report in reports:
+        models[report["model"]] = models.get(report["model"], 0) + 1
+    parts = [f"🔀 Tagesstories: {', '.join(f'{n}× {m}' for m, n in models.items())}"]
+    escalated = sum(len(report["escalated"]) for report in reports)
+    if escalated:
+        parts.append(f"{escalated} Slides mit größerem Modell überarbeitet")
+    return " · ".join(parts)
@@ -0,0 +1,78 @@
+import os
+import hashlib
+import threading
+
+from openai import DefaultHttpxClient, OpenAI
+
+try:  # openai>=3 is built on httpx2, older releases on httpx (same API)
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+try:
+    import h2  # noqa: F401  (optional, enables HTTP/2 via httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# -----------------------------
+# Shared, pooled OpenAI clients
+# -----------------------------
+# One client (= one connection pool) per API key and endpoint for the whole
+# process, instead of a new client, pool and TLS handshake per click.
+POOL_MAX_CONNECTIONS = int(os.getenv("STORYGEN_POOL_MAX_CONNECTIONS", "100"))
+POOL_MAX_KEEPALIVE = int(os.getenv("STORYGEN_POOL_MAX_KEEPALIVE", "40"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("STORYGEN_POOL_KEEPALIVE_EXPIRY", "120"))
+REQUEST_TIMEOUT = float(os.getenv("STORYGEN_REQUEST_TIMEOUT", "120"))
+CONNECT_TIMEOUT = 10.0
+USE_HTTP2 = os.getenv("STORYGEN_HTTP2", "0") == "1"
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def build_http_client(http2: bool = False):
+    """httpx client with tuned pool limits and keep-alive (OpenAI defaults otherwise)"""
+    return DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+        http2=http2 and HTTP2_AVAILABLE,
+    )
+
+
+def get_client(api_key: str, base_url: str = None, http2: bool = None, max_retries: int = 2) -> OpenAI:
+    """Process-wide OpenAI client for this key/endpoint (thread-safe, created once)"""
+    http2 = USE_HTTP2 if http2 is None else http2
+    # The registry is keyed by a digest, so raw keys aren't kept as dict keys
+    registry_key = (
+        hashlib.sha256(api_key.encode("utf-8")).hexdigest(),
+        base_url,
+        http2,
+        max_retries,
+    )
+    client = _clients.get(registry_key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(registry_key)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=max_retries,
+                http_client=build_http_client(http2),
+            )
+            _clients[registry_key] = client
+    return client
+
+
+def close_all():
+    """Close every pooled client (tests, shutdown)"""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,702 @@
+import json
+import time
+import textwrap
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from story_cache import request_hash
+from story_json import parse_json
+from story_metrics import REGISTRY, usage_tokens
+from story_ratelimit import CHARS_PER_TOKEN, completion_budget, estimate_prompt_tokens, estimate_tokens
+from story_schema import STATS, api_request, response_format, schema_name, validate
+from story_singleflight import FLIGHTS
+from story_stream import GenerationCancelled, consume_story_stream
+
+# -----------------------------
+# Defaults (same as the UI preselection)
+# -----------------------------
+DEFAULT_MODEL = "gpt-4o-mini"
+DEFAULT_CREATIVITY = 0.6
+
+DEFAULT_CFG = {
+    "goal": "Validierung & Entlastung (Du bist nicht verrückt)",
+    "text_type": "Mini-Carousel in Story (3–7 Slides, logisch aufgebaut)",
+    "tone": "Klar & direkt (ohne hart zu sein)",
+    "stage": "Noch drin / verwirrt / Selbstzweifel",
+    "topic": "Gaslighting",
+    "sensitivity": "Mittel",
+    "slide_length": 160,
+    "num_slides": 6,
+    "cta": "DM-Trigger: 'Schreib mir 'KLARHEIT' für…'",
+    "no_gos": "diagnose, narzisst, narzisstin, psychopat, rache, konfrontiere ihn, konfrontiere sie",
+    "extra_context": "",
+}
+
+DEFAULT_VIRAL_CFG = {
+    "urgency": 7,
+    "emotion": 8,
+    "viral_elements": [
+        "Curiosity Gap (Neugier wecken)",
+        "Utility (praktischer Nutzen)",
+        "Storytelling (persönliche Geschichte)",
+    ],
+}
+
+# Parallel requests for the week expansion (one per day)
+WEEK_MAX_WORKERS = 7
+
+# Per-slide actions: rewrite one slide with only its neighbours as context
+SLIDE_ACTIONS = ("regenerate", "shorten")
+SHORTEN_RATIO = 0.6
+SLIDE_MAX_TOKENS = 400
+
+# Schema-validated requests: an invalid answer is re-requested this many times
+SCHEMA_RETRIES = 1
+
+# -----------------------------
+# Parsing
+# -----------------------------
+def safe_json_loads(text: str):
+    """Robust JSON parsing: strict first, then story_json's single-pass repair"""
+    return parse_json(text).data
+
+# -----------------------------
+# Prompts
+# -----------------------------
+def build_system_prompt():
+    return (
+        "Du bist ein erfahrener Social-Media-Redakteur und Trauma-informierter Content-Stratege "
+        "für einen Instagram-Kanal, der Betroffene von narzisstischem Missbrauch unterstützt. "
+        "Du formulierst empathisch, klar, nicht reißerisch, ohne Diagnosen oder medizinische/therapeutische Anweisungen. "
+        "Du vermeidest gefährliche oder eskalierende Ratschläge (z.B. Konfrontationspläne, Rache, Stalking, Manipulation). "
+        "Du nutzt eine respektvolle Sprache: 'narzisstische Muster', 'emotionaler Missbrauch', 'Kontrolle', 'Gaslighting'. "
+        "Du gibst keine Rechts- oder Therapieanweisungen, sondern alltagstaugliche, sichere Mikro-Schritte und Selbstschutz. "
+        "Wenn sensible Themen vorkommen (Gewalt, Suizid, akute Gefahr), empfiehlst du Hilfe über lokale Notrufnummern/Hotlines. "
+        "Output immer im gewünschten Format als valides JSON."
+    )
+
+def build_user_prompt(cfg: dict) -> str:
+    # Compact but explicit instructions for consistent output
+    return f"""
+Erstelle Instagram-Story-Inhalte in deutscher Sprache für einen Kanal mit Fokus: Hilfe für Betroffene von narzisstischem Missbrauch.
+
+KONFIG:
+- Ziel der Story: {cfg["goal"]}
+- Textart: {cfg["text_type"]}
+- Tonalität: {cfg["tone"]}
+- Phase/Zustand der Zielgruppe: {cfg["stage"]}
+- Hauptthema: {cfg["topic"]}
+- Sensibilität/Trigger: {cfg["sensitivity"]}
+- Länge pro Slide: {cfg["slide_length"]}
+- Anzahl Slides: {cfg["num_slides"]}
+- CTA/Interaktion: {cfg["cta"]}
+- Tabu-Wörter/No-Gos: {cfg["no_gos"]}
+- Optionaler Kontext (Channel-Style, spezielle Situation): {cfg["extra_context"]}
+
+ANFORDERUNGEN:
+1) Liefere ein JSON mit diesem Schema:
+{{
+  "title_hook": "Sehr kurzer Hook (max 8 Wörter)",
+  "slides": [
+    {{
+      "slide_no": 1,
+      "headline": "max 7 Wörter",
+      "body": "max. {cfg["slide_length"]} Zeichen, kurze Zeilen, story-tauglich",
+      "sticker_suggestion": "z.B. Umfrage, Fragen-Sticker, Slider, Quiz",
+      "visual_suggestion": "z.B. Hintergrundidee / Symbolik / Farben"
+    }}
+  ],
+  "caption_variants": [
+    "1-2 Sätze, empathisch, ohne Diagnose, mit CTA",
+    "Alternative"
+  ],
+  "cta_options": [
+    "Kurzer CTA 1",
+    "Kurzer CTA 2",
+    "Kurzer CTA 3"
+  ],
+  "poll_or_question": {{
+    "type": "poll|question|quiz|slider",
+    "prompt": "Text",
+    "options": ["Option A", "Option B"]
+  }},
+  "hashtags": ["max 12, deutsch, thematisch, nicht zu generisch"],
+  "safety_note": "1 Satz: keine Diagnose, bei akuter Gefahr Hilfe holen"
+}}
+
+2) Achte darauf:
+- Keine Täter-Labels/Diagnosen als Fakt. Keine Schuldumkehr. Keine Eskalations-Tipps.
+- Konkrete, sichere Mikro-Schritte (z.B. Grenzen, Dokumentation für sich, Unterstützung suchen, Selbstfürsorge).
+- Variation: nicht jede Slide gleich starten; ein klarer Gedanke pro Slide.
+- Für die Zielgruppe passend: validierend, stärkend, handlungsfähig.
+
+3) Wenn 'Sensibilität/Trigger' hoch ist: sanfter, vorsichtiger Ton, Hinweis auf Unterstützung.
+
+Jetzt generieren.
+""".strip()
+
+def build_week_plan_prompt(cfg: dict) -> str:
+    return f"""
+Erstelle einen 7-Tage-Plan für Instagram Stories (deutsch) für einen Kanal: Hilfe bei narzisstischem Missbrauch.
+
+Konfiguration:
+- Zielgruppe/Phase: {cfg["stage"]}
+- Tonalität: {cfg["tone"]}
+- Fokus-Themen (rotierend): Gaslighting, Grenzen, Trauma Bond, Selbstwert, Kontrolle, Schuldumkehr, Heilung
+- CTA-Stil: {cfg["cta"]}
+- No-Gos: {cfg["no_gos"]}
+- Optionaler Kontext: {cfg["extra_context"]}
+
+Liefere valides JSON im Schema:
+{{
+  "week_theme": "Titel",
+  "days": [
+    {{
+      "day": "Tag 1",
+      "goal": "Ziel",
+      "topic": "Thema",
+      "hook": "max 8 Wörter",
+      "slides_outline": ["Slide1 Idee", "Slide2 Idee", "Slide3 Idee", "… max 6"],
+      "interaction": "Umfrage/Frage/Quiz/Slider Vorschlag",
+      "cta": "kurzer CTA"
+    }}
+  ],
+  "safety_note": "1 Satz"
+}}
+""".strip()
+
+def build_day_cfg(base_cfg: dict, day: dict) -> dict:
+    """Map one outline day of the week plan onto a full story config"""
+    day_cfg = dict(base_cfg)
+    day_cfg["goal"] = day.get("goal") or base_cfg["goal"]
+    day_cfg["topic"] = day.get("topic") or base_cfg["topic"]
+    day_cfg["cta"] = day.get("cta") or base_cfg["cta"]
+    outline = day.get("slides_outline", [])
+    if outline:
+        day_cfg["num_slides"] = len(outline)
+    context = [
+        base_cfg["extra_context"],
+        f"Hook: {day.get('hook','')}" if day.get("hook") else "",
+        f"Slides-Outline: {' | '.join(outline)}" if outline else "",
+        f"Interaktion: {day.get('interaction','')}" if day.get("interaction") else "",
+    ]
+    day_cfg["extra_context"] = " / ".join(c for c in context if c)
+    return day_cfg
+
+def build_viral_system_prompt():
+    """System prompt of the viral edition (Storygenv2)"""
+    return textwrap.dedent("""
+    Du bist ein hochkarätiger Social-Media-Content-Spezialist mit Expertise in Trauma-informierter Kommunikation.
+    
+    DEINE ROLLE:
+    - Erstellst viralen, hoch-engagierenden Content für Instagram Stories
+    - Formulierst sofort süchtig machende Hooks & emotional packende Texte
+    - Nutzt psychologische Trigger für maximale Interaktion (Neugier, Identifikation, Empowerment)
+    - Bleibst absolut sicher: Keine Diagnosen, keine Eskalationstipps
+    
+    DEINE SUPER-SKILLS:
+    🔥 EMOTIONAL HOOKS: Jede Story beginnt mit einem "Aha-Moment"
+    💥 SCROLL-STOPPER: Texte, die zum Stehenbleiben zwingen
+    📈 ENGAGEMENT-BOOSTER: Fragen, die zur Interaktion einladen
+    🎯 ZIELGRUPPEN-TREFFER: Exakt auf Phase & Bedürfnisse abgestimmt
+    
+    FORMAT-RICHTLINIEN:
+    - Jede Slide hat einen klaren Mehrwert
+    - Emotionale Achterbahn: Problem → Einsicht → Lösung → Aktion
+    - Storytelling mit persönlicher Note (ohne zu privat zu sein)
+    - Zahlen, Emojis und kurze Zeilen für bessere Lesbarkeit
+    
+    SICHERHEIT:
+    - Sprache: "narzisstische Dynamiken", "toxische Muster", "emotionaler Schutz"
+    - Immer empowernd, nie entmündigend
+    - Bei Hoch-Sensibilität: Sanfter Ton + Hilfsangebote
+    """).strip()
+
+def build_viral_prompt_template(cfg: dict) -> str:
+    """Optimized prompt for viral content"""
+    return textwrap.dedent(f"""
+    ERSTELLE VIRALE INSTAGRAM-STORY CONTENT mit maximalem Engagement-Potential!
+    
+    🔥 VIRALE STRATEGIE:
+    - Slide 1: EMOTIONALER HOOK (muss zum Weiterscrollen zwingen)
+    - Slide 2-3: PROBLEM-VERSTÄNDNIS (Identifikation schaffen)
+    - Slide 4-5: LÖSUNGS-IMPULS (klarer Mehrwert)
+    - Slide 6+: INTERAKTIONS-PUSH (Community-Bindung)
+    
+    📊 CONTENT-KONFIGURATION:
+    • Ziel: {cfg["goal"]} + Engagement-Boost
+    • Format: {cfg["text_type"]} 
+    • Ton: {cfg["tone"]} + emotionale Tiefe
+    • Zielgruppe: {cfg["stage"]} (genau treffen!)
+    • Fokus: {cfg["topic"]}
+    • Sensibilität: {cfg["sensitivity"]} (entsprechend anpassen)
+    • Slides: {cfg["num_slides"]} (jede muss Wert liefern)
+    • CTA: {cfg["cta"]} (maximale Interaktion)
+    
+    🚀 VIRALE ELEMENTE EINBAUEN:
+    1. KURIOSITÄTSLÜCKEN (Curiosity Gaps)
+    2. EMOTIONALE IDENTIFIKATION ("Kennst du das?")
+    3. ÜBERRASCHUNGS-MOMENTE (unerwartete Einsichten)
+    4. GEMEINSCHAFTSGEFÜHL ("Wir sind viele")
+    5. KLARE HANDLUNGSIMPULSE (mikro-Aktionen)
+    
+    ⚠️ TABUS: {cfg["no_gos"]}
+    
+    💡 STYLE-TIPPS: {cfg["extra_context"] or "Emojis sinnvoll einsetzen • Kurze Zeilen • Direkte Ansprache • Konkrete Beispiele"}
+    
+    📝 OUTPUT-FORMAT (STRENG EINHALTEN):
+    {{
+      "title_hook": "🔥 Emotionaler Hook (max 6 Wörter, muss neugierig machen)",
+      "viral_score": 85,
+      "slides": [
+        {{
+          "slide_no": 1,
+          "headline": "📌 Scroll-Stopper (max 5 Wörter)",
+          "body": "Max {cfg['slide_length']} Zeichen. Emotional • Persönlich • Wertvoll",
+          "engagement_tip": "Warum diese Slide interaktionsstark ist",
+          "sticker_suggestion": "Interaktiver Sticker + genaue Formulierung",
+          "visual_suggestion": "Hintergrund-Farbe • Symbol • Bild-Idee"
+        }}
+      ],
+      "caption_variants": [
+        "🔥 Caption mit Hook + CTA + Frage",
+        "💫 Alternative mit Storytelling"
+      ],
+      "cta_options": [
+        "📍 Dringender Handlungsimpuls",
+        "🤝 Community-Frage",
+        "💡 Wissens-CTA"
+      ],
+      "poll_or_question": {{
+        "type": "poll|question|quiz|slider|emoji_slider",
+        "prompt": "Ultra-interaktive Frageformulierung",
+        "options": ["Emotional Option A", "Überraschende Option B", "Tiefe Option C"]
+      }},
+      "hashtags": ["Deutsch • Thematisch • Viral • Community"],
+      "viral_techniques": ["Liste der verwendeten Viral-Techniken"],
+      "safety_note": "🔒 Sicherheitshinweis + Empowerment"
+    }}
+    
+    JETZT: Erstelle den engagiertesten Content, den Instagram je gesehen hat!
+    """).strip()
+
+def build_viral_user_prompt(cfg: dict, viral_cfg: dict) -> str:
+    """Viral template plus the sidebar's viral configuration"""
+    base_prompt = build_viral_prompt_template(cfg)
+    
+    # Add viral configuration to prompt
+    viral_addition = f"""
+    ZUSÄTZLICHE VIRAL-KONFIG:
+    • Dringlichkeit: {viral_cfg['urgency']}/10
+    • Emotion: {viral_cfg['emotion']}/10
+    • Viral-Elemente: {', '.join(viral_cfg['viral_elements'])}
+    
+    FOKUS: {cfg['goal']} mit {cfg['topic']} für Zielgruppe in {cfg['stage']}
+    
+    MACH DIESEN CONTENT UNVERGESSLICH!
+    """
+    
+    return base_prompt + "\n\n" + viral_addition
+
+
+def build_repair_prompt(patch: dict, terms: list, cfg: dict) -> str:
+    """Rewrite only the given story parts without the listed no-go terms"""
+    return f"""
+Diese Teile einer Instagram-Story (deutsch, Hauptthema: {cfg.get("topic", "")}, Tonalität: {cfg.get("tone", "")}) enthalten Tabu-Wörter: {", ".join(terms)}
+
+Schreibe NUR diese Teile neu:
+- gleiche Aussage, gleicher Ton, ungefähr gleiche Länge
+- keines der Tabu-Wörter, auch nicht gebeugt oder mit Sternchen
+- keine Diagnosen/Labels als Fakt, stattdessen z.B. 'narzisstische Muster', 'die Person'
+
+Antworte als valides JSON mit exakt denselben Keys und derselben Struktur (gleiche Anzahl Listeneinträge, gleiche slide_no):
+{json.dumps(patch, ensure_ascii=False, indent=2)}
+""".strip()
+
+def story_summary(data: dict) -> str:
+    """Compact outline of a story: hook + one line per slide headline"""
+    lines = [f"Hook: {data.get('title_hook', '')}"]
+    for i, slide in enumerate(data.get("slides", [])):
+        lines.append(f"{slide.get('slide_no', i + 1)}. {slide.get('headline', '')}")
+    return "\n".join(lines)
+
+def build_slide_prompt(data: dict, index: int, action: str, cfg: dict) -> str:
+    """Rewrite (regenerate) or shorten slide `index`; context = summary + neighbour slides"""
+    slides = data.get("slides", [])
+    slide = slides[index]
+    neighbours = [
+        f"{label} (Slide {slides[i].get('slide_no', i + 1)}): {slides[i].get('headline', '')} – {slides[i].get('body', '')}"
+        for label, i in (("Davor", index - 1), ("Danach", index + 1)) if 0 <= i < len(slides)
+    ]
+    if action == "shorten":
+        target = max(40, int(len(slide.get("body", "")) * SHORTEN_RATIO))
+        task = (f"Kürze diese Slide: body max. {target} Zeichen, headline max. 5 Wörter. "
+                "Gleiche Aussage, gleicher Ton, nichts Neues hinzufügen.")
+    else:
+        task = (f"Schreibe diese Slide neu: stärker, konkreter, gleiche Rolle im Ablauf der Story, "
+                f"body max. {cfg.get('slide_length', 160)} Zeichen. Nicht wie die Nachbar-Slides beginnen.")
+    return f"""
+Eine Instagram-Story (deutsch, Hauptthema: {cfg.get("topic", "")}, Tonalität: {cfg.get("tone", "")}, Tabu-Wörter: {cfg.get("no_gos", "")}).
+
+STORY (Überblick):
+{story_summary(data)}
+
+{chr(10).join(neighbours)}
+
+AUFGABE: {task}
+
+Antworte als valides JSON: {{"slide": <die Slide mit exakt denselben Keys>}}
+{json.dumps(slide, ensure_ascii=False, indent=2)}
+""".strip()
+
+# -----------------------------
+# Requests
+# -----------------------------
+def story_request(model: str, creativity: float, cfg: dict) -> dict:
+    return dict(
+        model=model,
+        temperature=creativity,
+        response_format=response_format("story"),
+        messages=[
+            {"role": "system", "content": build_system_prompt()},
+            {"role": "user", "content": build_user_prompt(cfg)},
+        ],
+    )
+
+def week_plan_request(model: str, creativity: float, cfg: dict) -> dict:
+    return dict(
+        model=model,
+        temperature=creativity,
+        response_format=response_format("week_plan"),
+        messages=[
+            {"role": "system", "content": build_system_prompt()},
+            {"role": "user", "content": build_week_plan_prompt(cfg)},
+        ],
+    )
+
+def viral_request(model: str, creativity: float, cfg: dict, viral_cfg: dict) -> dict:
+    return dict(
+        model=model,
+        temperature=creativity,
+        response_format=response_format("viral_story"),
+        messages=[
+            {"role": "system", "content": build_viral_system_prompt()},
+            {"role": "user", "content": build_viral_user_prompt(cfg, viral_cfg)},
+        ],
+        max_tokens=2000,
+    )
+
+def slide_request(model: str, creativity: float, data: dict, index: int, action: str, cfg: dict) -> dict:
+    return dict(
+        model=model,
+        temperature=creativity,
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": build_system_prompt()},
+            {"role": "user", "content": build_slide_prompt(data, index, action, cfg)},
+        ],
+        max_tokens=SLIDE_MAX_TOKENS,
+    )
+
+def repair_request(model: str, creativity: float, patch: dict, terms: list, cfg: dict) -> dict:
+    return dict(
+        model=model,
+        temperature=min(creativity, 0.5),
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": build_system_prompt()},
+            {"role": "user", "content": build_repair_prompt(patch, terms, cfg)},
+        ],
+    )
+
+# -----------------------------
+# Generation (no Streamlit; usable from the apps, CLI and benchmarks)
+# -----------------------------
+def _first_token(stream, marks: list):
+    """Pass a stream through, appending the time of the first content delta to marks"""
+    for chunk in stream:
+        if not marks and chunk.choices and chunk.choices[0].delta.content:
+            marks.append(time.perf_counter())
+        yield chunk
+
+def _timed_call(create, request: dict, kind: str, on_update=None, quota=None, cancel=None, scheduler=None) -> tuple:
+    """
+    One API call, recorded in story_metrics.REGISTRY and charged to quota
+    (story_auth.SessionQuota; raises QuotaExceeded before the call).
+    Returns (response or (text, usage), latency).
+
+    cancel (threading.Event): no call once it is set; a stream in progress
+    is closed and GenerationCancelled raised with the slides received.
+    scheduler: its TPM bucket is settled here for streams (the scheduler
+    only sees usage of non-streamed responses).
+    """
+    if cancel is not None and cancel.is_set():
+        raise GenerationCancelled()
+    reservation = quota.reserve(request) if quota else None
+    started = time.perf_counter()
+    marks = []
+    stream = None
+    try:
+        if on_update:
+            # Streamed: on_update gets the partial story whenever a slide closes
+            stream = create(stream=True, stream_options={"include_usage": True}, **api_request(request))
+            result = consume_story_stream(_first_token(stream, marks), on_update, cancel)
+            usage = result[1]
+        else:
+            result = create(**api_request(request))
+            usage = getattr(result, "usage", None)
+    except GenerationCancelled as e:
+        if stream is None and not e.text:
+            # Cancelled while waiting for the rate limiter: nothing was sent
+            if quota:
+                quota.release(reservation)
+            raise
+        _record_cancel(stream, request, kind, e.text, started, marks, quota, reservation, scheduler)
+        raise
+    except Exception:
+        REGISTRY.record_call(request["model"], kind, latency_s=time.perf_counter() - started, status="error")
+        if quota:
+            quota.release(reservation)
+        raise
+    if quota:
+        quota.settle(reservation, usage)
+    if on_update and scheduler:
+        # The TPM bucket was charged for the full budget: refund what the stream didn't use
+        prompt, completion = usage_tokens(usage) if usage else (
+            estimate_prompt_tokens(request), len(result[0] or "") // CHARS_PER_TOKEN)
+        scheduler.settle(estimate_tokens(request), prompt + completion)
+    latency = time.perf_counter() - started
+    REGISTRY.record_call(request["model"], kind, usage, latency_s=latency,
+                         ttft_s=marks[0] - started if marks else None, choices=request.get("n", 1))
+    return result, latency
+
+def _record_cancel(stream, request, kind, text, started, marks, quota, reservation, scheduler):
+    # Closing the response stops the generation (and its billing) server-side
+    # and frees the connection; its usage never arrives, so it is estimated
+    close = getattr(stream, "close", None)
+    if close:
+        close()
+    received = len(text) // CHARS_PER_TOKEN
+    usage = {"prompt_tokens": estimate_prompt_tokens(request), "completion_tokens": received}
+    if quota:
+        quota.settle(reservation, usage)
+    if scheduler:
+        # The TPM bucket was charged for the full budget: hand back the rest now
+        scheduler.settle(estimate_tokens(request), usage["prompt_tokens"] + received)
+    REGISTRY.record_call(request["model"], kind, usage, latency_s=time.perf_counter() - started,
+                         ttft_s=marks[0] - started if marks else None, status="cancelled")
+    REGISTRY.record_cancel(request["model"], kind, max(0, completion_budget(request) - received))
+
+def _ignore_partial(partial_data):
+    pass
+
+def _parse_failure(parsed, errors) -> str:
+    """Reason label for story_metrics (None = usable answer)"""
+    if not parsed.data:
+        return "unparseable"
+    if parsed.truncated:
+        return "truncated"
+    return "schema" if errors else None
+
+def run_completion(client, request: dict, on_update=None, cache=None, force_fresh=False,
+                   scheduler=None, history=None, meta=None, quota=None, coalesce=True, cancel=None):
+    """
+    Run one chat completion and parse it. Returns (data, text, cached).
+
+    - on_update: stream the answer and call on_update(partial) per finished slide
+    - cache: ResponseCache; identical requests are answered from disk.
+      Only complete answers are stored (repaired is fine, truncated is not).
+    - scheduler: RateLimitScheduler; admits the call within RPM/TPM budgets
+      and retries 429/5xx with backoff
+    - history: HistoryStore; every API answer is recorded with tokens and
+      latency. meta (kind, cfg, viral_cfg) is stored alongside.
+    - quota: story_auth.SessionQuota; every API call (not cache hits) is
+      charged to the logged-in user's daily limits
+    - coalesce: join an identical request already in flight in this process
+      (story_singleflight.FLIGHTS) instead of calling the API again. The
+      waiter gets the final answer (no on_update), is not charged and not
+      recorded in history. Off for force_fresh, which wants a new answer.
+    - cancel: threading.Event that stops the generation (GenerationCancelled
+      with the slides received so far). The answer is always streamed then,
+      so the HTTP request itself can be aborted. A joined flight is not
+      aborted (it costs nothing).
+
+    Requests with a json_schema response format are validated; an invalid
+    answer is requested again (SCHEMA_RETRIES) and counted in story_schema.STATS.
+    Every call, cache lookup, retry and parse failure is recorded in
+    story_metrics.REGISTRY.
+    """
+    kind = (meta or {}).get("kind", "other")
+    key = cache.make_key(request) if cache else None
+    if cache and not force_fresh:
+        text = cache.get(key)
+        data = safe_json_loads(text) if text is not None else None
+        REGISTRY.record_cache(kind, hit=bool(data))
+        if data:
+            return data, text, True
+
+    create = (
+        (lambda **kwargs: scheduler.create(client, kwargs, cancel=cancel)) if scheduler
+        else client.chat.completions.create
+    )
+    name = schema_name(request)
+    if cancel is not None and on_update is None:
+        on_update = _ignore_partial
+
+    def complete():
+        invalid = 0
+        for attempt in range(1 + (SCHEMA_RETRIES if name else 0)):
+            if attempt:
+                REGISTRY.record_retry(request["model"], "schema")
+            result, latency = _timed_call(create, request, kind, on_update, quota, cancel, scheduler)
+            if on_update:
+                text, usage = result
+                text = text or "{}"
+            else:
+                text = result.choices[0].message.content or "{}"
+                usage = getattr(result, "usage", None)
+            parsed = parse_json(text)
+            if history:
+                history.record(request, text, parsed.data, usage=usage, latency_s=latency, **(meta or {}))
+            errors = validate(name, parsed.data) if name else []
+            failure = _parse_failure(parsed, errors)
+            if failure:
+                REGISTRY.record_parse_failure(request["model"], kind, failure)
+            if not errors:
+                break
+            invalid += 1
+        if name:
+            STATS.record(name, calls=attempt + 1, invalid=invalid, failed=bool(errors))
+        if cache and parsed.data and not parsed.truncated and not errors:
+            cache.put(key, text)
+        # Still invalid after the retries: the apps render whatever fields are usable
+        return parsed.data, text
+
+    if not coalesce or force_fresh:
+        data, text = complete()
+        return data, text, False
+    (data, text), shared = FLIGHTS.do(key or request_hash(request), complete, kind)
+    if shared:
+        data = safe_json_loads(text)  # own copy: sessions must not share one mutable dict
+    return data, text, False
+
+def run_completion_n(client, request: dict, n: int, parallel=False, scheduler=None, history=None,
+                     meta=None, quota=None, cancel=None, max_workers=WEEK_MAX_WORKERS):
+    """
+    n candidates for one request, uncached. By default one call with the `n`
+    parameter (prompt billed once, one round trip); parallel=True sends n
+    separate calls instead (for models without `n`). Returns [(data, text)].
+    cancel only prevents calls that haven't started (n choices aren't streamed).
+    """
+    if parallel:
+        # n identical requests on purpose: coalescing would turn them into one
+        opts = {"scheduler": scheduler, "history": history, "meta": meta, "quota": quota, "coalesce": False,
+                "cancel": cancel}
+        with ThreadPoolExecutor(max_workers=max(1, min(n, max_workers))) as pool:
+            futures = [pool.submit(run_completion, client, request, **opts) for _ in range(n)]
+            return [(data, text) for data, text, _ in (f.result() for f in futures)]
+
+    request = dict(request, n=n)
+    create = (
+        (lambda **kwargs: scheduler.create(client, kwargs, cancel=cancel)) if scheduler
+        else client.chat.completions.create
+    )
+    kind = (meta or {}).get("kind", "other")
+    resp, latency = _timed_call(create, request, kind, quota=quota, cancel=cancel)
+    usage = getattr(resp, "usage", None)
+    results = []
+    name = schema_name(request)
+    for i, choice in enumerate(resp.choices):
+        text = choice.message.content or "{}"
+        parsed = parse_json(text)
+        if history:
+            # The usage covers all choices: recorded once so token totals stay right
+            history.record(request, text, parsed.data, usage=usage if i == 0 else None, latency_s=latency,
+                           **(meta or {}))
+        errors = validate(name, parsed.data) if name else []
+        if name:
+            # No retries here: invalid candidates just rank last (story_variants)
+            STATS.record(name, invalid=int(bool(errors)), failed=bool(errors))
+        failure = _parse_failure(parsed, errors)
+        if failure:
+            REGISTRY.record_parse_failure(request["model"], kind, failure)
+        results.append((parsed.data, text))
+    return results
+
+# The generate_* functions pass **completion_opts (on_update, cache,
+# force_fresh, scheduler, history, quota, coalesce, cancel) straight through to run_completion.
+def generate_single_story(client, model, creativity, cfg, **completion_opts):
+    data, text, _ = run_completion(
+        client, story_request(model, creativity, cfg),
+        meta={"kind": "story", "cfg": cfg}, **completion_opts
+    )
+    return data, text
+
+def generate_week_plan(client, model, creativity, cfg, **completion_opts):
+    data, text, _ = run_completion(
+        client, week_plan_request(model, creativity, cfg),
+        meta={"kind": "week", "cfg": cfg}, **completion_opts
+    )
+    return data, text
+
+def expand_week_plan(client, model, creativity, cfg, plan: dict, progress=None,
+                     max_workers=WEEK_MAX_WORKERS, generate=generate_single_story, **completion_opts):
+    """
+    Second stage of the week pipeline: expand every outline day into a full
+    story. All days run concurrently, so wall-clock is ~1 story instead of 7.
+    generate: the per-day function (e.g. story_cascade.cascaded). Returns a
+    list of (data, raw) in the order of plan["days"].
+    """
+    days = plan.get("days", [])
+    results = [(None, "")] * len(days)
+    if not days:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(days))) as pool:
+        futures = {
+            pool.submit(
+                generate, client, model, creativity, build_day_cfg(cfg, d),
+                **completion_opts
+            ): i
+            for i, d in enumerate(days)
+        }
+        for done, fut in enumerate(as_completed(futures), start=1):
+            i = futures[fut]
+            try:
+                results[i] = fut.result()
+            except GenerationCancelled as e:
+                results[i] = (e.partial, e.text)  # slides received before the cancel
+            except Exception as e:
+                results[i] = (None, f"API Error: {e}")
+            if progress:
+                progress(done, len(days))
+    return results
+
+def generate_viral_story(client, model, creativity, cfg, viral_cfg, **completion_opts):
+    """Generate viral-optimized content (streamed if on_update is given)"""
+    data, text, _ = run_completion(
+        client, viral_request(model, creativity, cfg, viral_cfg),
+        meta={"kind": "viral", "cfg": cfg, "viral_cfg": viral_cfg}, **completion_opts
+    )
+    return data, text
+
+def revise_slide(client, model, creativity, cfg, data: dict, index: int, action: str = "regenerate",
+                 **completion_opts):
+    """
+    Regenerate or shorten one slide and merge it back (other slides untouched).
+    Returns (new data, raw); data is unchanged if the answer had no usable slide.
+    """
+    if action not in SLIDE_ACTIONS:
+        raise ValueError(f"Unknown slide action {action!r}")
+    if action == "regenerate":
+        completion_opts["force_fresh"] = True  # same request again should give a new slide
+    result, text, _ = run_completion(
+        client, slide_request(model, creativity, data, index, action, cfg),
+        meta={"kind": f"slide_{action}", "cfg": cfg}, **completion_opts
+    )
+    new = (result or {}).get("slide")
+    if not isinstance(new, dict):
+        return data, text
+    slides = list(data["slides"])
+    old = slides[index]
+    slides[index] = {**old, **{k: v for k, v in new.items() if k in old and k != "slide_no"}}
+    return {**data, "slides": slides}, text
@@ -0,0 +1,328 @@
+"""
+Near-duplicate detection for hooks, slides and captions (MinHash + LSH).
+
+Every text is reduced to a 64-value MinHash signature over its character
+4-grams; the signature is split into 16 bands and each band is stored as one
+bucket key in SQLite. A new text only looks up its 16 keys (one indexed IN
+query) and compares signatures with the few candidates that share a bucket,
+so a check costs the same whether the archive holds 100 or 500k texts.
+Adding a story inserts its rows; nothing is ever rebuilt.
+
+Rows carry the story's content key (story_key), so a story is indexed only
+once and never reported as a duplicate of itself, e.g. when the same answer
+comes back from the response cache or a resumed batch.
+
+    python story_dedup.py backfill            # index the whole history once
+    python story_dedup.py check "Du bist nicht verrückt"
+"""
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+
+DEFAULT_DEDUP_PATH = os.getenv("STORYGEN_DEDUP_PATH", ".storygen_dedup.sqlite3")
+NUM_PERM = 64
+BANDS = 16  # 16 bands × 4 rows: texts with Jaccard ≥ 0.6 become candidates with p ≈ 0.9
+SHINGLE_SIZE = 4
+MIN_SHINGLES = 8  # shorter texts ("Teil 2", "Ja/Nein") say nothing about repetition
+DUPLICATE_THRESHOLD = float(os.getenv("STORYGEN_DUPLICATE_THRESHOLD", "0.6"))
+MAX_REROLLS = 2
+
+_MERSENNE = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Fixed seed: signatures stored in the index must stay comparable across runs
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """casefold (ß -> ss), no punctuation / emoji, single spaces"""
+    text = _NON_WORD_RE.sub(" ", str(text).casefold())
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def shingles(text: str) -> set:
+    text = normalize(text)
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(grams: set) -> np.ndarray:
+    """MinHash signature (NUM_PERM uint32) of a shingle set"""
+    hv = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+    # Wrapping uint64 arithmetic is intended here (same scheme as datasketch)
+    with np.errstate(over="ignore"):
+        phv = ((hv[:, None] * _PERM_A + _PERM_B) % _MERSENNE) & _MAX_HASH
+    return phv.min(axis=0).astype(np.uint32)
+
+
+def band_keys(sig: np.ndarray) -> list:
+    rows = NUM_PERM // BANDS
+    return [
+        int.from_bytes(hashlib.blake2b(bytes([band]) + sig[band * rows:(band + 1) * rows].tobytes(),
+                                       digest_size=8).digest(), "big", signed=True)
+        for band in range(BANDS)
+    ]
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def story_key(data: dict) -> str:
+    """Content key of a story: identical stories (e.g. cache hits) share it"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def story_texts(data: dict, prefix: str = "") -> list:
+    """[(field label, text)] of a story or week plan: hook, slides, captions"""
+    if not isinstance(data, dict):
+        return []
+    texts = []
+    if "days" in data:
+        for number, day in enumerate(data.get("days") or [], start=1):
+            texts.append((f"{prefix}{day.get('day') or f'Tag {number}'} · Hook", day.get("hook", "")))
+        for number, story in enumerate(data.get("stories") or [], start=1):
+            texts += story_texts(story, prefix=f"{prefix}Tag {number} · ")
+        return [(f, t) for f, t in texts if t]
+    texts.append((f"{prefix}Hook", data.get("title_hook", "")))
+    for index, slide in enumerate(data.get("slides") or [], start=1):
+        if isinstance(slide, dict):
+            text = f"{slide.get('headline', '')} {slide.get('body', '')}"
+            texts.append((f"{prefix}Slide {slide.get('slide_no', index)}", text))
+    for index, caption in enumerate(data.get("caption_variants") or [], start=1):
+        texts.append((f"{prefix}Caption {index}", caption))
+    return [(f, t) for f, t in texts if isinstance(t, str) and t.strip()]
+
+
+class DuplicateIndex:
+    """
+    Persistent LSH index over all accepted hooks, slides and captions.
+
+    check(data) lists the texts of a new story that nearly repeat an indexed
+    one; add(data) indexes an accepted story. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = DEFAULT_DEDUP_PATH, threshold: float = DUPLICATE_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS texts (
+                id INTEGER PRIMARY KEY,
+                created_at REAL NOT NULL,
+                source TEXT,
+                topic TEXT,
+                field TEXT,
+                text TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                story TEXT
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                key INTEGER NOT NULL,
+                text_id INTEGER NOT NULL,
+                PRIMARY KEY (key, text_id)
+            ) WITHOUT ROWID;
+            """
+        )
+        if "story" not in {row[1] for row in self._conn.execute("PRAGMA table_info(texts)")}:
+            self._conn.execute("ALTER TABLE texts ADD COLUMN story TEXT")  # indexes from before story keys
+        self._conn.execute("CREATE INDEX IF NOT EXISTS texts_story ON texts (story)")
+        self._conn.commit()
+
+    @staticmethod
+    def _signatures(data: dict) -> list:
+        items = []
+        for field, text in story_texts(data):
+            grams = shingles(text)
+            if len(grams) >= MIN_SHINGLES:
+                items.append((field, text, signature(grams)))
+        return items
+
+    def add(self, data: dict, topic: str = None, source: str = None, created_at: float = None,
+            key: str = None) -> int:
+        """
+        Index the texts of an accepted story / week plan under key (default
+        story_key(data)); returns how many were added, 0 if key is indexed.
+        """
+        key = key or story_key(data)
+        items = self._signatures(data)
+        created_at = created_at or time.time()
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM texts WHERE story = ? LIMIT 1", (key,)).fetchone():
+                return 0
+            for field, text, sig in items:
+                cur = self._conn.execute(
+                    "INSERT INTO texts (created_at, source, topic, field, text, signature, story) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (created_at, source, topic, field, text, sig.tobytes(), key),
+                )
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO buckets (key, text_id) VALUES (?, ?)",
+                    [(bucket, cur.lastrowid) for bucket in band_keys(sig)],
+                )
+            self._conn.commit()
+        return len(items)
+
+    def check(self, data: dict, threshold: float = None, key: str = None) -> list:
+        """
+        Texts of data that nearly repeat an indexed text, one entry per field:
+        {"field", "text", "match", "similarity", "topic", "source", "created_at"}.
+        Texts indexed under key (default story_key(data)) are the story itself
+        and don't count.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        key = key or story_key(data)
+        items = self._signatures(data)
+        if not items:
+            return []
+        buckets = [band_keys(sig) for _, _, sig in items]
+        all_buckets = sorted({bucket for text_buckets in buckets for bucket in text_buckets})
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, text_id FROM buckets WHERE key IN ({', '.join('?' * len(all_buckets))})", all_buckets
+            ).fetchall()
+            if not rows:
+                return []
+            by_bucket = {}
+            for bucket, text_id in rows:
+                by_bucket.setdefault(bucket, []).append(text_id)
+            ids = sorted({text_id for _, text_id in rows})
+            sigs = self._conn.execute(
+                f"SELECT id, signature FROM texts WHERE id IN ({', '.join('?' * len(ids))}) "
+                "AND (story IS NULL OR story != ?)", ids + [key]
+            ).fetchall()
+        if not sigs:
+            return []
+        # Score all candidates of a text at once against a (candidates × NUM_PERM) matrix
+        position = {text_id: i for i, (text_id, _) in enumerate(sigs)}
+        matrix = np.frombuffer(b"".join(blob for _, blob in sigs), dtype=np.uint32).reshape(len(sigs), NUM_PERM)
+
+        best = []
+        for (field, text, sig), text_buckets in zip(items, buckets):
+            rows = sorted({position[i] for bucket in text_buckets for i in by_bucket.get(bucket, ()) if i in position})
+            if not rows:
+                continue
+            scores = np.count_nonzero(matrix[rows] == sig, axis=1) / NUM_PERM
+            top = int(np.argmax(scores))
+            if scores[top] >= threshold:
+                best.append((field, text, sigs[rows[top]][0], round(float(scores[top]), 2)))
+        if not best:
+            return []
+
+        with self._lock:
+            meta = {
+                row[0]: row[1:] for row in self._conn.execute(
+                    "SELECT id, text, topic, source, created_at FROM texts "
+                    f"WHERE id IN ({', '.join('?' * len(best))})", [text_id for _, _, text_id, _ in best]
+                )
+            }
+        return [
+            dict(zip(("match", "topic", "source", "created_at"), meta[text_id]),
+                 field=field, text=text, similarity=score)
+            for field, text, text_id, score in best
+        ]
+
+    def backfill(self, history, batch_rows: int = 500) -> int:
+        """Index every story of a HistoryStore (one-off, for an existing archive); returns stories added"""
+        added, offset = 0, 0
+        while True:
+            records = history.search(limit=batch_rows, offset=offset)
+            if not records:
+                return added
+            for rec in records:
+                if isinstance(rec["data"], dict):
+                    self.add(rec["data"], topic=rec["topic"], source=f"history:{rec['id']}",
+                             created_at=rec["created_at"])
+                    added += 1
+            offset += batch_rows
+
+    def stats(self) -> dict:
+        with self._lock:
+            texts, oldest = self._conn.execute("SELECT COUNT(*), MIN(created_at) FROM texts").fetchone()
+        return {"texts": texts, "oldest": oldest}
+
+
+# -----------------------------
+# Re-rolls
+# -----------------------------
+def avoid_context(cfg: dict, duplicates: list) -> str:
+    """extra_context that asks the model not to repeat the flagged texts"""
+    repeated = " | ".join(d["text"][:120] for d in duplicates[:6])
+    return " / ".join(c for c in (cfg.get("extra_context", ""),
+                                  f"Bereits verwendet, NICHT wiederholen oder umformulieren: {repeated}") if c)
+
+
+def generate_unique(generate, client, model, creativity, cfg, *args, index=None, rerolls=0,
+                    **completion_opts):
+    """
+    Call a generate_* function and check the result against the index.
+
+    With rerolls > 0 a story with near-duplicates is generated again (fresh,
+    told which texts to avoid); the attempt with the fewest duplicates wins
+    and is added to the index. Returns (data, raw, duplicates).
+    """
+    data, raw = generate(client, model, creativity, cfg, *args, **completion_opts)
+    if index is None or not data:
+        return data, raw, []
+    duplicates = index.check(data)
+    for _ in range(rerolls):
+        if not duplicates:
+            break
+        retry_cfg = dict(cfg, extra_context=avoid_context(cfg, duplicates))
+        retry_opts = dict(completion_opts, force_fresh=True)
+        retry_data, retry_raw = generate(client, model, creativity, retry_cfg, *args, **retry_opts)
+        if not retry_data:
+            break
+        retry_duplicates = index.check(retry_data)
+        if len(retry_duplicates) <= len(duplicates):
+            data, raw, duplicates = retry_data, retry_raw, retry_duplicates
+    index.add(data, topic=cfg.get("topic"))
+    return data, raw, duplicates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Near-duplicate index over hooks, slides and captions.")
+    parser.add_argument("command", choices=("backfill", "check", "stats"))
+    parser.add_argument("text", nargs="?", help="check: a hook / slide text, or a story .json file")
+    parser.add_argument("--index", default=DEFAULT_DEDUP_PATH)
+    parser.add_argument("--threshold", type=float, default=DUPLICATE_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    index = DuplicateIndex(args.index, threshold=args.threshold)
+    if args.command == "backfill":
+        from story_history import HistoryStore
+
+        print(f"{index.backfill(HistoryStore())} stories indexed", file=sys.stderr)
+    elif args.command == "check":
+        if not args.text:
+            parser.error("check needs a text or a .json file")
+        if os.path.exists(args.text):
+            with open(args.text, encoding="utf-8") as f:
+                data = json.load(f)
+        else:
+            data = {"title_hook": args.text}
+        for dup in index.check(data):
+            print(json.dumps(dup, ensure_ascii=False))
+    print(json.dumps(index.stats()), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
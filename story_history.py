@@ -0,0 +1,257 @@
+"""
+Searchable history of every generation (apps, story_batch.py, story_batch_api.py).
+
+One row per API answer with the config, model, prompt hash, token usage,
+latency and the parsed JSON. Filters on topic / stage / goal / date use
+composite indexes; the story text is searchable through a contentless FTS5
+table. Exports as a pandas DataFrame or a Parquet file (in row groups, so
+large histories don't have to fit in memory).
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from story_cache import request_hash
+
+# -----------------------------
+# Generation history
+# -----------------------------
+DEFAULT_HISTORY_PATH = os.getenv("STORYGEN_HISTORY_PATH", ".storygen_history.sqlite3")
+PARQUET_CHUNK_ROWS = 5000
+
+# Columns returned by search() / to_dataframe() (data, cfg and viral_cfg are JSON)
+COLUMNS = (
+    "id", "created_at", "kind", "model", "temperature", "prompt_hash",
+    "topic", "stage", "goal", "title_hook",
+    "prompt_tokens", "completion_tokens", "total_tokens", "latency_s",
+    "cfg", "viral_cfg", "data",
+)
+FACETS = ("topic", "stage", "goal", "kind", "model")
+
+log = logging.getLogger(__name__)
+
+
+def searchable_text(data) -> str:
+    """All text of a story / week plan (hook, slides, captions, hashtags, ...)"""
+    parts = []
+
+    def walk(value):
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, dict):
+            for v in value.values():
+                walk(v)
+        elif isinstance(value, list):
+            for v in value:
+                walk(v)
+
+    walk(data)
+    return "\n".join(parts)
+
+
+def fts_query(text: str) -> str:
+    """User input -> FTS5 query: every word must match (as prefix), no FTS syntax"""
+    words = [w.replace('"', '""') for w in text.split()]
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def _usage_value(usage, name):
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+class HistoryStore:
+    """
+    Every generation (cfg, model, prompt hash, tokens, latency, parsed JSON)
+    in one SQLite file, with a contentless FTS5 index over the story text.
+
+    topic / stage / goal filters run on composite indexes with created_at, so
+    "all Gaslighting stories of the last 30 days" stays an index range scan
+    even with hundreds of thousands of rows. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = DEFAULT_HISTORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS generations (
+                id INTEGER PRIMARY KEY,
+                created_at REAL NOT NULL,
+                kind TEXT NOT NULL,
+                model TEXT,
+                temperature REAL,
+                prompt_hash TEXT NOT NULL,
+                topic TEXT,
+                stage TEXT,
+                goal TEXT,
+                title_hook TEXT,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                total_tokens INTEGER,
+                latency_s REAL,
+                cfg TEXT,
+                viral_cfg TEXT,
+                data TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_generations_created ON generations(created_at);
+            CREATE INDEX IF NOT EXISTS idx_generations_topic ON generations(topic, created_at);
+            CREATE INDEX IF NOT EXISTS idx_generations_stage ON generations(stage, created_at);
+            CREATE INDEX IF NOT EXISTS idx_generations_goal ON generations(goal, created_at);
+            CREATE INDEX IF NOT EXISTS idx_generations_prompt ON generations(prompt_hash);
+            CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+                text, content='', tokenize='unicode61 remove_diacritics 2'
+            );
+            """
+        )
+        self._conn.commit()
+
+    def record(self, request: dict, text: str, data, usage=None, latency_s=None,
+               kind: str = "story", cfg: dict = None, viral_cfg: dict = None, created_at: float = None):
+        """Store one generation; returns its id (None if the write failed)"""
+        cfg = cfg or {}
+        row = (
+            created_at or time.time(), kind, request.get("model"), request.get("temperature"),
+            request_hash(request), cfg.get("topic"), cfg.get("stage"), cfg.get("goal"),
+            (data or {}).get("title_hook") or (data or {}).get("week_theme"),
+            _usage_value(usage, "prompt_tokens"), _usage_value(usage, "completion_tokens"),
+            _usage_value(usage, "total_tokens"),
+            round(latency_s, 3) if latency_s is not None else None,
+            json.dumps(cfg, ensure_ascii=False),
+            json.dumps(viral_cfg, ensure_ascii=False) if viral_cfg else None,
+            json.dumps(data, ensure_ascii=False) if data else text,
+        )
+        try:
+            with self._lock:
+                cur = self._conn.execute(
+                    f"INSERT INTO generations ({', '.join(COLUMNS[1:])}) "
+                    f"VALUES ({', '.join('?' * (len(COLUMNS) - 1))})",
+                    row,
+                )
+                self._conn.execute(
+                    "INSERT INTO generations_fts (rowid, text) VALUES (?, ?)",
+                    (cur.lastrowid, searchable_text(data) if data else text),
+                )
+                self._conn.commit()
+                return cur.lastrowid
+        except sqlite3.Error as e:
+            # History is a convenience; never lose the generated story over it
+            log.warning("history write failed: %s", e)
+            return None
+
+    def _where(self, query=None, topic=None, stage=None, goal=None, kind=None, model=None,
+               since=None, until=None, prompt_hash=None) -> tuple:
+        clauses, params = [], []
+        for column, value in (("topic", topic), ("stage", stage), ("goal", goal), ("kind", kind),
+                              ("model", model), ("prompt_hash", prompt_hash)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        if query and query.strip():
+            clauses.append("id IN (SELECT rowid FROM generations_fts WHERE generations_fts MATCH ?)")
+            params.append(fts_query(query))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def search(self, limit: int = 50, offset: int = 0, **filters) -> list:
+        """
+        Newest first. Filters: query (full text), topic, stage, goal, kind,
+        model, since / until (unix time), prompt_hash. Returns dicts with
+        cfg / viral_cfg / data decoded.
+        """
+        where, params = self._where(**filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM generations{where} "
+                "ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        results = []
+        for row in rows:
+            rec = dict(zip(COLUMNS, row))
+            for key in ("cfg", "viral_cfg", "data"):
+                try:
+                    rec[key] = json.loads(rec[key]) if rec[key] else None
+                except json.JSONDecodeError:
+                    pass  # unparsed raw output is stored as text
+            results.append(rec)
+        return results
+
+    def count(self, **filters) -> int:
+        where, params = self._where(**filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM generations{where}", params).fetchone()[0]
+
+    def facets(self) -> dict:
+        """Distinct values per filter column (for select boxes)"""
+        with self._lock:
+            return {
+                column: [v for (v,) in self._conn.execute(
+                    f"SELECT DISTINCT {column} FROM generations WHERE {column} IS NOT NULL ORDER BY 1"
+                )]
+                for column in FACETS
+            }
+
+    def to_dataframe(self, limit: int = None, **filters):
+        """Matching generations as a pandas DataFrame (JSON columns stay strings)"""
+        import pandas as pd
+
+        where, params = self._where(**filters)
+        sql = f"SELECT {', '.join(COLUMNS)} FROM generations{where} ORDER BY created_at DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            df = pd.read_sql_query(sql, self._conn, params=params)
+        df["created_at"] = pd.to_datetime(df["created_at"], unit="s")
+        return df
+
+    def export_parquet(self, path, chunk_rows: int = PARQUET_CHUNK_ROWS, **filters) -> int:
+        """Write matching generations to a Parquet file in row groups of chunk_rows; returns rows"""
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        int_columns = ("id", "prompt_tokens", "completion_tokens", "total_tokens")
+        float_columns = ("temperature", "latency_s")
+        schema = pa.schema([
+            (c, pa.int64() if c in int_columns else pa.float64() if c in float_columns
+             else pa.timestamp("ms") if c == "created_at" else pa.string())
+            for c in COLUMNS
+        ])
+        where, params = self._where(**filters)
+        sql = f"SELECT {', '.join(COLUMNS)} FROM generations{where} ORDER BY created_at"
+        rows = 0
+        # Own connection: a long export must not hold the lock for the app's writes
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+                for chunk in pd.read_sql_query(sql, conn, params=params, chunksize=chunk_rows):
+                    chunk["created_at"] = pd.to_datetime(chunk["created_at"], unit="s").dt.floor("ms")
+                    for c in int_columns:
+                        chunk[c] = chunk[c].astype("Int64")
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                    rows += len(chunk)
+        finally:
+            conn.close()
+        return rows
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, tokens, oldest = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(total_tokens), 0), MIN(created_at) FROM generations"
+            ).fetchone()
+        return {"entries": entries, "total_tokens": tokens, "oldest": oldest}
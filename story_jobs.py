@@ -0,0 +1,143 @@
+"""
+Background generation jobs that outlive the Streamlit script run.
+
+A script run only submits a job and keeps its id (in session state and the
+URL, see story_ui.session_jobs); the API calls run in JobExecutor's thread
+pool. The UI polls Job.snapshot() for status, progress and the partial
+story while it streams. Widget changes, reruns and page reloads no longer
+abort a generation; jobs beyond max_workers wait in the queue.
+
+Job functions get the Job as their only argument and must not call st.*
+(there is no script run in the pool threads): they report through
+job.update() and return the result or raise. Cancelling a running job sets
+job.cancel_event (story_core's cancel=); whatever the function still
+returns (e.g. the slides received so far) is kept as the result.
+"""
+import os
+import copy
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.getenv("STORYGEN_JOB_WORKERS", "4"))
+# Finished jobs (and their results) are kept this long for polling / reloads
+JOB_TTL = 3600
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobError(Exception):
+    """A job failure with details for the UI (e.g. the unparseable raw answer)"""
+
+    def __init__(self, message: str, detail: str = None):
+        super().__init__(message)
+        self.detail = detail
+
+
+class Job:
+    def __init__(self, fn, label: str = "", owner: str = None):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.owner = owner
+        self.state = QUEUED
+        self.created = time.time()
+        self.started = self.finished = None
+        self.progress = None  # (fraction, text)
+        self.partial = None
+        self.result = None
+        self.error = self.detail = None
+        self.cancel_event = threading.Event()
+        self._fn = fn
+        self._future = None
+        self._lock = threading.Lock()
+
+    def update(self, partial=None, progress=None):
+        """Called from the job function: latest partial data and/or (fraction, text)"""
+        with self._lock:
+            if partial is not None:
+                self.partial = copy.deepcopy(partial)  # the stream keeps mutating its dict
+            if progress is not None:
+                self.progress = progress
+
+    def snapshot(self) -> dict:
+        """Consistent copy of the public fields for one UI pass"""
+        with self._lock:
+            return {
+                "id": self.id, "label": self.label, "state": self.state,
+                "created": self.created, "started": self.started, "finished": self.finished,
+                "progress": self.progress, "partial": self.partial, "result": self.result,
+                "error": self.error, "detail": self.detail, "cancelling": self.cancel_event.is_set(),
+            }
+
+
+class JobExecutor:
+    """Thread pool plus a registry of jobs by id; one per process (st.cache_resource)"""
+
+    def __init__(self, max_workers: int = JOB_WORKERS, ttl: float = JOB_TTL):
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storygen-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, label: str = "", owner: str = None) -> str:
+        """Queue fn(job); returns the job id"""
+        self._purge()
+        job = Job(fn, label, owner)
+        with self._lock:
+            self._jobs[job.id] = job
+        job._future = self._pool.submit(self._run, job)
+        return job.id
+
+    def _run(self, job: Job):
+        with job._lock:
+            if job.state != QUEUED:
+                return
+            job.state, job.started = RUNNING, time.time()
+        try:
+            result, error = job._fn(job), None
+        except Exception as e:
+            result, error = None, e
+        with job._lock:
+            if job.cancel_event.is_set():
+                # The cancel usually surfaces as an exception: not a failure
+                job.state, error = CANCELLED, None
+            else:
+                job.state = FAILED if error else DONE
+            job.result = result
+            job.error = str(error) if error else None
+            job.detail = getattr(error, "detail", None)
+            job.finished = time.time()
+            job.partial = None
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a queued job; ask a running one to stop (it ends as cancelled)"""
+        job = self.get(job_id)
+        if not job:
+            return False
+        with job._lock:
+            if job.state in FINISHED:
+                return False
+            job.cancel_event.set()
+            if job.state == RUNNING:
+                return True
+            job.state, job.finished = CANCELLED, time.time()
+        job._future.cancel()
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return {"workers": self.max_workers, **{state: states.count(state) for state in (QUEUED, RUNNING)}}
+
+    def _purge(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for job_id in [i for i, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+                del self._jobs[job_id]
@@ -0,0 +1,238 @@
+import json
+import re
+from collections import namedtuple
+
+# -----------------------------
+# Tolerant JSON parsing for model output
+# -----------------------------
+RepairResult = namedtuple("RepairResult", ["data", "repairs", "truncated"])
+
+_NUMBER_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?\Z")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null", "NaN": "null", "Infinity": "null"}
+_BARE_STOP = set(" \t\r\n,:[]{}\"'#")
+_CLOSER = {"{": "}", "[": "]"}
+_VALID_ESCAPES = set('"\\/bfnrtu')
+
+
+def parse_json(text: str):
+    """Strict json.loads first (fast paths: raw, then without ``` fences), then the single-pass repair"""
+    try:
+        return RepairResult(json.loads(text), [], False)
+    except (json.JSONDecodeError, TypeError):
+        pass
+    text = text or ""
+    start, end = text.find("{"), text.rfind("}")
+    if 0 < start < end:
+        try:
+            return RepairResult(json.loads(text[start:end + 1]), ["removed text around JSON"], False)
+        except json.JSONDecodeError:
+            pass
+    return repair_json(text)
+
+
+def repair_json(text: str) -> RepairResult:
+    """
+    Rebuild valid JSON from typical LLM output in one pass over the text.
+
+    Handles: text/markdown fences around the object, # // /* */ comments,
+    trailing and duplicate commas, missing commas and colons, single-quoted
+    strings, raw newlines in strings, Python literals (True/False/None),
+    bare words, and truncated output (open strings, keys and containers are
+    closed so everything that arrived is kept).
+
+    Apostrophes inside normal strings are never touched. Returns
+    RepairResult(data, repairs, truncated); data is None if nothing usable
+    was found.
+    """
+    repairs = {}
+
+    def note(what):
+        repairs[what] = repairs.get(what, 0) + 1
+
+    out = []
+    stack = []  # frames: [opening bracket, expect]; expect in key|colon|value|comma
+    n = len(text)
+    i = 0
+
+    while i < n and text[i] not in "{[":
+        i += 1
+    if text[:i].replace("```json", "").replace("```", "").strip():
+        note("removed text before JSON")
+
+    def begin():
+        """Fix up separators before a token starts and advance the frame state"""
+        if not stack:
+            return "value"
+        frame = stack[-1]
+        kind, expect = frame
+        if expect == "comma":
+            out.append(",")
+            note("inserted missing comma")
+            expect = "key" if kind == "{" else "value"
+        if kind == "{":
+            if expect == "key":
+                frame[1] = "colon"
+                return "key"
+            if expect == "colon":
+                out.append(":")
+                note("inserted missing colon")
+        frame[1] = "comma"
+        return "value"
+
+    while i < n:
+        c = text[i]
+
+        if not stack and out:
+            if text[i:].replace("```", "").strip():
+                note("removed text after JSON")
+            break
+
+        if c in " \t\r\n":
+            i += 1
+            continue
+
+        # Comments (the viral template itself contains '# 1-100 ...')
+        if c == "#" or text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+            note("removed comment")
+            continue
+        if text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            note("removed comment")
+            continue
+
+        if c == '"' or c == "'":
+            begin()
+            i, literal, closed = _read_string(text, i, note)
+            out.append(literal)
+            if not closed:
+                note("closed truncated string")
+            continue
+
+        if c in "{[":
+            begin()
+            out.append(c)
+            stack.append([c, "key" if c == "{" else "value"])
+            i += 1
+            continue
+
+        if c in "}]":
+            if not any(frame[0] == ("{" if c == "}" else "[") for frame in stack):
+                note("removed unmatched closing bracket")
+                i += 1
+                continue
+            while stack:
+                frame = stack.pop()
+                _close_frame(frame, out, note)
+                if _CLOSER[frame[0]] == c:
+                    break
+                note("closed mismatched bracket")
+            i += 1
+            continue
+
+        if c == ":":
+            if stack and stack[-1][0] == "{" and stack[-1][1] == "colon":
+                out.append(":")
+                stack[-1][1] = "value"
+            else:
+                note("removed stray colon")
+            i += 1
+            continue
+
+        if c == ",":
+            if stack and stack[-1][1] == "comma":
+                out.append(",")
+                stack[-1][1] = "key" if stack[-1][0] == "{" else "value"
+            else:
+                note("removed extra comma")
+            i += 1
+            continue
+
+        # Bare word: number, literal, or unquoted key/value
+        start = i
+        while i < n and text[i] not in _BARE_STOP and not text.startswith("//", i):
+            i += 1
+        word = text[start:i]
+        if not word:
+            i += 1
+            continue
+        role = begin()
+        if word in ("true", "false", "null") or (_NUMBER_RE.match(word) and role == "value"):
+            out.append(word)
+        elif word in _PY_LITERALS and role == "value":
+            out.append(_PY_LITERALS[word])
+            note("converted Python literal")
+        else:
+            out.append(json.dumps(word, ensure_ascii=False))
+            note("quoted bare word")
+
+    truncated = bool(stack)
+    if truncated:
+        note("closed truncated output")
+        while stack:
+            _close_frame(stack.pop(), out, note)
+
+    repair_list = [f"{what} (x{count})" if count > 1 else what for what, count in repairs.items()]
+    if not out:
+        return RepairResult(None, repair_list, truncated)
+    try:
+        return RepairResult(json.loads("".join(out)), repair_list, truncated)
+    except json.JSONDecodeError as e:
+        return RepairResult(None, repair_list + [f"unrecoverable: {e.msg}"], truncated)
+
+
+def _close_frame(frame, out, note):
+    kind, expect = frame
+    if kind == "{" and expect == "colon":
+        out.append(":null")
+        note("filled missing value")
+    elif kind == "{" and expect == "value":
+        out.append("null")
+        note("filled missing value")
+    elif out and out[-1] == ",":
+        out.pop()
+        note("removed trailing comma")
+    out.append(_CLOSER[kind])
+
+
+def _read_string(text: str, i: int, note):
+    """Read a '...' or "..." string starting at i. Returns (end index, JSON literal, closed)"""
+    quote = text[i]
+    if quote == "'":
+        note("converted single-quoted string")
+    chars = ['"']
+    i += 1
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == "\\" and i + 1 < n:
+            nxt = text[i + 1]
+            if nxt == "'":
+                chars.append("'")
+            elif nxt in _VALID_ESCAPES:
+                chars.append(c + nxt)
+            else:
+                chars.append("\\\\")  # lone backslash, keep it literally
+                i += 1
+                continue
+            i += 2
+            continue
+        if c == quote:
+            chars.append('"')
+            return i + 1, "".join(chars), True
+        if c == '"':
+            chars.append('\\"')  # only reachable inside single-quoted strings
+        elif c == "\n":
+            chars.append("\\n")
+            note("escaped newline in string")
+        elif c in "\r\t":
+            chars.append("\\r" if c == "\r" else "\\t")
+        else:
+            chars.append(c)
+        i += 1
+    if chars[-1].endswith("\\") and not chars[-1].endswith("\\\\"):
+        chars.pop()
+    chars.append('"')
+    return n, "".join(chars), False
@@ -0,0 +1,255 @@
+"""
+In-process telemetry for every API call: tokens, cost, time to first token,
+latency, retries, parse failures, response-cache hits, coalesced requests,
+the tokens saved by cancelled generations and the model cascade's checks.
+
+story_core.run_completion / run_completion_n record each call,
+story_ratelimit the retries of the scheduler. REGISTRY is one per process
+(shared by all Streamlit sessions and batch threads) and is exposed as:
+
+- Prometheus text: prometheus(), an HTTP endpoint (start_metrics_server,
+  STORYGEN_METRICS_PORT in the apps) or a textfile for node_exporter
+  (write_textfile, --metrics-file in story_batch.py)
+- the "Telemetrie" dashboard page (pages/Telemetrie.py)
+"""
+import os
+import time
+import bisect
+import threading
+import statistics
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.getenv("STORYGEN_METRICS_PORT", "0"))
+METRICS_FILE = os.getenv("STORYGEN_METRICS_FILE", "")
+# Per-call records kept for the dashboard (counters and histograms are unbounded)
+RECENT_CALLS = 1000
+
+# USD per 1M (prompt, completion) tokens; unknown models count as 0
+PRICES_PER_1M = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "storygen_api_calls_total": ("counter", "Chat completion calls by outcome", None),
+    "storygen_tokens_total": ("counter", "Tokens from response.usage", None),
+    "storygen_cost_usd_total": ("counter", "Estimated cost in USD (PRICES_PER_1M)", None),
+    "storygen_api_latency_seconds": ("histogram", "Total latency of a call", LATENCY_BUCKETS),
+    "storygen_ttft_seconds": ("histogram", "Time to first token of streamed calls", TTFT_BUCKETS),
+    "storygen_api_retries_total": ("counter", "Retried calls (rate limit, server, connection, schema)", None),
+    "storygen_parse_failures_total": ("counter", "Answers that were unparseable, truncated or failed the schema", None),
+    "storygen_cache_lookups_total": ("counter", "Response cache lookups by result", None),
+    "storygen_cancel_saved_tokens_total": ("counter", "Completion tokens not generated due to cancelled streams (upper bound)", None),
+    "storygen_singleflight_total": ("counter", "Uncached requests by role: leader (API call) or coalesced (shared result)", None),
+    "storygen_cascade_total": ("counter", "Local checks of cascaded answers by model, level (story/slide) and result", None),
+}
+
+
+def cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    # Dated snapshots (gpt-4o-mini-2024-07-18) are billed like their base model
+    prices = PRICES_PER_1M.get(model) or next(
+        (p for name, p in sorted(PRICES_PER_1M.items(), key=lambda i: -len(i[0])) if model.startswith(name)),
+        (0.0, 0.0),
+    )
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+def usage_tokens(usage) -> tuple:
+    """(prompt, completion) tokens of a response.usage (object or dict; None -> zeros)"""
+    if usage is None:
+        return 0, 0
+    get = usage.get if isinstance(usage, dict) else (lambda key: getattr(usage, key, None))
+    return int(get("prompt_tokens") or 0), int(get("completion_tokens") or 0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels] + ([extra] if extra else [])
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class MetricsRegistry:
+    """Thread-safe labelled counters and histograms plus a ring buffer of recent calls"""
+
+    def __init__(self, recent: int = RECENT_CALLS):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._calls = deque(maxlen=recent)
+        self.started = time.time()
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.setdefault(key, [0] * (len(buckets) + 1) + [0.0])
+            hist[bisect.bisect_left(buckets, value)] += 1
+            hist[-1] += value
+
+    def record_call(self, model: str, kind: str, usage=None, latency_s: float = 0.0, ttft_s: float = None,
+                    status: str = "ok", choices: int = 1):
+        """One API call (all n choices of a request count as one call)"""
+        prompt, completion = usage_tokens(usage)
+        cost = cost_usd(model, prompt, completion)
+        self.inc("storygen_api_calls_total", model=model, kind=kind, status=status)
+        if prompt or completion:
+            self.inc("storygen_tokens_total", prompt, model=model, kind=kind, type="prompt")
+            self.inc("storygen_tokens_total", completion, model=model, kind=kind, type="completion")
+            self.inc("storygen_cost_usd_total", cost, model=model, kind=kind)
+        self.observe("storygen_api_latency_seconds", latency_s, model=model, kind=kind)
+        if ttft_s is not None:
+            self.observe("storygen_ttft_seconds", ttft_s, model=model, kind=kind)
+        with self._lock:
+            self._calls.append({
+                "time": time.time(), "model": model, "kind": kind, "status": status, "choices": choices,
+                "prompt_tokens": prompt, "completion_tokens": completion, "cost_usd": cost,
+                "latency_s": latency_s, "ttft_s": ttft_s,
+            })
+
+    def record_retry(self, model: str, reason: str):
+        self.inc("storygen_api_retries_total", model=model, reason=reason)
+
+    def record_parse_failure(self, model: str, kind: str, reason: str):
+        self.inc("storygen_parse_failures_total", model=model, kind=kind, reason=reason)
+
+    def record_cancel(self, model: str, kind: str, saved_tokens: int):
+        """A stream stopped early (the call itself is recorded with status="cancelled")"""
+        self.inc("storygen_cancel_saved_tokens_total", saved_tokens, model=model, kind=kind)
+
+    def record_cache(self, kind: str, hit: bool):
+        self.inc("storygen_cache_lookups_total", kind=kind, result="hit" if hit else "miss")
+
+    # -----------------------------
+    # Reading
+    # -----------------------------
+    def calls(self) -> list:
+        """Recent call records, oldest first"""
+        with self._lock:
+            return list(self._calls)
+
+    def total(self, name: str, **match) -> float:
+        """Sum of a counter over all label sets that contain `match`"""
+        with self._lock:
+            return sum(
+                value for (metric, labels), value in self._counters.items()
+                if metric == name and all((k, v) in labels for k, v in match.items())
+            )
+
+    def summary(self) -> dict:
+        """Headline numbers: totals since start, percentiles over the recent calls"""
+        calls = self.calls()
+        latencies = [c["latency_s"] for c in calls if c["status"] == "ok"]
+        ttfts = [c["ttft_s"] for c in calls if c["ttft_s"] is not None]
+        hits = self.total("storygen_cache_lookups_total", result="hit")
+        lookups = self.total("storygen_cache_lookups_total")
+        coalesced = self.total("storygen_singleflight_total", role="coalesced")
+        flights = self.total("storygen_singleflight_total")
+
+        def pct(samples, q):
+            if len(samples) < 2:
+                return round(samples[0], 3) if samples else None
+            return round(statistics.quantiles(samples, n=100)[q - 1], 3)
+
+        return {
+            "calls": int(self.total("storygen_api_calls_total")),
+            "errors": int(self.total("storygen_api_calls_total", status="error")),
+            "cancelled": int(self.total("storygen_api_calls_total", status="cancelled")),
+            "tokens_saved": int(self.total("storygen_cancel_saved_tokens_total")),
+            "prompt_tokens": int(self.total("storygen_tokens_total", type="prompt")),
+            "completion_tokens": int(self.total("storygen_tokens_total", type="completion")),
+            "cost_usd": round(self.total("storygen_cost_usd_total"), 4),
+            "retries": int(self.total("storygen_api_retries_total")),
+            "parse_failures": int(self.total("storygen_parse_failures_total")),
+            "cache_hit_rate": round(hits / lookups, 4) if lookups else None,
+            "coalesced": int(coalesced),
+            "coalesced_rate": round(coalesced / flights, 4) if flights else None,
+            "latency_p50_s": pct(latencies, 50),
+            "latency_p95_s": pct(latencies, 95),
+            "ttft_p50_s": pct(ttfts, 50),
+        }
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(hist) for key, hist in self._histograms.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value:g}")
+                continue
+            for (metric, labels), hist in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ["+Inf"], hist[:-1]):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {hist[-1]:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str = METRICS_FILE):
+        """Atomically write prometheus() to path (node_exporter textfile collector)"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._calls.clear()
+            self.started = time.time()
+
+
+REGISTRY = MetricsRegistry()
+
+
+# -----------------------------
+# HTTP endpoint
+# -----------------------------
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.server.registry.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "0.0.0.0", registry: MetricsRegistry = REGISTRY):
+    """Serve GET /metrics from a daemon thread. Returns the server (server.shutdown() to stop)."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,283 @@
+"""
+Local no-go enforcement: find forbidden terms in generated stories and have
+the model rewrite only the parts that contain them.
+
+The no_gos of a config plus the curated lexicon (nogo_lexicon.txt) are
+compiled into one Aho-Corasick automaton. Texts are folded the same way as
+the terms (casefold, ä -> ae, ß -> ss, accents removed) and every word is
+reduced by its German inflection ending, so "Narzisst" also finds
+"Narzissten" and "NARZISSTIN" in a single pass over the text. A trailing *
+in a term also matches longer words (rache* -> Rachegedanken).
+
+    python story_nogo.py stories.jsonl --no-gos "diagnose, rache*"
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import unicodedata
+from collections import deque
+from functools import lru_cache
+
+from story_core import repair_request, run_completion
+
+LEXICON_PATH = os.getenv("STORYGEN_NOGO_LEXICON", os.path.join(os.path.dirname(__file__), "nogo_lexicon.txt"))
+# Inflection endings, longest first; stripped at most twice, never below MIN_STEM chars
+SUFFIXES = ("innen", "ern", "em", "en", "er", "es", "in", "e", "n", "s")
+MIN_STEM = 4
+REPAIR_ROUNDS = 2
+
+FIELD_LABELS = {
+    "title_hook": "Hook", "headline": "Headline", "body": "Text", "caption_variants": "Caption",
+    "cta_options": "CTA", "hashtags": "Hashtag", "poll_or_question": "Interaktion",
+    "sticker_suggestion": "Sticker", "visual_suggestion": "Visual", "engagement_tip": "Engagement",
+    "hook": "Hook", "slides_outline": "Outline", "interaction": "Interaktion", "cta": "CTA",
+}
+LIST_LABELS = {"slides": "Slide", "days": "Tag", "stories": "Story"}
+# Not shown to followers / not written by the model
+SKIP_KEYS = {"slide_no", "safety_note", "viral_score", "viral_techniques", "day", "goal", "topic"}
+
+_WORD_RE = re.compile(r"\w+")
+_UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue"})
+
+
+def fold(word: str) -> str:
+    """German case folding: casefold (ß -> ss), umlauts -> ae/oe/ue, other accents removed"""
+    word = word.casefold().translate(_UMLAUTS)
+    return "".join(c for c in unicodedata.normalize("NFKD", word) if not unicodedata.combining(c))
+
+
+def stem(word: str) -> str:
+    for _ in range(2):
+        for suffix in SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+                word = word[:-len(suffix)]
+                break
+        else:
+            break
+    return word
+
+
+def fold_text(text: str) -> tuple:
+    """(" stem stem ... ", word spans, word index per char) of a text"""
+    spans = [m.span() for m in _WORD_RE.finditer(text)]
+    folded, owner = [" "], [-1]
+    for index, (start, end) in enumerate(spans):
+        for c in stem(fold(text[start:end])):
+            folded.append(c)
+            owner.append(index)
+        folded.append(" ")
+        owner.append(-1)
+    return "".join(folded), spans, owner
+
+
+def parse_terms(text: str) -> list:
+    """Comma / newline separated terms (the no_gos field or the lexicon file)"""
+    terms = []
+    for line in str(text or "").splitlines():
+        if line.strip().startswith("#"):
+            continue
+        terms += [t.strip() for t in line.split(",") if t.strip()]
+    return terms
+
+
+@lru_cache(maxsize=1)
+def load_lexicon(path: str = LEXICON_PATH) -> tuple:
+    if not path or not os.path.exists(path):
+        return ()
+    with open(path, encoding="utf-8") as f:
+        return tuple(parse_terms(f.read()))
+
+
+class NoGoMatcher:
+    """Aho-Corasick automaton over folded, stemmed terms; find() is one pass per text"""
+
+    def __init__(self, terms):
+        self.terms = list(dict.fromkeys(t for t in terms if t))
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]  # (term index, key length, open end) per state
+        for index, term in enumerate(self.terms):
+            wildcard = term.endswith("*")
+            key = " " + " ".join(stem(fold(w)) for w in _WORD_RE.findall(term.rstrip("*")))
+            if key.strip():
+                self._add(key, (index, len(key), wildcard))
+        self._build()
+
+    def _add(self, key: str, output: tuple):
+        state = 0
+        for c in key:
+            if c not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][c] = len(self._goto) - 1
+            state = self._goto[state][c]
+        self._out[state].append(output)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(c, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> list:
+        """[(term, matched original text)] for every no-go occurrence in text"""
+        if not self.terms or not text:
+            return []
+        folded, spans, owner = fold_text(text)
+        hits, seen, state = [], set(), 0
+        for pos, c in enumerate(folded):
+            while state and c not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(c, 0)
+            for index, length, wildcard in self._out[state]:
+                # Keys start with a space (word start); whole words unless the term ends with *
+                if not wildcard and pos + 1 < len(folded) and folded[pos + 1] != " ":
+                    continue
+                first, last = owner[pos - length + 2], owner[pos]
+                if (first, last) not in seen:  # overlapping terms (narzisst / narzisstin) count once
+                    seen.add((first, last))
+                    hits.append((self.terms[index], text[spans[first][0]:spans[last][1]]))
+        return hits
+
+
+@lru_cache(maxsize=64)
+def get_matcher(no_gos: str, lexicon: bool = True) -> NoGoMatcher:
+    """Compiled matcher for a no_gos string (+ the curated lexicon), cached per string"""
+    return NoGoMatcher(parse_terms(no_gos) + (list(load_lexicon()) if lexicon else []))
+
+
+# -----------------------------
+# Checking stories
+# -----------------------------
+def _walk(value, path: tuple):
+    if isinstance(value, str):
+        yield path, value
+    elif isinstance(value, dict):
+        for key, v in value.items():
+            if key not in SKIP_KEYS:
+                yield from _walk(v, path + (key,))
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            yield from _walk(v, path + (i,))
+
+
+def field_label(path: tuple) -> str:
+    """("slides", 2, "body") -> "Slide 3 · Text" """
+    parts = []
+    for i, part in enumerate(path):
+        if isinstance(part, int):
+            parts[-1] = f"{LIST_LABELS.get(path[i - 1], parts[-1])} {part + 1}"
+        else:
+            parts.append(FIELD_LABELS.get(part, part))
+    return " · ".join(parts)
+
+
+def find_no_gos(data: dict, matcher: NoGoMatcher) -> list:
+    """Every no-go hit in a story / week plan: [{"path", "field", "term", "match"}]"""
+    return [
+        {"path": path, "field": field_label(path), "term": term, "match": match}
+        for path, text in _walk(data, ())
+        for term, match in matcher.find(text)
+    ]
+
+
+def build_patch(data: dict, hits: list) -> tuple:
+    """
+    The offending parts only: whole top-level fields, but of slides / days just
+    the affected entries. Returns (patch, {list key: [original positions]}).
+    """
+    patch, positions = {}, {}
+    for hit in hits:
+        key = hit["path"][0]
+        if isinstance(data.get(key), list) and len(hit["path"]) > 2 and isinstance(data[key][hit["path"][1]], dict):
+            if hit["path"][1] not in positions.setdefault(key, []):
+                positions[key].append(hit["path"][1])
+        else:
+            patch[key] = data[key]
+    for key, indexes in positions.items():
+        indexes.sort()
+        patch[key] = [data[key][i] for i in indexes]
+    return patch, positions
+
+
+def merge_patch(data: dict, patch: dict, fixed: dict, positions: dict) -> dict:
+    """The story with the rewritten parts put back in place (other parts untouched)"""
+    merged = dict(data)
+    for key, value in fixed.items():
+        if key not in patch:
+            continue
+        if key in positions:
+            if not isinstance(value, list):
+                continue
+            items = list(data[key])
+            for i, new in zip(positions[key], value):
+                if isinstance(new, dict):
+                    items[i] = {**items[i], **new, **({"slide_no": items[i]["slide_no"]}
+                                                     if "slide_no" in items[i] else {})}
+            merged[key] = items
+        elif type(value) is type(patch[key]):
+            merged[key] = value
+    return merged
+
+
+def enforce_no_gos(client, model, creativity, cfg, data, repair=True, rounds=REPAIR_ROUNDS,
+                   lexicon=True, **completion_opts) -> tuple:
+    """
+    Check a story against cfg["no_gos"] (+ lexicon) and, if repair is set,
+    let the model rewrite only the offending slides / fields. Returns
+    (data, remaining hits, repaired field labels).
+    """
+    matcher = get_matcher(cfg.get("no_gos", ""), lexicon)
+    hits = find_no_gos(data, matcher) if data else []
+    repaired = []
+    for _ in range(rounds if repair else 0):
+        if not hits:
+            break
+        patch, positions = build_patch(data, hits)
+        terms = sorted({hit["term"].rstrip("*") for hit in hits})
+        fixed, _, _ = run_completion(
+            client, repair_request(model, creativity, patch, terms, cfg),
+            meta={"kind": "repair", "cfg": cfg}, **completion_opts
+        )
+        if not fixed:
+            break
+        repaired += [hit["field"] for hit in hits if hit["field"] not in repaired]
+        data = merge_patch(data, patch, fixed, positions)
+        hits = find_no_gos(data, matcher)
+    remaining = {hit["field"] for hit in hits}
+    return data, hits, [field for field in repaired if field not in remaining]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check story_batch.py output for no-go terms.")
+    parser.add_argument("results", help="Output .jsonl of story_batch.py / story_batch_api.py")
+    parser.add_argument("--no-gos", default=None, help="Comma separated terms (default: each record's cfg)")
+    parser.add_argument("--no-lexicon", action="store_true", help="Ignore nogo_lexicon.txt")
+    args = parser.parse_args(argv)
+
+    flagged = 0
+    with open(args.results, encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            if not rec.get("ok"):
+                continue
+            no_gos = args.no_gos if args.no_gos is not None else (rec.get("cfg") or {}).get("no_gos", "")
+            hits = find_no_gos(rec["data"], get_matcher(no_gos, not args.no_lexicon))
+            for hit in hits:
+                print(f"{rec.get('id')}\t{hit['field']}\t{hit['term']}\t{hit['match']}")
+            flagged += bool(hits)
+    print(f"{flagged} stories with no-go terms", file=sys.stderr)
+    return 0 if not flagged else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
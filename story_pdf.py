@@ -0,0 +1,279 @@
+"""
+Print-ready PDF briefings of stories and week plans (PyMuPDF).
+
+One page per slide (with the rendered 1080×1920 slide next to the text) and
+one page per day of a week plan. Pages are written in chunks: each chunk is
+appended to the file with an incremental save and dropped from memory, so a
+30-day plan with hundreds of slide images needs no more memory than a
+single story. The fonts are embedded once and every page references them.
+
+    python story_pdf.py stories.jsonl -o briefing.pdf     # story_batch.py output
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+try:
+    import pymupdf as fitz
+except ImportError:  # PyMuPDF < 1.24.3
+    import fitz
+
+from story_render import clean_text, get_font, render_tasks, story_tasks
+
+PAGE_SIZE = (595, 842)  # A4 in pt
+MARGIN = 48
+IMAGE_WIDTH = 216  # 1080×1920 slide scaled to 216×384 pt
+CHUNK_PAGES = 16
+
+TEXT = (0.12, 0.12, 0.14)
+MUTED = (0.42, 0.42, 0.47)
+ACCENT = (0.45, 0.28, 0.62)
+
+FONT_NAMES = {False: "SGReg", True: "SGBold"}
+# Used when no TrueType font is found (not embedded, Latin-1 only)
+BASE14_FONTS = {False: "helv", True: "hebo"}
+
+
+class PdfStreamWriter:
+    """
+    Appends pages to a PDF file in chunks of `chunk_pages`.
+
+    Usage: with PdfStreamWriter(path) as pdf: page = pdf.new_page(); pdf.text(...)
+    """
+
+    def __init__(self, path: str, chunk_pages: int = CHUNK_PAGES, page_size: tuple = PAGE_SIZE):
+        self.path = path
+        self.chunk_pages = chunk_pages
+        self.page_size = page_size
+        self.pages = 0
+        self.page = None
+        self.y = MARGIN
+        self._doc = fitz.open()
+        self._saved = False
+        self._pending = 0
+        self._font_xrefs = {}
+        self._font_files = {bold: getattr(get_font(12, bold), "path", None) for bold in (False, True)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def new_page(self):
+        if self._pending >= self.chunk_pages:
+            self.flush()
+        self.page = self._doc.new_page(width=self.page_size[0], height=self.page_size[1])
+        self._use_fonts(self.page)
+        self.pages += 1
+        self._pending += 1
+        self.y = MARGIN
+        return self.page
+
+    def _use_fonts(self, page):
+        # First page embeds the fonts; all later pages only reference them
+        if self._font_xrefs:
+            fonts = "".join(f"/{name} {xref} 0 R" for name, xref in self._font_xrefs.items())
+            self._doc.xref_set_key(page.xref, "Resources", f"<</Font<<{fonts}>>>>")
+            return
+        for bold, name in FONT_NAMES.items():
+            if self._font_files[bold]:
+                with open(self._font_files[bold], "rb") as f:
+                    self._font_xrefs[name] = page.insert_font(fontname=name, fontbuffer=f.read())
+
+    def _fontname(self, bold: bool) -> str:
+        name = FONT_NAMES[bold]
+        return name if name in self._font_xrefs else BASE14_FONTS[bold]
+
+    def text(self, text, size: float = 11, bold: bool = False, color: tuple = TEXT,
+             left: float = MARGIN, gap: float = 6, min_size: float = 7):
+        """Write a wrapped text block below the previous one (shrinks to fit the page)"""
+        text = clean_text(text)
+        if not text:
+            return
+        width, height = self.page_size
+        start_size = size
+        while True:
+            rect = fitz.Rect(left, self.y, width - MARGIN, height - MARGIN)
+            # insert_textbox writes nothing and returns < 0 if the text does not fit
+            rest = self.page.insert_textbox(rect, text, fontname=self._fontname(bold), fontsize=size,
+                                            color=color, lineheight=1.3)
+            if rest >= 0:
+                break
+            if size > min_size:
+                size -= 1
+            elif self.y > MARGIN:
+                self.new_page()  # continue on a fresh page
+                size = start_size
+            else:
+                text = text[:len(text) * 3 // 4].rstrip() + "…"
+        self.y += (rect.height - rest) + gap
+
+    def image(self, png: bytes, rect):
+        self.page.insert_image(fitz.Rect(rect), stream=png)
+
+    def flush(self):
+        """Append the pending pages to the file and release them"""
+        if not self._pending:
+            return
+        # deflate: inserted images are stored as raw pixels otherwise
+        if self._saved:
+            self._doc.save(self.path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP, deflate=True)
+        else:
+            self._doc.save(self.path, garbage=1, deflate=True)
+            self._saved = True
+        self._doc.close()
+        self._doc = fitz.open(self.path)
+        self._pending = 0
+        self.page = None
+
+    def close(self):
+        if self._doc is None:
+            return
+        if not self.pages:
+            self._doc.new_page(width=self.page_size[0], height=self.page_size[1])
+            self._pending = 1
+        self.flush()
+        self._doc.close()
+        self._doc = None
+
+
+# -----------------------------
+# Page layouts
+# -----------------------------
+def _join(items) -> str:
+    return "\n".join(f"• {clean_text(i)}" for i in items or [] if i)
+
+
+def write_story_cover(pdf: PdfStreamWriter, data: dict, title: str = ""):
+    pdf.new_page()
+    if title:
+        pdf.text(title, size=10, color=MUTED)
+    pdf.text(data.get("title_hook", ""), size=22, bold=True, color=ACCENT, gap=14)
+    if data.get("viral_score") is not None:
+        pdf.text(f"Viral Score: {data.get('viral_score')}/100", size=10, color=MUTED, gap=12)
+    sections = [
+        ("Captions", _join(data.get("caption_variants"))),
+        ("CTA-Optionen", _join(data.get("cta_options"))),
+        ("Hashtags", " ".join(f"#{str(h).strip('#')}" for h in data.get("hashtags", []))),
+        ("Viral-Techniken", ", ".join(data.get("viral_techniques", []))),
+    ]
+    pq = data.get("poll_or_question") or {}
+    if pq:
+        options = ", ".join(pq.get("options", []))
+        sections.insert(2, ("Interaktion", f"{pq.get('type', '')}: {pq.get('prompt', '')}"
+                                           + (f"\nOptionen: {options}" if options else "")))
+    for heading, body in sections:
+        if body:
+            pdf.text(heading, size=12, bold=True, gap=3)
+            pdf.text(body, size=10.5, gap=12)
+    pdf.text(data.get("safety_note", "Keine Diagnose. Bei akuter Gefahr Hilfe holen."), size=9, color=MUTED)
+
+
+def write_slide_page(pdf: PdfStreamWriter, slide: dict, index: int, total: int, png: bytes = None):
+    pdf.new_page()
+    left = MARGIN
+    if png:
+        pdf.image(png, (MARGIN, MARGIN, MARGIN + IMAGE_WIDTH, MARGIN + IMAGE_WIDTH * 16 / 9))
+        left = MARGIN + IMAGE_WIDTH + 24
+    pdf.text(f"Slide {slide.get('slide_no', index + 1)}/{total}", size=10, color=MUTED, left=left)
+    pdf.text(slide.get("headline", ""), size=18, bold=True, left=left, gap=10)
+    pdf.text(slide.get("body", ""), size=12, left=left, gap=14)
+    for label, key in (("Sticker", "sticker_suggestion"), ("Visual", "visual_suggestion"),
+                       ("Engagement", "engagement_tip")):
+        if slide.get(key):
+            pdf.text(label, size=9.5, bold=True, color=MUTED, left=left, gap=1)
+            pdf.text(slide[key], size=9.5, color=MUTED, left=left, gap=8)
+
+
+def write_story(pdf: PdfStreamWriter, data: dict, title: str = "", images: bool = True):
+    write_story_cover(pdf, data, title)
+    tasks = story_tasks(data)
+    # Render one chunk of slide images at a time so only a chunk is ever held in memory
+    for start in range(0, len(tasks), pdf.chunk_pages):
+        chunk = tasks[start:start + pdf.chunk_pages]
+        pngs = [png for _, png in render_tasks(chunk)] if images else [None] * len(chunk)
+        for (_, (slide, index, total, _hook)), png in zip(chunk, pngs):
+            write_slide_page(pdf, slide, index, total, png)
+
+
+def write_day_page(pdf: PdfStreamWriter, day: dict, number: int):
+    pdf.new_page()
+    pdf.text(day.get("day") or f"Tag {number}", size=10, color=MUTED)
+    pdf.text(day.get("hook", ""), size=20, bold=True, color=ACCENT, gap=14)
+    for label, key in (("Ziel", "goal"), ("Thema", "topic")):
+        pdf.text(f"{label}: {clean_text(day.get(key, ''))}", size=11.5, gap=4)
+    pdf.y += 8
+    pdf.text("Slides Outline", size=12, bold=True, gap=3)
+    pdf.text(_join(day.get("slides_outline")), size=11, gap=12)
+    for label, key in (("Interaktion", "interaction"), ("CTA", "cta")):
+        if day.get(key):
+            pdf.text(label, size=12, bold=True, gap=3)
+            pdf.text(day[key], size=11, gap=10)
+
+
+def write_week_plan(pdf: PdfStreamWriter, plan: dict, images: bool = True):
+    pdf.new_page()
+    pdf.text("Wochenplan", size=10, color=MUTED)
+    pdf.text(plan.get("week_theme", ""), size=24, bold=True, color=ACCENT, gap=16)
+    for number, day in enumerate(plan.get("days", []), start=1):
+        pdf.text(f"{day.get('day') or f'Tag {number}'}: {clean_text(day.get('hook', ''))}", size=11, gap=4)
+    pdf.y += 10
+    pdf.text(plan.get("safety_note", "Keine Diagnose. Bei akuter Gefahr Hilfe holen."), size=9, color=MUTED)
+
+    stories = plan.get("stories") or []
+    for number, day in enumerate(plan.get("days", []), start=1):
+        write_day_page(pdf, day, number)
+        story = stories[number - 1] if number <= len(stories) else None
+        if story:
+            write_story(pdf, story, title=day.get("day") or f"Tag {number}", images=images)
+
+
+def write_any(pdf: PdfStreamWriter, data: dict, title: str = "", images: bool = True):
+    if "days" in data:
+        write_week_plan(pdf, data, images=images)
+    else:
+        write_story(pdf, data, title=title, images=images)
+
+
+def export_pdf(data: dict, path: str, images: bool = True) -> str:
+    with PdfStreamWriter(path) as pdf:
+        write_any(pdf, data, images=images)
+    return path
+
+
+def pdf_bytes(data: dict, images: bool = True) -> bytes:
+    """The PDF as bytes (for download buttons); built in a temp file"""
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        export_pdf(data, path, images=images)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a PDF briefing from a story_batch.py output.")
+    parser.add_argument("results", help="Output .jsonl of story_batch.py / story_batch_api.py")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--no-images", action="store_true", help="Text only, no rendered slides")
+    args = parser.parse_args(argv)
+
+    count = 0
+    with PdfStreamWriter(args.output) as pdf, open(args.results, encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            if rec.get("ok"):
+                write_any(pdf, rec["data"], title=str(rec.get("id", "")), images=not args.no_images)
+                count += 1
+        pages = pdf.pages
+    print(f"{count} stories, {pages} pages -> {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
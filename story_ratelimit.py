@@ -0,0 +1,229 @@
+import os
+import re
+import time
+import random
+import hashlib
+import threading
+
+import openai
+
+from story_metrics import REGISTRY
+from story_stream import GenerationCancelled
+
+# -----------------------------
+# Rate-limit-aware request scheduling
+# -----------------------------
+# Account limits; the x-ratelimit-limit-* response headers override these
+DEFAULT_RPM = int(os.getenv("STORYGEN_RPM", "500"))
+DEFAULT_TPM = int(os.getenv("STORYGEN_TPM", "200000"))
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+# Completion budget assumed when a request sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 1500
+CHARS_PER_TOKEN = 4
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def estimate_prompt_tokens(request: dict) -> int:
+    """Prompt chars / 4 plus a few tokens of overhead per message"""
+    prompt_chars = sum(len(str(m.get("content", ""))) for m in request.get("messages", []))
+    return prompt_chars // CHARS_PER_TOKEN + 4 * len(request.get("messages", []))
+
+
+def completion_budget(request: dict) -> int:
+    """Most completion tokens one choice of the request may generate"""
+    return request.get("max_tokens") or request.get("max_completion_tokens") or DEFAULT_COMPLETION_TOKENS
+
+
+def estimate_tokens(request: dict) -> int:
+    """Rough token cost of a request: prompt chars / 4 + completion budget"""
+    return estimate_prompt_tokens(request) + completion_budget(request) * int(request.get("n", 1))
+
+
+def parse_duration(value: str) -> float:
+    """'6m0s' / '1.5s' / '20ms' (x-ratelimit-reset-* format) to seconds"""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(num) * _UNIT_SECONDS[unit] for num, unit in _DURATION_RE.findall(value))
+
+
+class TokenBucket:
+    """Continuously refilling bucket: `capacity` units per `period` seconds (not thread-safe)"""
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = float(capacity)
+        self.period = period
+        self.level = float(capacity)
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 = now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+    def sync(self, remaining: float = None, limit: float = None):
+        """Adopt the server's view: its limit, and never more than it says is left"""
+        self._refill()
+        if limit and limit != self.capacity:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+
+
+class RateLimitScheduler:
+    """
+    Admits requests through an RPM and a TPM token bucket and retries
+    429/5xx/connection errors with jittered exponential backoff.
+
+    Token cost is estimated up front (estimate_tokens) and corrected with the
+    real usage afterwards: here for normal responses, for streams (whose
+    usage only arrives with the last chunk) by the caller via settle(), see
+    story_core._timed_call. Every response's x-ratelimit-* headers re-sync the
+    buckets, so parallel sessions/processes on the same key are accounted for.
+    """
+
+    def __init__(self, rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM, max_retries: int = MAX_RETRIES):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int, cancel=None):
+        """
+        Block until both buckets admit one request of `tokens` tokens.
+        cancel (threading.Event): stop waiting with GenerationCancelled once set.
+        """
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise GenerationCancelled()
+            with self._lock:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+                self.throttled_seconds += min(wait, 1.0)
+            self._sleep(min(wait, 1.0), cancel)
+
+    @staticmethod
+    def _sleep(seconds: float, cancel=None):
+        if cancel is not None:
+            cancel.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    def settle(self, estimated: int, actual: int):
+        """Refund (or charge) the difference between estimated and real token usage"""
+        if actual is None:
+            return
+        with self._lock:
+            self.tokens.give_back(estimated - actual)
+
+    def update_from_headers(self, headers):
+        if not headers:
+            return
+
+        def num(name):
+            value = headers.get(name)
+            try:
+                return float(value) if value is not None else None
+            except ValueError:
+                return None
+
+        with self._lock:
+            self.requests.sync(num("x-ratelimit-remaining-requests"), num("x-ratelimit-limit-requests"))
+            self.tokens.sync(num("x-ratelimit-remaining-tokens"), num("x-ratelimit-limit-tokens"))
+
+    def backoff(self, attempt: int, error=None) -> float:
+        """Retry delay: server's retry-after if given, else full-jitter exponential"""
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        if headers.get("retry-after-ms"):
+            return parse_duration(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return parse_duration(headers["retry-after"])
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    def create(self, client, request: dict, cancel=None):
+        """
+        Scheduled chat.completions.create. Returns the parsed response (or the
+        Stream for stream=True). The client's own retries are disabled so
+        that every attempt goes through the buckets. cancel ends the wait for
+        the buckets and between retries (GenerationCancelled).
+        """
+        estimated = estimate_tokens(request)
+        raw_api = client.with_options(max_retries=0).chat.completions.with_raw_response
+        attempt = 0
+        while True:
+            self.acquire(estimated, cancel)
+            try:
+                raw = raw_api.create(**request)
+            except openai.APIStatusError as e:
+                self.update_from_headers(e.response.headers)
+                if (e.status_code != 429 and e.status_code < 500) or attempt >= self.max_retries:
+                    raise
+                error, reason = e, "rate_limit" if e.status_code == 429 else "server"
+            except (openai.APIConnectionError, openai.APITimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                error, reason = e, "connection"
+            else:
+                self.update_from_headers(raw.headers)
+                response = raw.parse()
+                usage = getattr(response, "usage", None)
+                self.settle(estimated, getattr(usage, "total_tokens", None))
+                return response
+
+            attempt += 1
+            with self._lock:
+                self.retries += 1
+            REGISTRY.record_retry(request.get("model", ""), reason)
+            self._sleep(self.backoff(attempt, error), cancel)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests_available": round(self.requests.level, 1),
+                "tokens_available": round(self.tokens.level),
+                "rpm": self.requests.capacity,
+                "tpm": self.tokens.capacity,
+                "retries": self.retries,
+                "throttled_seconds": round(self.throttled_seconds, 2),
+            }
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(api_key: str, rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM) -> RateLimitScheduler:
+    """One scheduler per API key and process (limits are per account, not per session)"""
+    key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = RateLimitScheduler(rpm=rpm, tpm=tpm)
+        return _schedulers[key]
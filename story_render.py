@@ -0,0 +1,352 @@
+"""
+Story slides as 1080×1920 PNGs (Instagram story format).
+
+Each slide gets a gradient background in the colors named in its
+visual_suggestion ("dunkles Lila, Verlauf zu Rosa", "#1e3a5f"), the headline
+and the body text. Fonts, word widths and gradients are cached per
+process; bigger jobs (a full week) are rendered on a shared process pool.
+
+    python story_render.py stories.jsonl -o slides/     # story_batch.py output
+"""
+import io
+import os
+import re
+import sys
+import json
+import atexit
+import zipfile
+import argparse
+import threading
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+SLIDE_SIZE = (1080, 1920)
+MARGIN = 96
+HEADLINE_SIZES = (92, 80, 68, 58)
+BODY_SIZES = (58, 52, 46, 40, 36)
+LINE_SPACING = 1.25
+PNG_COMPRESS_LEVEL = 4
+
+# Below this many slides the pool start-up costs more than it saves
+PARALLEL_MIN_SLIDES = 8
+RENDER_WORKERS = int(os.getenv("STORYGEN_RENDER_WORKERS", "0")) or min(8, os.cpu_count() or 1)
+
+FONT_REGULAR = [os.getenv("STORYGEN_FONT", ""), "DejaVuSans.ttf", "Arial.ttf", "LiberationSans-Regular.ttf"]
+FONT_BOLD = [os.getenv("STORYGEN_FONT_BOLD", ""), "DejaVuSans-Bold.ttf", "arialbd.ttf", "LiberationSans-Bold.ttf"]
+
+# Colors the model tends to name in visual_suggestion (word stems, lowercase)
+COLOR_WORDS = {
+    "schwarz": (20, 20, 24), "weiß": (245, 245, 240), "weiss": (245, 245, 240),
+    "grau": (128, 132, 140), "silber": (192, 196, 204), "anthrazit": (52, 56, 62),
+    "rot": (200, 48, 56), "bordeaux": (110, 20, 40), "koralle": (250, 128, 114),
+    "orange": (240, 140, 50), "gelb": (245, 205, 70), "gold": (212, 175, 55),
+    "beige": (225, 210, 185), "creme": (245, 235, 215), "sand": (215, 195, 160),
+    "braun": (120, 80, 50), "grün": (70, 150, 90), "gruen": (70, 150, 90),
+    "mint": (160, 220, 190), "salbei": (160, 180, 150), "oliv": (110, 120, 60),
+    "türkis": (50, 180, 180), "tuerkis": (50, 180, 180), "petrol": (20, 100, 110),
+    "blau": (60, 110, 190), "navy": (25, 35, 75), "lila": (130, 80, 170),
+    "violett": (120, 70, 170), "flieder": (190, 160, 220), "lavendel": (180, 160, 220),
+    "pink": (230, 90, 150), "rosa": (240, 170, 190), "rosé": (235, 185, 185),
+}
+DARK_WORDS = ("dunkel", "tief", "nacht")
+LIGHT_WORDS = ("hell", "pastell", "sanft", "zart", "blass")
+
+# Calm fallback pairs, used in order when a slide names no colors
+FALLBACK_GRADIENTS = [
+    ((40, 48, 90), (120, 80, 150)),
+    ((30, 70, 90), (90, 160, 160)),
+    ((90, 40, 70), (220, 120, 130)),
+    ((35, 35, 45), (95, 100, 120)),
+    ((60, 90, 70), (170, 200, 160)),
+]
+
+_HEX_RE = re.compile(r"#([0-9a-fA-F]{6}|[0-9a-fA-F]{3})\b")
+_WORD_RE = re.compile(r"[\w-]+")
+# "blau", "blaues", "dunkelblau", "hell-rosa" (stem at the word start, after an optional modifier)
+_COLOR_RE = re.compile(
+    "^((?:%s)\\w*?)?-?(%s)" % ("|".join(DARK_WORDS + LIGHT_WORDS), "|".join(sorted(COLOR_WORDS, key=len, reverse=True)))
+)
+# Emoji / pictographs are not in the text fonts and would render as boxes
+_UNRENDERABLE_RE = re.compile("[\U00010000-\U0010FFFF\u200d\ufe0f\u20e3]")
+
+
+# -----------------------------
+# Fonts & text layout
+# -----------------------------
+@lru_cache(maxsize=None)
+def get_font(size: int, bold: bool = False) -> ImageFont.FreeTypeFont:
+    """Loaded once per (size, weight) and process"""
+    for name in FONT_BOLD if bold else FONT_REGULAR:
+        if not name:
+            continue
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+@lru_cache(maxsize=64)
+def font_metrics(size: int, bold: bool = False) -> tuple:
+    """(line height, space width) in px"""
+    font = get_font(size, bold)
+    ascent, descent = font.getmetrics()
+    return int((ascent + descent) * LINE_SPACING), font.getlength(" ")
+
+
+@lru_cache(maxsize=16384)
+def word_width(word: str, size: int, bold: bool = False) -> float:
+    return get_font(size, bold).getlength(word)
+
+
+def clean_text(text) -> str:
+    return _UNRENDERABLE_RE.sub("", str(text or "")).strip()
+
+
+def wrap_text(text: str, size: int, bold: bool, max_width: int) -> list:
+    """Greedy word wrap on cached word widths; keeps the model's own line breaks"""
+    _, space = font_metrics(size, bold)
+    lines = []
+    for paragraph in text.split("\n"):
+        line, width = [], 0.0
+        for word in paragraph.split():
+            w = word_width(word, size, bold)
+            if line and width + space + w > max_width:
+                lines.append(" ".join(line))
+                line, width = [], 0.0
+            width += (space if line else 0) + w
+            line.append(word)
+        lines.append(" ".join(line))
+    while lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def fit_text(text: str, sizes: tuple, bold: bool, max_width: int, max_height: int) -> tuple:
+    """Largest size whose wrapped text fits -> (size, lines, line height)"""
+    for size in sizes:
+        lines = wrap_text(text, size, bold, max_width)
+        line_height, _ = font_metrics(size, bold)
+        if len(lines) * line_height <= max_height:
+            return size, lines, line_height
+    return size, lines, line_height
+
+
+# -----------------------------
+# Colors & backgrounds
+# -----------------------------
+def _shade(rgb: tuple, factor: float) -> tuple:
+    """factor < 1 darkens, > 1 lightens (towards white)"""
+    if factor < 1:
+        return tuple(int(c * factor) for c in rgb)
+    return tuple(int(c + (255 - c) * (factor - 1)) for c in rgb)
+
+
+def parse_colors(text: str) -> list:
+    """RGB colors mentioned in a visual_suggestion, in order of appearance"""
+    found = []
+    text = str(text or "")
+    for m in _HEX_RE.finditer(text):
+        h = m.group(1)
+        if len(h) == 3:
+            h = "".join(c * 2 for c in h)
+        found.append((m.start(), tuple(int(h[i:i + 2], 16) for i in (0, 2, 4))))
+
+    previous = ""
+    for m in _WORD_RE.finditer(text.lower()):
+        word = m.group(0)
+        color = _COLOR_RE.match(word)
+        if color:
+            rgb = COLOR_WORDS[color.group(2)]
+            modifier = color.group(1) or previous
+            if modifier.startswith(DARK_WORDS):
+                rgb = _shade(rgb, 0.55)
+            elif modifier.startswith(LIGHT_WORDS):
+                rgb = _shade(rgb, 1.5)
+            found.append((m.start(), rgb))
+        previous = word
+    return [rgb for _, rgb in sorted(found)]
+
+
+def slide_palette(visual_suggestion: str, index: int = 0) -> tuple:
+    """(top, bottom) gradient colors for a slide"""
+    colors = parse_colors(visual_suggestion)
+    if len(colors) >= 2:
+        return colors[0], colors[1]
+    if colors:
+        return colors[0], _shade(colors[0], 0.6)
+    return FALLBACK_GRADIENTS[index % len(FALLBACK_GRADIENTS)]
+
+
+@lru_cache(maxsize=4)
+def _gradient_ramp(height: int) -> np.ndarray:
+    # 0..1 from top to bottom, shape (h, 1, 1)
+    return np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+
+
+@lru_cache(maxsize=64)
+def _gradient(top: tuple, bottom: tuple, size: tuple) -> Image.Image:
+    # Vertical only: identical rows keep the PNG small and fast to encode.
+    # The ramp is computed for one pixel column and widened by PIL.
+    width, height = size
+    start = np.asarray(top, dtype=np.float32)
+    column = start + (np.asarray(bottom, dtype=np.float32) - start) * _gradient_ramp(height)
+    return Image.fromarray(column.astype(np.uint8), "RGB").resize(size, Image.NEAREST)
+
+
+def gradient_background(top: tuple, bottom: tuple, size: tuple = SLIDE_SIZE) -> Image.Image:
+    """Fresh (drawable) copy of the cached gradient"""
+    return _gradient(tuple(top), tuple(bottom), tuple(size)).copy()
+
+
+def _luminance(rgb: tuple) -> float:
+    r, g, b = rgb
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+
+# -----------------------------
+# Rendering
+# -----------------------------
+def render_slide(slide: dict, index: int = 0, total: int = 0, hook: str = "") -> Image.Image:
+    """One slide as a SLIDE_SIZE RGB image"""
+    width, height = SLIDE_SIZE
+    top, bottom = slide_palette(slide.get("visual_suggestion", ""), index)
+    img = gradient_background(top, bottom)
+    draw = ImageDraw.Draw(img)
+
+    mid = tuple((a + b) // 2 for a, b in zip(top, bottom))
+    dark_bg = _luminance(mid) < 150
+    fg = (250, 250, 248) if dark_bg else (24, 24, 28)
+    muted = (215, 215, 220) if dark_bg else (70, 70, 80)
+    text_width = width - 2 * MARGIN
+
+    small = get_font(38)
+    small_height, _ = font_metrics(38)
+    if total:
+        draw.text((MARGIN, 120), f"{slide.get('slide_no', index + 1)}/{total}", font=small, fill=muted)
+    if hook:
+        draw.text((MARGIN, height - 160), clean_text(hook)[:60], font=small, fill=muted)
+
+    head_size, head_lines, head_lh = fit_text(
+        clean_text(slide.get("headline", "")), HEADLINE_SIZES, True, text_width, int(height * 0.25))
+    body_size, body_lines, body_lh = fit_text(
+        clean_text(slide.get("body", "")), BODY_SIZES, False, text_width, int(height * 0.45))
+
+    gap = 56 if head_lines and body_lines else 0
+    block = len(head_lines) * head_lh + gap + len(body_lines) * body_lh
+    y = max(120 + small_height * 2, (height - block) // 2)
+
+    head_font, body_font = get_font(head_size, True), get_font(body_size)
+    for line in head_lines:
+        draw.text((MARGIN, y), line, font=head_font, fill=fg)
+        y += head_lh
+    y += gap
+    for line in body_lines:
+        draw.text((MARGIN, y), line, font=body_font, fill=fg)
+        y += body_lh
+    return img
+
+
+def render_slide_png(slide: dict, index: int = 0, total: int = 0, hook: str = "") -> bytes:
+    buf = io.BytesIO()
+    render_slide(slide, index, total, hook).save(buf, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buf.getvalue()
+
+
+def _render_task(task: tuple) -> bytes:
+    return render_slide_png(*task)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """One process pool per server process (spawned, safe to start from Streamlit's threads)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def story_tasks(data: dict, prefix: str = "") -> list:
+    """(file name, render args) for every slide of a story"""
+    slides = data.get("slides") or []
+    hook = data.get("title_hook", "")
+    return [
+        (f"{prefix}slide_{i + 1:02d}.png", (slide, i, len(slides), hook))
+        for i, slide in enumerate(slides) if isinstance(slide, dict)
+    ]
+
+
+def week_tasks(plan: dict) -> list:
+    """Tasks for the expanded stories of a week plan (plan["stories"])"""
+    tasks = []
+    for day_no, story in enumerate(plan.get("stories") or [], start=1):
+        if story:
+            tasks.extend(story_tasks(story, prefix=f"tag_{day_no}_"))
+    return tasks
+
+
+def render_tasks(tasks: list, parallel: bool = None) -> list:
+    """[(name, png bytes)], in task order"""
+    if parallel is None:
+        parallel = len(tasks) >= PARALLEL_MIN_SLIDES and RENDER_WORKERS > 1
+    args = [task for _, task in tasks]
+    if parallel:
+        chunksize = max(1, len(args) // (RENDER_WORKERS * 4))
+        pngs = list(get_render_pool().map(_render_task, args, chunksize=chunksize))
+    else:
+        pngs = [_render_task(a) for a in args]
+    return [(name, png) for (name, _), png in zip(tasks, pngs)]
+
+
+def render_zip(data: dict, parallel: bool = None) -> bytes:
+    """All slides of a story (or of an expanded week plan) as a ZIP of PNGs"""
+    tasks = week_tasks(data) if "days" in data else story_tasks(data)
+    buf = io.BytesIO()
+    # PNGs are already compressed
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for name, png in render_tasks(tasks, parallel):
+            zf.writestr(name, png)
+    return buf.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render story slides from a story_batch.py output to PNG.")
+    parser.add_argument("results", help="Output .jsonl of story_batch.py / story_batch_api.py")
+    parser.add_argument("-o", "--out-dir", required=True)
+    args = parser.parse_args(argv)
+
+    tasks = []
+    with open(args.results, encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            if not rec.get("ok"):
+                continue
+            prefix = f"{rec['id']}_"
+            data = rec["data"]
+            tasks.extend(
+                [(prefix + name, t) for name, t in week_tasks(data)] if "days" in data
+                else story_tasks(data, prefix=prefix)
+            )
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for name, png in render_tasks(tasks):
+        with open(os.path.join(args.out_dir, name), "wb") as f:
+            f.write(png)
+    print(f"{len(tasks)} slides -> {args.out_dir}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Story and week-plan schemas, defined once.
+
+The same schema is sent to the API as a strict `json_schema` response format
+(plain `json_object` for models without structured outputs, see api_request)
+and checked locally. The local check is compiled once per schema into nested
+closures, so validating an answer is one pass over the data without looking
+the schema up again.
+
+STATS counts per schema how often answers were invalid and how often a
+request had to be retried (see story_core.run_completion).
+"""
+import threading
+
+# -----------------------------
+# Schemas (subset of JSON Schema supported by strict structured outputs)
+# -----------------------------
+STRING = {"type": "string"}
+INTEGER = {"type": "integer"}
+
+
+def _object(**properties) -> dict:
+    # Strict mode: every property required, nothing else allowed
+    return {"type": "object", "properties": properties, "required": list(properties),
+            "additionalProperties": False}
+
+
+def _list(items: dict) -> dict:
+    return {"type": "array", "items": items}
+
+
+POLL_TYPES = ["poll", "question", "quiz", "slider", "emoji_slider"]
+
+SLIDE_FIELDS = dict(
+    slide_no=INTEGER,
+    headline=STRING,
+    body=STRING,
+    sticker_suggestion=STRING,
+    visual_suggestion=STRING,
+)
+
+STORY_FIELDS = dict(
+    title_hook=STRING,
+    slides=_list(_object(**SLIDE_FIELDS)),
+    caption_variants=_list(STRING),
+    cta_options=_list(STRING),
+    poll_or_question=_object(type={"type": "string", "enum": POLL_TYPES}, prompt=STRING, options=_list(STRING)),
+    hashtags=_list(STRING),
+    safety_note=STRING,
+)
+
+STORY_SCHEMA = _object(**STORY_FIELDS)
+
+VIRAL_SCHEMA = _object(**dict(
+    STORY_FIELDS,
+    viral_score=INTEGER,
+    slides=_list(_object(**SLIDE_FIELDS, engagement_tip=STRING)),
+    viral_techniques=_list(STRING),
+))
+
+WEEK_PLAN_SCHEMA = _object(
+    week_theme=STRING,
+    days=_list(_object(
+        day=STRING,
+        goal=STRING,
+        topic=STRING,
+        hook=STRING,
+        slides_outline=_list(STRING),
+        interaction=STRING,
+        cta=STRING,
+    )),
+    safety_note=STRING,
+)
+
+SCHEMAS = {"story": STORY_SCHEMA, "viral_story": VIRAL_SCHEMA, "week_plan": WEEK_PLAN_SCHEMA}
+# Models without structured outputs: sent as json_object, the answer is only validated locally
+JSON_OBJECT_MODELS = ("gpt-3.5-turbo",)
+
+
+def response_format(name: str) -> dict:
+    """response_format for a request: strict structured output with schema `name`"""
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": SCHEMAS[name]}}
+
+
+def schema_name(request: dict):
+    """Name of the json_schema a request asks for (None for plain json_object)"""
+    fmt = request.get("response_format") or {}
+    return fmt.get("json_schema", {}).get("name") if fmt.get("type") == "json_schema" else None
+
+
+def api_request(request: dict) -> dict:
+    """The request as sent to the API: json_schema becomes json_object for JSON_OBJECT_MODELS"""
+    if schema_name(request) and str(request.get("model", "")).startswith(JSON_OBJECT_MODELS):
+        return dict(request, response_format={"type": "json_object"})
+    return request
+
+
+# -----------------------------
+# Compiled validator
+# -----------------------------
+_TYPES = {
+    "string": (str, "Text"),
+    "integer": (int, "Zahl"),
+    "number": ((int, float), "Zahl"),
+    "boolean": (bool, "true/false"),
+    "array": (list, "Liste"),
+    "object": (dict, "Objekt"),
+}
+
+
+def compile_schema(schema: dict):
+    """check(value, path, errors) for a schema; appends German messages to errors"""
+    kind = schema.get("type")
+    types, label = _TYPES[kind]
+    exclude_bool = kind in ("integer", "number")  # bool is an int subclass
+    enum = set(schema["enum"]) if "enum" in schema else None
+
+    if kind == "object":
+        fields = [(key, compile_schema(sub)) for key, sub in schema.get("properties", {}).items()]
+        required = schema.get("required", [])
+        closed = schema.get("additionalProperties") is False
+        known = set(schema.get("properties", {}))
+
+        def check(value, path, errors):
+            if not isinstance(value, dict):
+                errors.append(f"{path or 'Antwort'}: {label} erwartet")
+                return
+            for key in required:
+                if key not in value:
+                    errors.append(f"{path}{'.' if path else ''}{key}: fehlt")
+            for key, check_field in fields:
+                if key in value:
+                    check_field(value[key], f"{path}{'.' if path else ''}{key}", errors)
+            if closed:
+                for key in value.keys() - known:
+                    errors.append(f"{path}{'.' if path else ''}{key}: unerwartetes Feld")
+        return check
+
+    if kind == "array":
+        check_item = compile_schema(schema["items"])
+
+        def check(value, path, errors):
+            if not isinstance(value, list):
+                errors.append(f"{path}: {label} erwartet")
+                return
+            for i, item in enumerate(value):
+                check_item(item, f"{path}[{i}]", errors)
+        return check
+
+    def check(value, path, errors):
+        if not isinstance(value, types) or (exclude_bool and isinstance(value, bool)):
+            errors.append(f"{path}: {label} erwartet")
+        elif enum is not None and value not in enum:
+            errors.append(f"{path}: ungültiger Wert {value!r}")
+    return check
+
+
+VALIDATORS = {name: compile_schema(schema) for name, schema in SCHEMAS.items()}
+
+
+def validate(name: str, data) -> list:
+    """Problems of data against schema `name` (empty list = valid)"""
+    errors = []
+    VALIDATORS[name](data, "", errors)
+    return errors
+
+
+# -----------------------------
+# Validation / retry rates
+# -----------------------------
+class ValidationStats:
+    """Thread-safe counters per schema: requests, calls, invalid answers, retries, final failures"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, name: str, calls: int = 1, invalid: int = 0, failed: bool = False):
+        """One request that took `calls` attempts, `invalid` of them invalid"""
+        with self._lock:
+            counts = self._counts.setdefault(name, dict(requests=0, calls=0, invalid=0, retries=0, failed=0))
+            counts["requests"] += 1
+            counts["calls"] += calls
+            counts["invalid"] += invalid
+            counts["retries"] += calls - 1
+            counts["failed"] += bool(failed)
+
+    def snapshot(self) -> dict:
+        """{schema: counts + invalid_rate (per call), retry_rate and failure_rate (per request)}"""
+        with self._lock:
+            return {
+                name: dict(
+                    c,
+                    invalid_rate=round(c["invalid"] / c["calls"], 4) if c["calls"] else 0.0,
+                    retry_rate=round(c["retries"] / c["requests"], 4) if c["requests"] else 0.0,
+                    failure_rate=round(c["failed"] / c["requests"], 4) if c["requests"] else 0.0,
+                )
+                for name, c in self._counts.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+STATS = ValidationStats()
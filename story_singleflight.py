@@ -0,0 +1,74 @@
+"""
+Request coalescing ("singleflight") across Streamlit sessions and threads.
+
+While a request is in flight, identical requests (same canonical request
+hash, see story_cache.request_hash) don't call the API again: they wait for
+the running call and share its answer. Only successful results are shared;
+if the leading call raises, the waiters run the request themselves (again
+coalesced among each other), so one user's quota or connection error never
+reaches another session.
+
+FLIGHTS is one per process, like story_metrics.REGISTRY. Leaders and
+coalesced waiters are counted in REGISTRY (storygen_singleflight_total).
+"""
+import threading
+
+from story_metrics import REGISTRY
+
+
+class _Call:
+    __slots__ = ("done", "result", "ok", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.ok = False
+        self.waiters = 0
+
+
+class SingleFlight:
+    """At most one running call per key; concurrent callers with the same key share its result"""
+
+    def __init__(self, registry=REGISTRY):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call
+        self.registry = registry
+
+    def do(self, key: str, fn, kind: str = "other"):
+        """
+        fn() once for all concurrent callers of key. Returns (result, shared):
+        shared is True for callers that got the result of another caller's call.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    call.waiters += 1
+            if leader:
+                break
+            call.done.wait()
+            if call.ok:
+                self.registry.inc("storygen_singleflight_total", kind=kind, role="coalesced")
+                return call.result, True
+            # The leader failed: try again, the first waiter becomes the next leader
+
+        self.registry.inc("storygen_singleflight_total", kind=kind, role="leader")
+        try:
+            call.result = fn()
+            call.ok = True
+            return call.result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> dict:
+        """{key: number of waiting callers} of the running calls"""
+        with self._lock:
+            return {key: call.waiters for key, call in self._calls.items()}
+
+
+FLIGHTS = SingleFlight()
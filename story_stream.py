@@ -0,0 +1,165 @@
+import json
+
+# -----------------------------
+# Incremental JSON for streamed stories
+# -----------------------------
+class StoryStreamParser:
+    """
+    Incremental parser for a streamed story JSON object.
+
+    Feed it the text deltas of a streamed completion. It scans every character
+    exactly once and keeps track of:
+    - completed top-level fields (e.g. title_hook, viral_score)
+    - completed objects inside the `array_key` list (the slides)
+
+    partial() returns what is known so far in the normal story shape, so the
+    regular render functions can draw it while the rest is still streaming.
+    """
+
+    def __init__(self, array_key: str = "slides"):
+        self.array_key = array_key
+        self.fields = {}
+        self.items = []
+        self._buf = ""
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._done = False
+        self._expect = "key"
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self._item_start = None
+
+    @property
+    def text(self) -> str:
+        return self._buf
+
+    def feed(self, chunk: str) -> bool:
+        """Consume a text delta. Returns True if a field or item completed."""
+        self._buf += chunk
+        changed = False
+        buf = self._buf
+
+        for i in range(self._pos, len(buf)):
+            if self._done:
+                break
+            c = buf[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1 and self._expect == "key":
+                        self._key = self._loads(buf[self._key_start:i + 1])
+                continue
+
+            if not self._started:
+                # Skip anything before the root object (e.g. ```json fences)
+                if c == "{":
+                    self._started = True
+                    self._stack.append(c)
+                continue
+
+            if c.isspace():
+                continue
+
+            depth = len(self._stack)
+            if depth == 1 and self._expect == "value" and self._value_start is None:
+                self._value_start = i
+
+            if c == '"':
+                self._in_string = True
+                if depth == 1 and self._expect == "key":
+                    self._key_start = i
+            elif c in "{[":
+                if c == "{" and depth == 2 and self._key == self.array_key and self._stack[-1] == "[":
+                    self._item_start = i
+                self._stack.append(c)
+            elif c in "}]":
+                self._stack.pop()
+                depth = len(self._stack)
+                if c == "}" and depth == 2 and self._item_start is not None:
+                    item = self._loads(buf[self._item_start:i + 1])
+                    self._item_start = None
+                    if isinstance(item, dict):
+                        self.items.append(item)
+                        changed = True
+                if depth == 0:
+                    changed |= self._finish_value(i)
+                    self._done = True
+            elif depth == 1 and c == ":":
+                self._expect = "value"
+                self._value_start = None
+            elif depth == 1 and c == ",":
+                changed |= self._finish_value(i)
+
+        self._pos = len(buf)
+        return changed
+
+    def partial(self) -> dict:
+        """Everything parsed so far, in the story schema"""
+        data = dict(self.fields)
+        if self.array_key not in data:
+            data[self.array_key] = list(self.items)
+        return data
+
+    def _finish_value(self, end: int) -> bool:
+        changed = False
+        if self._key is not None and self._value_start is not None:
+            value = self._loads(self._buf[self._value_start:end])
+            if value is not None:
+                self.fields[self._key] = value
+                changed = True
+        self._expect = "key"
+        self._key = None
+        self._value_start = None
+        return changed
+
+    @staticmethod
+    def _loads(text: str):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+
+class GenerationCancelled(Exception):
+    """
+    A generation was cancelled (cancel event set). partial holds what had
+    streamed in so far in the story shape (None if nothing had arrived),
+    text the raw text received.
+    """
+
+    def __init__(self, partial: dict = None, text: str = ""):
+        super().__init__("Generierung abgebrochen")
+        self.partial = partial
+        self.text = text
+
+
+def consume_story_stream(stream, on_update, cancel=None) -> tuple:
+    """
+    Read a streamed chat completion and call on_update(partial_data) whenever
+    a top-level field or a slide object closes. Returns (full raw text, usage);
+    usage is only sent with stream_options={"include_usage": True}.
+    cancel: threading.Event, checked per chunk; once set, reading stops with
+    GenerationCancelled (the caller closes the stream).
+    """
+    parser = StoryStreamParser()
+    usage = None
+    for chunk in stream:
+        if cancel is not None and cancel.is_set():
+            raise GenerationCancelled(parser.partial() if parser.items or parser.fields else None, parser.text)
+        usage = getattr(chunk, "usage", None) or usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        if delta and parser.feed(delta):
+            on_update(parser.partial())
+    return parser.text, usage
+
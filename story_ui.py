@@ -0,0 +1,504 @@
+"""
+Streamlit helpers shared by Storygen.py and Storygenv2.py.
+
+Both apps split their page into st.fragment sections (config, output,
+export) so that a widget change only reruns its own section. measure_rerun
+records how long each (partial) rerun took, per section, in session state.
+
+render_history_panel lists the HistoryStore (search, filters, reload, export),
+render_duplicates and render_no_go_report show the results of the
+story_dedup / story_nogo checks, slide_action_buttons the per-slide
+regenerate / shorten actions (story_core.revise_slide) and
+render_variant_picker the ranked N-variants result. render_schema_stats
+shows how often answers failed the story_schema validation,
+render_cascade_stats how often each tier of the story_cascade passed,
+render_metrics_summary / render_metrics_dashboard the per-call telemetry
+of story_metrics (sidebar and the Telemetrie page). login_gate,
+render_user_box and session_quota put the apps and pages behind the
+story_auth accounts (one UserStore per process, shared by all pages).
+submit_job / jobs_panel run generations in the story_jobs pool and poll
+them, so reruns and reloads no longer abort a paid API call.
+"""
+import os
+import time
+import statistics
+from datetime import datetime, timedelta
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+import streamlit as st
+
+RERUN_HISTORY = 100
+
+
+def _timings() -> deque:
+    if "rerun_timings" not in st.session_state:
+        st.session_state.rerun_timings = deque(maxlen=RERUN_HISTORY)
+    return st.session_state.rerun_timings
+
+
+def record_rerun(scope: str, started: float):
+    """Record a run that began at time.perf_counter() == started"""
+    _timings().append((scope, (time.perf_counter() - started) * 1000, time.time()))
+
+
+@contextmanager
+def measure_rerun(scope: str):
+    """Time a full run or a fragment rerun; also records runs ended by st.stop/st.rerun"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_rerun(scope, started)
+
+
+def rerun_stats() -> dict:
+    """{scope: {"runs", "last_ms", "p50_ms", "max_ms"}} over the recent reruns"""
+    by_scope = {}
+    for scope, ms, _ in _timings():
+        by_scope.setdefault(scope, []).append(ms)
+    return {
+        scope: {
+            "runs": len(samples),
+            "last_ms": round(samples[-1], 1),
+            "p50_ms": round(statistics.median(samples), 1),
+            "max_ms": round(max(samples), 1),
+        }
+        for scope, samples in by_scope.items()
+    }
+
+
+def render_rerun_timings():
+    """Sidebar expander with rerun times per section (as of the previous run)"""
+    with st.expander("⏱️ Rerun-Zeiten"):
+        stats = rerun_stats()
+        if not stats:
+            st.caption("Noch keine Messungen.")
+            return
+        for scope, s in stats.items():
+            st.caption(f"**{scope}**: zuletzt {s['last_ms']:.0f} ms · Median {s['p50_ms']:.0f} ms · "
+                       f"max {s['max_ms']:.0f} ms ({s['runs']}×)")
+
+
+def render_schema_stats(stats: dict):
+    """Sidebar expander with validation-failure and retry rates per schema (as of the previous run)"""
+    with st.expander("🧩 Schema-Validierung"):
+        if not stats:
+            st.caption("Noch keine Anfragen.")
+            return
+        for name, s in stats.items():
+            st.caption(f"**{name}**: {s['requests']} Anfragen · ungültig {s['invalid_rate']:.0%} der Antworten · "
+                       f"Retries {s['retry_rate']:.0%} · weiterhin ungültig {s['failure_rate']:.0%}")
+
+
+def render_cascade_stats(stats: dict):
+    """Sidebar expander with the pass rates per model of the automatic model cascade (story_cascade)"""
+    with st.expander("🔀 Modell-Kaskade"):
+        if not stats:
+            st.caption("Noch keine automatisch gerouteten Anfragen.")
+            return
+        for model, levels in stats.items():
+            parts = [f"{'Stories' if level == 'story' else 'Slides'} {s['passed']}/{s['attempts']} ok "
+                     f"({s['pass_rate']:.0%})" for level, s in sorted(levels.items(), reverse=True)]
+            st.caption(f"**{model}**: " + " · ".join(parts))
+
+
+# -----------------------------
+# Generation history
+# -----------------------------
+HISTORY_PAGE_SIZE = 20
+HISTORY_KINDS = {"story": "Story", "week": "Wochenplan", "viral": "Viral"}
+# Records that are whole results (slide actions and repairs store fragments)
+LOADABLE_KINDS = tuple(HISTORY_KINDS)
+
+
+def _parquet_bytes(store, filters: dict) -> bytes:
+    import tempfile
+
+    fd, path = tempfile.mkstemp(suffix=".parquet")
+    os.close(fd)
+    try:
+        store.export_parquet(path, **filters)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+@st.fragment
+def render_history_panel(store, on_load, loadable=LOADABLE_KINDS):
+    """
+    Searchable list of past generations (fragment: searching doesn't rerun
+    the app). on_load(record) is called for "Laden", followed by a full rerun;
+    only records of the kinds in loadable can be loaded.
+    """
+    stats = store.stats()
+    if not stats["entries"]:
+        st.caption("Noch keine Generierungen gespeichert.")
+        return
+    facets = store.facets()
+
+    query = st.text_input("Volltextsuche", placeholder="z. B. Grenzen setzen", key="history_query")
+    col1, col2, col3 = st.columns(3)
+    topic = col1.selectbox("Thema", [""] + facets["topic"], key="history_topic")
+    stage = col2.selectbox("Phase", [""] + facets["stage"], key="history_stage")
+    goal = col3.selectbox("Ziel", [""] + facets["goal"], key="history_goal")
+    days = st.date_input("Zeitraum", value=(), key="history_dates")
+
+    filters = {"query": query, "topic": topic, "stage": stage, "goal": goal}
+    if len(days) >= 1:
+        filters["since"] = datetime.combine(days[0], datetime.min.time()).timestamp()
+    if len(days) == 2:
+        filters["until"] = (datetime.combine(days[1], datetime.min.time()) + timedelta(days=1)).timestamp()
+
+    started = time.perf_counter()
+    total = store.count(**filters)
+    records = store.search(limit=HISTORY_PAGE_SIZE, **filters)
+    st.caption(f"{total} von {stats['entries']} Einträgen · {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    for rec in records:
+        created = datetime.fromtimestamp(rec["created_at"]).strftime("%d.%m.%Y %H:%M")
+        tokens = f" · {rec['total_tokens']} Tokens" if rec["total_tokens"] else ""
+        col_text, col_btn = st.columns([5, 1])
+        col_text.markdown(f"**{rec['title_hook'] or '—'}**  \n"
+                          f"{created} · {HISTORY_KINDS.get(rec['kind'], rec['kind'])} · {rec['topic'] or ''} · "
+                          f"{rec['model']}{tokens}")
+        if col_btn.button("Laden", key=f"history_load_{rec['id']}",
+                          disabled=rec["kind"] not in loadable or not isinstance(rec["data"], dict)):
+            on_load(rec)
+            st.rerun(scope="app")
+
+    col_pq, col_csv = st.columns(2)
+    col_pq.download_button("📦 Parquet", data=lambda: _parquet_bytes(store, filters),
+                           file_name="storygen_history.parquet", mime="application/octet-stream",
+                           use_container_width=True)
+    col_csv.download_button("📊 CSV", data=lambda: store.to_dataframe(**filters).to_csv(index=False).encode(),
+                            file_name="storygen_history.csv", mime="text/csv", use_container_width=True)
+
+
+# -----------------------------
+# Near-duplicates
+# -----------------------------
+def render_duplicates(duplicates: list):
+    """Warning listing the texts that nearly repeat earlier stories (story_dedup)"""
+    if not duplicates:
+        return
+    lines = []
+    for dup in duplicates:
+        when = datetime.fromtimestamp(dup["created_at"]).strftime("%d.%m.%Y")
+        lines.append(f"- **{dup['field']}** ({dup['similarity']:.0%} ähnlich zu „{dup['match'][:90]}“, {when})")
+    st.warning("♻️ Ähnliche Inhalte wurden schon einmal generiert:\n" + "\n".join(lines))
+
+
+# -----------------------------
+# No-go check
+# -----------------------------
+def render_no_go_report(hits: list, repaired: list):
+    """Which parts were rewritten because of no-go terms, and which hits remain (story_nogo)"""
+    if repaired:
+        st.info(f"🛠️ Wegen Tabu-Wörtern neu formuliert: {', '.join(repaired)}")
+    if hits:
+        lines = [f"- **{hit['field']}**: „{hit['match']}“ ({hit['term']})" for hit in hits]
+        st.warning("🚫 Enthält noch Tabu-Wörter:\n" + "\n".join(lines))
+
+
+# -----------------------------
+# Per-slide actions
+# -----------------------------
+SLIDE_ACTION_LABELS = {"regenerate": "🔄 Neu", "shorten": "✂️ Kürzen"}
+
+
+def slide_action_buttons(key: str, index: int):
+    """Regenerate / shorten buttons under a slide; returns the clicked action or None"""
+    clicked = None
+    for col, (action, label) in zip(st.columns(len(SLIDE_ACTION_LABELS)), SLIDE_ACTION_LABELS.items()):
+        if col.button(label, key=f"{key}_{action}_{index}", use_container_width=True):
+            clicked = action
+    return clicked
+
+
+# -----------------------------
+# Variants
+# -----------------------------
+def render_variant_picker(variants: list, selected: int, key: str) -> int:
+    """Radio over the ranked variants (story_variants) with their criteria; returns the chosen index"""
+    from story_variants import variant_summary
+
+    choice = st.radio(
+        "Varianten (lokal gerankt)",
+        range(len(variants)),
+        index=selected,
+        format_func=lambda i: f"#{variants[i]['rank']}: {(variants[i]['data'] or {}).get('title_hook', '—')}",
+        horizontal=True,
+        key=key,
+    )
+    st.caption(variant_summary(variants[choice]))
+    return choice
+
+
+# -----------------------------
+# Telemetry (story_metrics)
+# -----------------------------
+def _seconds(value) -> str:
+    return f"{value:.2f} s" if value is not None else "–"
+
+
+def render_metrics_summary(summary: dict, compact: bool = False):
+    """Headline numbers of MetricsRegistry.summary(); compact: sidebar-sized"""
+    tokens = summary["prompt_tokens"] + summary["completion_tokens"]
+    hit_rate = f"{summary['cache_hit_rate']:.0%}" if summary["cache_hit_rate"] is not None else "–"
+    coalesced = f"{summary['coalesced_rate']:.0%}" if summary["coalesced_rate"] is not None else "–"
+    if compact:
+        col1, col2 = st.columns(2)
+        col1.metric("API Calls", summary["calls"])
+        col2.metric("Tokens", f"{tokens:,}".replace(",", "."))
+        st.caption(f"💶 ~${summary['cost_usd']:.4f} · p50 {_seconds(summary['latency_p50_s'])} · "
+                   f"Cache-Treffer {hit_rate} · gebündelt {coalesced} (alle Sessions)")
+        return
+    cols = st.columns(5)
+    cols[0].metric("API Calls", summary["calls"], f"{summary['errors']} Fehler" if summary["errors"] else None,
+                   delta_color="inverse")
+    cols[1].metric("Tokens (Prompt / Antwort)", f"{summary['prompt_tokens']:,} / {summary['completion_tokens']:,}")
+    cols[2].metric("Kosten (geschätzt)", f"${summary['cost_usd']:.4f}")
+    cols[3].metric("Cache-Trefferquote", hit_rate)
+    cols[4].metric("Abgebrochen", summary["cancelled"],
+                   f"bis {summary['tokens_saved']:,} Tokens gespart" if summary["tokens_saved"] else None,
+                   delta_color="off", help="Abgebrochene Streams; gespart = Token-Budget minus bereits empfangen")
+    cols = st.columns(5)
+    cols[0].metric("Latenz p50 / p95", f"{_seconds(summary['latency_p50_s'])} / {_seconds(summary['latency_p95_s'])}")
+    cols[1].metric("Time to first token p50", _seconds(summary["ttft_p50_s"]))
+    cols[2].metric("Retries", summary["retries"])
+    cols[3].metric("Parse-Fehler", summary["parse_failures"])
+    cols[4].metric("Gebündelte Anfragen", summary["coalesced"], coalesced if summary["coalesced"] else None,
+                   delta_color="off", help="Identische Anfragen, die auf einen laufenden Aufruf gewartet haben")
+
+
+def render_metrics_dashboard(registry):
+    """Telemetrie page: totals, per model/kind breakdown, latency over time, Prometheus export"""
+    import pandas as pd
+
+    render_metrics_summary(registry.summary())
+    calls = pd.DataFrame(registry.calls())
+    if calls.empty:
+        st.info("Noch keine API-Aufrufe in diesem Prozess.")
+    else:
+        calls["time"] = pd.to_datetime(calls["time"], unit="s")
+        st.subheader("Nach Modell & Art")
+        by_model = calls.groupby(["model", "kind"]).agg(
+            calls=("status", "size"),
+            errors=("status", lambda s: int((s == "error").sum())),
+            prompt_tokens=("prompt_tokens", "sum"),
+            completion_tokens=("completion_tokens", "sum"),
+            cost_usd=("cost_usd", "sum"),
+            latency_p50_s=("latency_s", "median"),
+            latency_max_s=("latency_s", "max"),
+            ttft_p50_s=("ttft_s", "median"),
+        ).reset_index()
+        st.dataframe(by_model, hide_index=True, use_container_width=True)
+        st.subheader("Latenz der letzten Aufrufe")
+        st.line_chart(calls.set_index("time")[["latency_s", "ttft_s"]])
+        st.caption(f"Letzte {len(calls)} Aufrufe; Summen oben seit Prozessstart "
+                   f"({datetime.fromtimestamp(registry.started).strftime('%d.%m.%Y %H:%M')}).")
+    with st.expander("Prometheus"):
+        text = registry.prometheus()
+        st.download_button("⬇️ metrics.prom", data=text, file_name="storygen_metrics.prom", mime="text/plain")
+        st.code(text, language="text")
+
+
+# -----------------------------
+# Accounts & quotas (story_auth)
+# -----------------------------
+@st.cache_resource
+def get_user_store():
+    """Process-wide accounts + quota ledger (one ledger, so quotas hold across sessions)"""
+    from story_auth import UserStore
+    return UserStore()
+
+
+def login_gate():
+    """
+    Login form until the session holds a valid signed token; returns the
+    username (None while no account exists: open mode, as before accounts).
+    bcrypt only runs on submit; reruns just check the token signature.
+    """
+    store = get_user_store()
+    if not store.has_users():
+        return None
+    user = store.verify_token(st.session_state.get("auth_token"))
+    if user:
+        st.session_state.user = user
+        return user
+    st.session_state.user = None
+    st.title("🔐 Anmeldung")
+    with st.form("login"):
+        username = st.text_input("Benutzername")
+        password = st.text_input("Passwort", type="password")
+        submitted = st.form_submit_button("Anmelden", type="primary")
+    if submitted:
+        token = store.login(username.strip(), password)
+        if token:
+            st.session_state.auth_token = token
+            st.rerun()
+        st.error("Benutzername oder Passwort falsch.")
+    st.stop()
+
+
+def session_quota():
+    """story_auth.SessionQuota of the logged-in user (quota= of story_core), None in open mode"""
+    from story_auth import SessionQuota
+    user = st.session_state.get("user")
+    return SessionQuota(get_user_store().ledger, user) if user else None
+
+
+def _limit(used: int, limit: int) -> str:
+    return f"{used:,}".replace(",", ".") + (" / " + f"{limit:,}".replace(",", ".") if limit else "")
+
+
+def render_user_box():
+    """Sidebar: logged-in user, today's usage against the quota, logout"""
+    user = st.session_state.get("user")
+    if not user:
+        return
+    usage = get_user_store().ledger.usage(user)
+    st.caption(f"👤 **{user}** · heute {_limit(usage['tokens'], usage['daily_tokens'])} Tokens · "
+               f"{_limit(usage['requests'], usage['daily_requests'])} Anfragen")
+    if usage["daily_tokens"]:
+        st.progress(min(1.0, usage["tokens"] / usage["daily_tokens"]))
+    if st.button("Abmelden", key="logout"):
+        st.session_state.auth_token = None
+        st.session_state.user = None
+        st.rerun()
+
+
+# -----------------------------
+# Background jobs (story_jobs)
+# -----------------------------
+JOB_POLL_S = 0.5
+MAX_ACTIVE_JOBS = 3  # queued + running per session
+JOB_LIST_SIZE = 8
+JOB_STATES = {
+    "queued": "⏳ in der Warteschlange",
+    "running": "🔄 läuft",
+    "done": "✅ fertig",
+    "failed": "❌ fehlgeschlagen",
+    "cancelled": "🚫 abgebrochen",
+}
+
+
+@st.cache_resource
+def get_job_executor():
+    """Process-wide generation pool: jobs keep running across reruns, reloads and sessions"""
+    from story_jobs import JobExecutor
+    return JobExecutor()
+
+
+def session_jobs() -> list:
+    """
+    Job ids of this session, oldest first. Mirrored into the URL (?jobs=...)
+    so a page reload (a new session) finds its running and finished jobs again.
+    """
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = [i for i in st.query_params.get("jobs", "").split(",") if i]
+    return st.session_state.jobs
+
+
+def _save_jobs(ids: list):
+    st.session_state.jobs = ids[-JOB_LIST_SIZE:]
+    if ids:
+        st.query_params["jobs"] = ",".join(st.session_state.jobs)
+    else:
+        st.query_params.pop("jobs", None)
+
+
+def _visible_jobs() -> list:
+    """Snapshots of this session's jobs that still exist and belong to the logged-in user"""
+    executor = get_job_executor()
+    user = st.session_state.get("user")
+    jobs = [executor.get(job_id) for job_id in session_jobs()]
+    return [job.snapshot() for job in jobs if job and job.owner == user]
+
+
+def _active(jobs: list) -> bool:
+    return any(job["state"] in ("queued", "running") for job in jobs)
+
+
+def submit_job(fn, label: str):
+    """Queue fn(job) in the job pool; returns the job id (None if this session already has enough queued)"""
+    active = [job for job in _visible_jobs() if job["state"] in ("queued", "running")]
+    if len(active) >= MAX_ACTIVE_JOBS:
+        st.warning(f"{len(active)} Generierungen laufen bereits – bitte warte, bis eine fertig ist.")
+        return None
+    job_id = get_job_executor().submit(fn, label=label, owner=st.session_state.get("user"))
+    _save_jobs(session_jobs() + [job_id])
+    return job_id
+
+
+def jobs_panel(apply, render_partial=None):
+    """
+    This session's generation jobs: status, progress, the partial story while
+    it streams, errors, a cancel button. A finished result (or what a
+    cancelled job kept) is handed to apply(result) once (oldest first, so the
+    newest ends up shown), then the page reruns.
+    Polls every JOB_POLL_S (as a fragment) while a job is queued or running.
+    """
+    active = _active(_visible_jobs())
+    st.fragment(_jobs_fragment, run_every=JOB_POLL_S if active else None)(apply, render_partial, active)
+
+
+def _jobs_fragment(apply, render_partial, polling: bool):
+    jobs = _visible_jobs()
+    applied = st.session_state.setdefault("jobs_applied", set())
+    fresh = [job for job in jobs if job["result"] is not None and job["id"] not in applied]
+    for job in fresh:
+        apply(job["result"])
+        applied.add(job["id"])
+        st.session_state.jobs_shown = job["id"]
+    if fresh or (polling and not _active(jobs)):
+        st.rerun()  # full rerun: output and exports follow, polling stops when idle
+    if not jobs:
+        return
+
+    executor = get_job_executor()
+    # Polls would push every other section out of the RERUN_HISTORY timings: only clicks are timed
+    with nullcontext() if polling else measure_rerun("Jobs"):
+        for job in reversed(jobs):
+            with st.container(border=True):
+                col_info, col_action = st.columns([5, 1])
+                state = job["state"]
+                if state == "running":
+                    timing = f" · {time.time() - job['started']:.0f}s"
+                elif job["started"] and job["finished"]:
+                    timing = f" · {job['finished'] - job['started']:.1f}s"
+                else:
+                    timing = ""
+                if state == "running" and job["cancelling"]:
+                    status = "⏹️ wird abgebrochen…"
+                elif state == "cancelled" and job["result"] is not None:
+                    status = "🚫 abgebrochen (bisherige Slides behalten)"
+                else:
+                    status = JOB_STATES[state]
+                col_info.markdown(f"{status} · **{job['label']}**{timing}")
+                if state in ("queued", "running"):
+                    if not job["cancelling"] and col_action.button(
+                        "Abbrechen", key=f"job_cancel_{job['id']}", use_container_width=True,
+                        help="Bricht die laufende Anfrage ab; bereits empfangene Slides bleiben erhalten",
+                    ):
+                        executor.cancel(job["id"])
+                        st.rerun()
+                else:
+                    if job["result"] is not None and job["id"] != st.session_state.get("jobs_shown"):
+                        if col_action.button("Anzeigen", key=f"job_show_{job['id']}", use_container_width=True):
+                            apply(job["result"])
+                            st.session_state.jobs_shown = job["id"]
+                            st.rerun()
+                    if col_action.button("Entfernen", key=f"job_drop_{job['id']}", use_container_width=True):
+                        _save_jobs([i for i in session_jobs() if i != job["id"]])
+                        st.rerun()
+                if state == "running" and job["progress"]:
+                    st.progress(*job["progress"])
+                if state == "running" and job["partial"] and render_partial:
+                    render_partial(job["partial"])
+                if state == "failed":
+                    st.error(job["error"])
+                    if job["detail"]:
+                        st.code(job["detail"])
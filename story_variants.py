@@ -0,0 +1,76 @@
+"""
+Local ranking of several candidates for the same config ("N variants").
+
+Candidates come from story_core.run_completion_n (one request with `n`, or
+parallel calls). They are ranked without further API calls, in this order:
+schema validity (story_schema), slide_length compliance, no-go hits (story_nogo) and
+similarity to earlier stories (story_dedup).
+"""
+from story_dedup import story_texts
+from story_nogo import find_no_gos, get_matcher
+from story_schema import validate
+
+MAX_VARIANTS = 4
+# Slides may overshoot slide_length a little before they count as too long
+LENGTH_TOLERANCE = 1.15
+
+
+def schema_problems(data, cfg: dict, schema: str = "story") -> list:
+    """Schema violations plus a wrong slide count (empty list = usable)"""
+    problems = validate(schema, data)
+    slides = data.get("slides") if isinstance(data, dict) else None
+    if isinstance(slides, list) and cfg.get("num_slides") and len(slides) != int(cfg["num_slides"]):
+        problems.append(f"{len(slides)} statt {cfg['num_slides']} Slides")
+    return problems
+
+
+def over_length(data, cfg: dict) -> list:
+    """slide_no of every slide whose body exceeds cfg["slide_length"]"""
+    limit = int(cfg.get("slide_length") or 0) * LENGTH_TOLERANCE
+    if not limit or not isinstance(data, dict):
+        return []
+    return [
+        s.get("slide_no", i + 1) for i, s in enumerate(data.get("slides") or [])
+        if isinstance(s, dict) and len(str(s.get("body", ""))) > limit
+    ]
+
+
+def rank_variants(candidates: list, cfg: dict, index=None, lexicon: bool = True, schema: str = "story") -> list:
+    """
+    Rank [(data, raw)] best first. Each entry: {"data", "raw", "problems",
+    "over_length", "no_go_hits", "similarity", "rank"}. index: DuplicateIndex
+    for the similarity to earlier stories (0.0 without one); schema: name in
+    story_schema.SCHEMAS.
+    """
+    matcher = get_matcher(cfg.get("no_gos", ""), lexicon)
+    ranked = []
+    for data, raw in candidates:
+        problems = schema_problems(data, cfg, schema)
+        usable = isinstance(data, dict)
+        duplicates = index.check(data) if index is not None and usable else []
+        ranked.append({
+            "data": data,
+            "raw": raw,
+            "problems": problems,
+            "over_length": over_length(data, cfg),
+            "no_go_hits": find_no_gos(data, matcher) if usable else [],
+            # Share of the story's texts that repeat earlier content, weighted by how close they are
+            "similarity": round(sum(d["similarity"] for d in duplicates) / max(1, len(story_texts(data))), 2)
+            if duplicates else 0.0,
+        })
+    ranked.sort(key=lambda v: (len(v["problems"]), len(v["over_length"]), len(v["no_go_hits"]), v["similarity"]))
+    for rank, variant in enumerate(ranked, start=1):
+        variant["rank"] = rank
+    return ranked
+
+
+def variant_summary(variant: dict) -> str:
+    """One-line German summary of the ranking criteria of a variant"""
+    problems = variant["problems"]
+    parts = ["✅ Schema ok" if not problems else "⚠️ " + ", ".join(problems[:3]) + (" …" if len(problems) > 3 else "")]
+    if variant["over_length"]:
+        parts.append(f"zu lang: Slide {', '.join(map(str, variant['over_length']))}")
+    if variant["no_go_hits"]:
+        parts.append(f"{len(variant['no_go_hits'])} Tabu-Treffer")
+    parts.append(f"Ähnlichkeit {variant['similarity']:.0%}")
+    return " · ".join(parts)
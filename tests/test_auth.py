@@ -0,0 +1,103 @@
+import pytest
+
+import story_auth
+from story_auth import QuotaExceeded, SessionQuota, UserStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(story_auth, "BCRYPT_ROUNDS", 4)  # keep bcrypt fast in tests
+    store = UserStore(str(tmp_path / "users.sqlite3"), secret="test")
+    store.add_user("alice", "pw", daily_tokens=1000, daily_requests=3)
+    return store
+
+
+# -----------------------------
+# Tokens
+# -----------------------------
+def test_login_issues_a_token_that_verifies(store):
+    assert store.login("alice", "wrong") is None
+    assert store.login("bob", "pw") is None
+    assert store.verify_token(store.login("alice", "pw")) == "alice"
+
+
+@pytest.mark.parametrize("token", ["", "no-dot", "a.b", "!!.??"])
+def test_garbage_tokens_are_rejected(store, token):
+    assert store.verify_token(token) is None
+
+
+def test_tampered_token_is_rejected(store):
+    payload, signature = store.issue_token("alice").split(".")
+    forged = story_auth._b64(story_auth._unb64(payload).replace(b"alice", b"admin"))
+    assert store.verify_token(f"{forged}.{signature}") is None
+
+
+def test_token_of_another_secret_is_rejected(store, tmp_path):
+    other = UserStore(str(tmp_path / "users.sqlite3"), secret="other")
+    assert other.verify_token(store.issue_token("alice")) is None
+
+
+def test_expired_token_is_rejected(store):
+    assert store.verify_token(store.issue_token("alice", ttl=-1)) is None
+
+
+def test_password_change_and_removal_end_sessions(store):
+    token = store.issue_token("alice")
+    store.set_password("alice", "neu")
+    assert store.verify_token(token) is None
+    token = store.login("alice", "neu")
+    store.remove_user("alice")
+    assert store.verify_token(token) is None
+
+
+def test_generated_secret_is_shared_by_the_file(tmp_path):
+    path = str(tmp_path / "users.sqlite3")
+    first = UserStore(path)
+    first.add_user("alice", "pw")
+    assert UserStore(path).verify_token(first.issue_token("alice")) == "alice"
+
+
+# -----------------------------
+# Quotas
+# -----------------------------
+def test_token_limit(store):
+    ledger = store.ledger
+    ledger.reserve("alice", 600)
+    with pytest.raises(QuotaExceeded):
+        ledger.reserve("alice", 500)
+    assert ledger.usage("alice")["tokens"] == 600
+
+
+def test_request_limit(store):
+    for _ in range(3):
+        store.ledger.reserve("alice", 1)
+    with pytest.raises(QuotaExceeded):
+        store.ledger.reserve("alice", 1)
+
+
+def test_unknown_user_has_no_quota(store):
+    with pytest.raises(QuotaExceeded):
+        store.ledger.reserve("bob", 1)
+
+
+def test_release_undoes_a_reservation(store):
+    day = store.ledger.reserve("alice", 600)
+    store.ledger.release("alice", day, 600)
+    assert store.ledger.usage("alice")["tokens"] == 0
+    assert store.ledger.usage("alice")["requests"] == 0
+
+
+def test_settle_replaces_the_estimate_and_persists(store):
+    store.set_quota("alice", daily_tokens=100_000)
+    quota = SessionQuota(store.ledger, "alice")
+    reservation = quota.reserve({"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "x" * 400}]})
+    quota.settle(reservation, {"prompt_tokens": 100, "completion_tokens": 50})
+    assert store.ledger.usage("alice")["tokens"] == 150
+    assert store.load_usage(reservation[0]) == {"alice": [150, 1]}
+
+
+def test_zero_limit_is_unlimited(store):
+    store.set_quota("alice", daily_tokens=0, daily_requests=0)
+    for _ in range(10):
+        store.ledger.reserve("alice", 10_000)
+    assert store.ledger.usage("alice")["requests"] == 10
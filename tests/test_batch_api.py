@@ -0,0 +1,29 @@
+import json
+from types import SimpleNamespace
+
+from story_batch import build_job
+from story_batch_api import collect, save_state
+
+STORY = {"title_hook": "Hook", "slides": [], "caption_variants": [], "cta_options": [],
+         "poll_or_question": {"type": "poll", "prompt": "p", "options": []}, "hashtags": [], "safety_note": "n"}
+
+
+def output_line(custom_id, data):
+    body = {"choices": [{"message": {"content": json.dumps(data)}}], "usage": None}
+    return json.dumps({"custom_id": custom_id, "response": {"status_code": 200, "body": body}}) + "\n"
+
+
+def test_unknown_custom_id_is_skipped(tmp_path):
+    output = str(tmp_path / "month.jsonl")
+    args = SimpleNamespace(mode="story", model="gpt-4o-mini", temperature=0.5)
+    save_state(output, {"batch_id": "b", "status": "completed", "output_file_id": "f",
+                        "jobs": [build_job(0, {"id": "a"}, args)]})
+    with open(output + ".batch_output.jsonl", "w", encoding="utf-8") as f:  # already downloaded
+        f.write(output_line("stale", STORY) + output_line("a", STORY))
+
+    logged = []
+    counts = collect(None, output, log=logged.append)
+    assert counts == {"ok": 1, "failed": 1, "skipped": 0, "invalid": 0}
+    assert "stale" in logged[0]
+    with open(output, encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == ["a"]
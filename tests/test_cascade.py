@@ -0,0 +1,91 @@
+import copy
+
+import pytest
+
+import story_cascade
+from story_cascade import check_story, route
+from story_dedup import DuplicateIndex
+
+TIERS = ("small", "large")
+CFG = {"topic": "Grenzen", "num_slides": 3, "slide_length": 120, "no_gos": ""}
+
+
+def make_story(long_slide=None):
+    slides = [{"slide_no": i, "headline": f"Schritt {i}",
+               "body": f"Grenzen setzen ist kein Egoismus, sondern Selbstschutz Nummer {i}",
+               "sticker_suggestion": "Umfrage", "visual_suggestion": "ruhiges Blau"} for i in range(1, 4)]
+    if long_slide is not None:
+        slides[long_slide]["body"] = "Viel zu lang. " * 40
+    return {
+        "title_hook": "Du bist nicht verrückt, du bist einfach nur erschöpft",
+        "slides": slides,
+        "caption_variants": ["Speicher dir das für schwere Tage und teile es mit jemandem, der es braucht"],
+        "cta_options": ["Schreib mir"],
+        "poll_or_question": {"type": "poll", "prompt": "Kennst du das?", "options": ["Ja", "Nein"]},
+        "hashtags": ["grenzen"],
+        "safety_note": "Keine Diagnose",
+    }
+
+
+class CachedGenerate:
+    """A generate_* function whose answers come from the response cache: same model, same story"""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.models = []
+
+    def __call__(self, client, model, creativity, cfg, **opts):
+        self.models.append(model)
+        return copy.deepcopy(self.answers[model]), "raw"
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DuplicateIndex(str(tmp_path / "dedup.sqlite3"))
+
+
+@pytest.fixture(autouse=True)
+def shortened(monkeypatch):
+    def revise(client, model, creativity, cfg, data, index, action, **opts):
+        slides = list(data["slides"])
+        slides[index] = dict(slides[index], body="Kurz und klar.")
+        return dict(data, slides=slides), "raw"
+    monkeypatch.setattr(story_cascade, "revise_slide", revise)
+
+
+def test_passing_story_stays_on_the_first_tier(index):
+    generate = CachedGenerate({"small": make_story(), "large": make_story()})
+    data, _, report = route(generate, None, 0.5, CFG, tiers=TIERS, index=index)
+    assert generate.models == ["small"]
+    assert report["model"] == "small" and report["problems"] == []
+
+
+def test_too_long_slide_is_escalated_alone(index):
+    generate = CachedGenerate({"small": make_story(long_slide=1), "large": make_story()})
+    data, _, report = route(generate, None, 0.5, CFG, tiers=TIERS, index=index)
+    assert generate.models == ["small"]
+    assert report["escalated"] == [2] and report["slide_model"] == "large"
+    assert data["slides"][1]["body"] == "Kurz und klar."
+
+
+def test_wrong_slide_count_escalates_the_story():
+    generate = CachedGenerate({"small": make_story(), "large": make_story()})
+    _, _, report = route(generate, None, 0.5, dict(CFG, num_slides=5), tiers=TIERS)
+    assert generate.models == ["small", "large"]
+    assert report["problems"] == ["3 statt 5 Slides"]
+
+
+@pytest.mark.parametrize("long_slide", [None, 1])
+def test_cached_repeat_is_not_escalated(index, long_slide):
+    generate = CachedGenerate({"small": make_story(long_slide), "large": make_story()})
+    for _ in range(2):
+        _, _, report = route(generate, None, 0.5, CFG, tiers=TIERS, index=index)
+        assert report["model"] == "small" and report["duplicates"] == []
+    assert generate.models == ["small", "small"]
+
+
+def test_other_story_repeating_the_hook_fails_the_check(index):
+    index.add(make_story())
+    other = make_story()
+    other["caption_variants"] = ["Eine ganz neue Caption über Funkstille, die es so noch nicht gab"]
+    assert "Hook: wiederholt frühere Inhalte" in check_story(other, CFG, index=index)["story"]
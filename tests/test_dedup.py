@@ -0,0 +1,89 @@
+import sqlite3
+
+import pytest
+
+from story_dedup import DuplicateIndex, generate_unique, shingles, signature, similarity, story_key
+
+
+def make_story(hook="Du bist nicht verrückt, du bist einfach nur erschöpft", body="Grenzen setzen ist kein Egoismus"):
+    return {
+        "title_hook": hook,
+        "slides": [{"slide_no": i, "headline": f"Schritt {i}", "body": f"{body}, sondern Selbstschutz Nummer {i}"}
+                   for i in range(1, 4)],
+        "caption_variants": ["Speicher dir das für schwere Tage und teile es mit jemandem, der es braucht"],
+    }
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DuplicateIndex(str(tmp_path / "dedup.sqlite3"))
+
+
+def test_similar_texts_have_similar_signatures():
+    a = signature(shingles("Du bist nicht verrückt, du bist erschöpft"))
+    b = signature(shingles("Du bist nicht verrückt – du bist nur erschöpft"))
+    c = signature(shingles("Heute geht es um Grenzen im Familienkreis"))
+    assert similarity(a, b) > 0.6 > similarity(a, c)
+
+
+def test_story_is_not_a_duplicate_of_itself(index):
+    story = make_story()
+    assert index.add(story, topic="t") > 0
+    # The same answer again (response cache, resumed batch): checked twice, never a duplicate
+    assert index.check(story) == []
+    assert index.check(dict(story)) == []
+
+
+def test_add_is_idempotent(index):
+    story = make_story()
+    added = index.add(story)
+    assert index.add(story) == 0
+    assert index.stats()["texts"] == added
+
+
+def test_other_story_repeating_a_hook_is_reported(index):
+    index.add(make_story())
+    other = make_story(body="Ein ganz anderer Text über Funkstille und was sie mit dir macht")
+    fields = [dup["field"] for dup in index.check(other)]
+    assert "Hook" in fields
+    assert all(dup["similarity"] >= index.threshold for dup in index.check(other))
+
+
+def test_key_ties_a_revised_story_to_its_original(index):
+    original = make_story()
+    revised = dict(original, caption_variants=["Eine neue Caption, die vorher so nie dastand, ganz bestimmt nicht"])
+    index.add(revised, key=story_key(original))
+    assert index.check(original) == []
+    assert index.check(make_story(body="Ein ganz anderer Text über Funkstille und was sie mit dir macht"))
+
+
+def test_cached_answer_is_not_rerolled(index):
+    story = make_story()
+    calls = []
+
+    def generate(client, model, creativity, cfg, **opts):
+        calls.append(opts.get("force_fresh", False))
+        return story, "raw"  # what a response-cache hit returns every time
+
+    for _ in range(2):
+        data, _, duplicates = generate_unique(generate, None, "m", 0.5, {"topic": "t"}, index=index, rerolls=2)
+        assert duplicates == []
+    assert calls == [False, False]
+
+
+def test_index_from_before_story_keys_is_migrated(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE texts (id INTEGER PRIMARY KEY, created_at REAL NOT NULL, source TEXT, topic TEXT,
+                            field TEXT, text TEXT NOT NULL, signature BLOB NOT NULL);
+        CREATE TABLE buckets (key INTEGER NOT NULL, text_id INTEGER NOT NULL, PRIMARY KEY (key, text_id))
+            WITHOUT ROWID;
+        """
+    )
+    conn.close()
+    index = DuplicateIndex(path)
+    story = make_story()
+    index.add(story)
+    assert index.check(story) == []
@@ -0,0 +1,52 @@
+import pytest
+
+from story_json import parse_json, repair_json
+
+
+def test_valid_json_needs_no_repair():
+    assert parse_json('{"a": 1}') == ({"a": 1}, [], False)
+
+
+def test_text_and_fences_around_the_object_are_removed():
+    result = parse_json('Hier ist die Story:\n```json\n{"a": 1}\n```')
+    assert result.data == {"a": 1}
+    assert result.repairs == ["removed text around JSON"]
+
+
+@pytest.mark.parametrize("text, data, repair", [
+    ("{'a': 'b'}", {"a": "b"}, "converted single-quoted string"),
+    ('{"a": True, "b": None}', {"a": True, "b": None}, "converted Python literal"),
+    ('{a: 1}', {"a": 1}, "quoted bare word"),
+    ('{"a": 1,}', {"a": 1}, "removed trailing comma"),
+    ('{"a": [1, 2,, 3]}', {"a": [1, 2, 3]}, "removed extra comma"),
+    ('{"a": "x" "b": 2}', {"a": "x", "b": 2}, "inserted missing comma"),
+    ('{"a": 1 /* x */, # y\n "b": 2 // z\n}', {"a": 1, "b": 2}, "removed comment"),
+    ('{"a": "line\nbreak"}', {"a": "line\nbreak"}, "escaped newline in string"),
+])
+def test_typical_model_mistakes_are_repaired(text, data, repair):
+    result = parse_json(text)
+    assert result.data == data
+    assert any(r.startswith(repair) for r in result.repairs)
+    assert not result.truncated
+
+
+def test_apostrophes_in_strings_are_kept():
+    assert parse_json('{"a": "don\'t"}').data == {"a": "don't"}
+    assert parse_json("{'a': \"it's\"}").data == {"a": "it's"}
+
+
+def test_truncated_output_keeps_what_arrived():
+    result = parse_json('{"slides": [{"body": "abc')
+    assert result.data == {"slides": [{"body": "abc"}]}
+    assert result.truncated
+
+
+def test_truncated_key_gets_a_null_value():
+    result = repair_json('{"a": 1, "b"')
+    assert result.data == {"a": 1, "b": None}
+    assert result.truncated
+
+
+def test_no_json_gives_no_data():
+    assert parse_json("Das kann ich leider nicht.").data is None
+    assert parse_json(None).data is None
@@ -0,0 +1,59 @@
+import pytest
+
+from story_nogo import NoGoMatcher, build_patch, find_no_gos, fold, merge_patch, parse_terms, stem
+
+
+def test_fold_and_stem():
+    assert fold("Größe Café") == "groesse cafe"
+    assert stem("narzissten") == "narzisst"
+    assert stem("rat") == "rat"  # never below MIN_STEM
+
+
+def test_parse_terms_skips_comments():
+    assert parse_terms("a, b\n# kommentar\n c ,\n") == ["a", "b", "c"]
+
+
+@pytest.mark.parametrize("text, match", [
+    ("Er ist ein NARZISST.", "NARZISST"),
+    ("Lauter Narzissten hier", "Narzissten"),
+    ("Sie ist eine Narzisstin", "Narzisstin"),
+    ("Rachegedanken helfen nicht", "Rachegedanken"),
+    ("er ist krank im Kopf!", "krank im Kopf"),
+])
+def test_matches_inflections_wildcards_and_phrases(text, match):
+    matcher = NoGoMatcher(["Narzisst", "rache*", "krank im kopf"])
+    assert [m for _, m in matcher.find(text)] == [match]
+
+
+@pytest.mark.parametrize("text", ["Narzissmus", "Kopf krank", "krank im Bett", ""])
+def test_whole_words_only_without_wildcard(text):
+    assert NoGoMatcher(["Narzisst", "krank im kopf"]).find(text) == []
+
+
+def test_overlapping_terms_count_once():
+    matcher = NoGoMatcher(["narzisst", "narzisstin"])
+    assert len(matcher.find("Narzisstin")) == 1
+
+
+def test_find_no_gos_labels_fields_and_skips_meta():
+    data = {"title_hook": "Kein Narzisst", "safety_note": "Narzisst",
+            "slides": [{"slide_no": 1, "body": "ok"}, {"slide_no": 2, "body": "Narzisst"}]}
+    hits = find_no_gos(data, NoGoMatcher(["narzisst"]))
+    assert [(h["path"], h["field"]) for h in hits] == [
+        (("title_hook",), "Hook"), (("slides", 1, "body"), "Slide 2 · Text")]
+
+
+def test_patch_contains_only_offending_parts_and_merges_back():
+    data = {"title_hook": "Narzisst", "hashtags": ["#ok"],
+            "slides": [{"slide_no": 1, "body": "ok"}, {"slide_no": 2, "body": "Narzisst"}]}
+    hits = find_no_gos(data, NoGoMatcher(["narzisst"]))
+    patch, positions = build_patch(data, hits)
+    assert patch == {"title_hook": "Narzisst", "slides": [{"slide_no": 2, "body": "Narzisst"}]}
+    assert positions == {"slides": [1]}
+
+    fixed = {"title_hook": "Neu", "slides": [{"slide_no": 9, "body": "anders"}], "hashtags": ["#neu"]}
+    merged = merge_patch(data, patch, fixed, positions)
+    assert merged["title_hook"] == "Neu"
+    assert merged["slides"] == [{"slide_no": 1, "body": "ok"}, {"slide_no": 2, "body": "anders"}]
+    assert merged["hashtags"] == ["#ok"]  # not part of the patch
+    assert data["slides"][1]["body"] == "Narzisst"
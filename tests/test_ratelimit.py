@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from story_core import DEFAULT_CFG, run_completion, story_request
+from story_ratelimit import RateLimitScheduler, TokenBucket, estimate_tokens, parse_duration
+from story_stream import GenerationCancelled
+
+STORY = {"title_hook": "Hook", "slides": [], "caption_variants": [], "cta_options": [],
+         "poll_or_question": {"type": "poll", "prompt": "p", "options": []}, "hashtags": [], "safety_note": "n"}
+
+
+def chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class StreamingClient:
+    """Just enough of openai.OpenAI for RateLimitScheduler.create with stream=True"""
+
+    def __init__(self, usage):
+        self.usage = usage
+        self.chat = SimpleNamespace(completions=SimpleNamespace(with_raw_response=self))
+
+    def with_options(self, **kwargs):
+        return self
+
+    def create(self, **request):
+        text = json.dumps(STORY)
+        chunks = [chunk(text[i:i + 20]) for i in range(0, len(text), 20)] + [chunk(usage=self.usage)]
+        return SimpleNamespace(headers={}, parse=lambda: iter(chunks))
+
+
+# -----------------------------
+# Token bucket
+# -----------------------------
+def test_bucket_admits_up_to_capacity_then_waits():
+    bucket = TokenBucket(60, period=60.0)
+    assert bucket.wait_time(60) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(30) == pytest.approx(30.0, abs=0.1)
+
+
+def test_bucket_never_exceeds_capacity():
+    bucket = TokenBucket(100)
+    bucket.give_back(500)
+    assert bucket.level == 100
+    # Requests larger than the bucket are capped instead of waiting forever
+    assert bucket.wait_time(1000) == 0.0
+
+
+def test_sync_only_lowers_the_level_and_adopts_the_limit():
+    bucket = TokenBucket(100)
+    bucket.sync(remaining=40)
+    assert bucket.level == pytest.approx(40, abs=1)
+    bucket.sync(remaining=90, limit=200)
+    assert bucket.capacity == 200 and bucket.level < 90
+
+
+def test_parse_duration():
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("1.5s") == 1.5
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("") == 0.0
+
+
+# -----------------------------
+# Scheduler
+# -----------------------------
+def test_streamed_call_refunds_unused_budget():
+    scheduler = RateLimitScheduler(rpm=100, tpm=100_000)
+    usage = SimpleNamespace(prompt_tokens=300, completion_tokens=120, total_tokens=420)
+    request = story_request("gpt-4o-mini", 0.5, DEFAULT_CFG)
+    assert estimate_tokens(request) > 1000
+
+    data, _, _ = run_completion(StreamingClient(usage), request, on_update=lambda partial: None,
+                                scheduler=scheduler, coalesce=False)
+    assert data["title_hook"] == "Hook"
+    # Charged the real 420 tokens, not the up-front estimate
+    assert scheduler.tokens.level == pytest.approx(100_000 - 420, abs=5)
+
+
+def test_streamed_call_without_usage_is_settled_from_the_text():
+    scheduler = RateLimitScheduler(rpm=100, tpm=100_000)
+    request = story_request("gpt-4o-mini", 0.5, DEFAULT_CFG)
+    run_completion(StreamingClient(None), request, on_update=lambda partial: None, scheduler=scheduler,
+                   coalesce=False)
+    assert 100_000 - scheduler.tokens.level < estimate_tokens(request) - 1000
+
+
+def test_acquire_stops_waiting_when_cancelled():
+    scheduler = RateLimitScheduler(rpm=1, tpm=100_000)
+    scheduler.acquire(10)
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    started = time.monotonic()
+    with pytest.raises(GenerationCancelled):
+        scheduler.acquire(10, cancel)  # the next request slot is a minute away
+    assert time.monotonic() - started < 1.0
+    assert scheduler.tokens.level == pytest.approx(100_000 - 10, abs=5)
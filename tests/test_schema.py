@@ -0,0 +1,87 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from story_core import DEFAULT_CFG, run_completion, week_plan_request
+from story_schema import SCHEMAS, ValidationStats, api_request, response_format, schema_name, validate
+
+DAY = {"day": "Mo", "goal": "g", "topic": "t", "hook": "h", "slides_outline": ["a"], "interaction": "i", "cta": "c"}
+PLAN = {"week_theme": "w", "days": [DAY], "safety_note": "n"}
+
+
+def test_valid_plan_has_no_problems():
+    assert validate("week_plan", PLAN) == []
+
+
+def test_problems_name_the_field():
+    plan = dict(PLAN, days=[dict(DAY, goal=1, slides_outline=["a", 2], extra=1)])
+    del plan["safety_note"]
+    assert validate("week_plan", plan) == [
+        "safety_note: fehlt",
+        "days[0].goal: Text erwartet",
+        "days[0].slides_outline[1]: Text erwartet",
+        "days[0].extra: unerwartetes Feld",
+    ]
+
+
+def test_answer_must_be_an_object():
+    assert validate("story", []) == ["Antwort: Objekt erwartet"]
+
+
+@pytest.mark.parametrize("value, problem", [
+    (True, "slides[0].slide_no: Zahl erwartet"),  # bool is no integer here
+    ("1", "slides[0].slide_no: Zahl erwartet"),
+])
+def test_integer_fields(value, problem):
+    story = {"slides": [{"slide_no": value}]}
+    assert problem in validate("story", story)
+
+
+def test_enum_is_checked():
+    story = {"poll_or_question": {"type": "umfrage", "prompt": "p", "options": []}}
+    assert "poll_or_question.type: ungültiger Wert 'umfrage'" in validate("story", story)
+
+
+def test_response_format_round_trip():
+    request = {"response_format": response_format("viral_story")}
+    assert schema_name(request) == "viral_story"
+    assert request["response_format"]["json_schema"]["schema"] is SCHEMAS["viral_story"]
+    assert schema_name({"response_format": {"type": "json_object"}}) is None
+
+
+def test_models_without_structured_outputs_get_json_object():
+    request = week_plan_request("gpt-3.5-turbo", 0.5, DEFAULT_CFG)
+    assert api_request(request)["response_format"] == {"type": "json_object"}
+    assert schema_name(request) == "week_plan"  # still validated locally
+    strict = week_plan_request("gpt-4o-mini", 0.5, DEFAULT_CFG)
+    assert api_request(strict) is strict
+
+
+def test_json_object_answers_are_validated_and_retried():
+    sent = []
+    answers = iter([{"week_theme": "w"}, PLAN])
+
+    def create(**request):
+        sent.append(request["response_format"])
+        message = SimpleNamespace(content=json.dumps(next(answers)))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    data, _, _ = run_completion(client, week_plan_request("gpt-3.5-turbo", 0.5, DEFAULT_CFG), coalesce=False)
+    assert data == PLAN
+    assert sent == [{"type": "json_object"}] * 2
+
+
+def test_stats_rates():
+    stats = ValidationStats()
+    stats.record("story")
+    stats.record("story", calls=2, invalid=1)
+    stats.record("story", calls=2, invalid=2, failed=True)
+    snap = stats.snapshot()["story"]
+    assert (snap["requests"], snap["calls"], snap["invalid"], snap["retries"], snap["failed"]) == (3, 5, 3, 2, 1)
+    assert snap["invalid_rate"] == 0.6
+    assert snap["retry_rate"] == 0.6667
+    assert snap["failure_rate"] == 0.3333
+    stats.reset()
+    assert stats.snapshot() == {}
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from story_metrics import MetricsRegistry
+from story_singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flights = SingleFlight(MetricsRegistry())
+    release, calls, results = threading.Event(), [], []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "story"
+
+    def caller():
+        results.append(flights.do("key", fn))
+
+    threads = [threading.Thread(target=caller) for _ in range(4)]
+    for t in threads:
+        t.start()
+    while sum(flights.in_flight().values()) < 3:
+        pass
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert sorted(results) == [("story", False)] + [("story", True)] * 3
+    assert flights.in_flight() == {}
+
+
+def test_sequential_calls_are_not_shared():
+    flights = SingleFlight(MetricsRegistry())
+    assert flights.do("key", lambda: 1) == (1, False)
+    assert flights.do("key", lambda: 2) == (2, False)
+
+
+def test_failure_is_not_shared():
+    flights = SingleFlight(MetricsRegistry())
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("quota")
+
+    def leader():
+        with pytest.raises(RuntimeError):
+            flights.do("key", failing)
+
+    def waiter():
+        results.append(flights.do("key", lambda: "own"))
+
+    first = threading.Thread(target=leader)
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=waiter)
+    second.start()
+    while not flights.in_flight().get("key"):
+        pass
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert results == [("own", False)]